@@ -0,0 +1,68 @@
+#
+# Benchmark relative horizontal accuracy edge extraction: the 3x3 binary
+# erosion (erode3x3/edgeMask) against the original convolve2d formulation.
+#
+#   python3 benchmarks/bench_edges.py [--sizes 512 1024 2048 4096] [--repeat 3]
+#
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from scipy.signal import convolve2d
+
+from synthetic import syntheticSurface
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from core3dmetrics.geometrics.relative_accuracy_metrics import erode3x3, edgeMask
+
+
+# original convolve2d edge extraction
+def convolveEdges(refMask, testMask, validMask):
+    kernel = np.ones((3, 3), int)
+    refEdge = convolve2d(refMask.astype(int), kernel, mode="same", boundary="symm")
+    testEdge = convolve2d(testMask.astype(int), kernel, mode="same", boundary="symm")
+    validEdge = convolve2d(validMask.astype(int), kernel, mode="same", boundary="symm")
+    refEdge = (refEdge < 9) & refMask & (validEdge == 9)
+    testEdge = (testEdge < 9) & testMask & (validEdge == 9)
+    return refEdge, testEdge
+
+
+def erosionEdges(refMask, testMask, validMask):
+    validInterior = erode3x3(validMask)
+    return edgeMask(refMask, validInterior), edgeMask(testMask, validInterior)
+
+
+# best of "repeat" runs: (seconds, result)
+def timeit(func, repeat, *args):
+    best, result = np.inf, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='edge extraction benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048, 4096])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(args)
+
+    print('{:>6} {:>14} {:>14} {:>9} {:>10}'.format('size', 'convolve2d (s)', 'erosion (s)', 'speedup', 'identical'))
+    for size in args.sizes:
+        dsm, dtm, ndx = syntheticSurface((size, size))
+        refMask = ndx > 0
+        testMask = np.roll(refMask, (2, -3), axis=(0, 1))
+        validMask = np.ones(refMask.shape, bool)
+        validMask[:size // 16] = False
+
+        tconv, expected = timeit(convolveEdges, args.repeat, refMask, testMask, validMask)
+        terode, result = timeit(erosionEdges, args.repeat, refMask, testMask, validMask)
+        identical = all(np.array_equal(a, b) for a, b in zip(expected, result))
+        print('{:>6} {:>14.4f} {:>14.4f} {:>8.1f}x {:>10}'.format(size, tconv, terode, tconv / terode, str(identical)))
+
+
+if __name__ == '__main__':
+    main()
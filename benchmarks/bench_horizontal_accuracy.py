@@ -0,0 +1,50 @@
+#
+# Benchmark nearest test edge search for relative horizontal accuracy:
+# KD tree against Euclidean distance transform, for clean and noisy test models.
+#
+#   python3 benchmarks/bench_horizontal_accuracy.py [--sizes 1024 2048 4096] [--noise 0 0.01 0.05]
+#
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+from synthetic import syntheticSurface
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from core3dmetrics.geometrics.relative_accuracy_metrics import (
+    HORIZONTAL_ACCURACY_METHODS, edgeMask, nearestEdgeDistance)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='horizontal accuracy benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048, 4096])
+    parser.add_argument('--noise', type=float, nargs='+', default=[0, 0.01, 0.05],
+                        help='fraction of test pixels with flipped labels')
+    args = parser.parse_args(args)
+
+    rng = np.random.RandomState(0)
+    print('{:>6} {:>6} {:>12} {:>20} {:>10} {:>10}'.format(
+        'size', 'noise', 'test edges', 'method', 'time (s)', 'h90 (px)'))
+    for size in args.sizes:
+        dsm, dtm, ndx = syntheticSurface((size, size))
+        refMask = ndx > 0
+        refEdge = edgeMask(refMask)
+
+        for noise in args.noise:
+            testMask = np.roll(refMask, (2, -3), axis=(0, 1))
+            testMask ^= rng.rand(size, size) < noise
+            testEdge = edgeMask(testMask)
+
+            for method in HORIZONTAL_ACCURACY_METHODS:
+                start = time.perf_counter()
+                dist, _ = nearestEdgeDistance(refEdge, testEdge, method)
+                elapsed = time.perf_counter() - start
+                print('{:>6} {:>6} {:>12} {:>20} {:>10.3f} {:>10.3f}'.format(
+                    size, noise, np.count_nonzero(testEdge), method, elapsed, np.percentile(dist, 90)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#
+# Benchmark package import time: a fresh interpreter imports
+# core3dmetrics.geometrics and accesses the names of each scenario, reporting
+# the best wall time and the heavy dependencies loaded. Exits with an error if
+# the light scenario exceeds the budget.
+#
+#   python3 benchmarks/bench_import.py [--repeat 5] [--budget 1.0]
+#
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+HEAVY_MODULES = ('gdal', 'osgeo', 'scipy', 'matplotlib', 'jsonschema', 'pkg_resources')
+
+# scenario name: names accessed after import
+SCENARIOS = (
+    ('light', 'geo.calcMops'),
+    ('config', 'geo.parse_config'),
+    ('threshold geometry', 'geo.run_threshold_geometry_metrics'),
+    ('raster io', 'geo.imageWarp'),
+    ('relative accuracy', 'geo.run_relative_accuracy_metrics'),
+    ('plots', 'geo.plot'),
+    ('everything', 'from core3dmetrics.geometrics import *'),
+)
+
+
+# (seconds, heavy modules loaded) of one fresh interpreter
+def profile(code):
+    script = ('import sys, time, json\n'
+        't = time.perf_counter()\n'
+        'import core3dmetrics.geometrics as geo\n'
+        + code + '\n'
+        'print(json.dumps([time.perf_counter() - t, sorted(m for m in {} if m in sys.modules)]))\n').format(HEAVY_MODULES)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.check_output([sys.executable, '-c', script], env=env)
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='package import time benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0, help='light scenario budget (seconds)')
+    args = parser.parse_args(args)
+
+    print('{:>20} {:>10}  {}'.format('scenario', 'time (s)', 'heavy modules'))
+    results = {}
+    for name, code in SCENARIOS:
+        try:
+            runs = [profile(code) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError:
+            print('{:>20} {:>10}  {}'.format(name, 'failed', '(missing dependency?)'))
+            continue
+        results[name] = min(r[0] for r in runs)
+        print('{:>20} {:>10.3f}  {}'.format(name, results[name], ', '.join(runs[0][1]) or '-'))
+
+    if results.get('light', 0) > args.budget:
+        print('\nLight import exceeds the {:.2f} s budget'.format(args.budget))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
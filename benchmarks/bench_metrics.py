@@ -0,0 +1,174 @@
+#
+# Benchmark the metric functions and the end-to-end evaluation on synthetic
+# AOIs (see synthetic.syntheticAOI) across sizes, reporting the best wall time
+# and the peak traced (Python/NumPy) memory allocated by each benchmark.
+# Results may be saved as JSON and compared against a saved baseline, exiting
+# with an error on regressions beyond the tolerance.
+#
+#   python3 benchmarks/bench_metrics.py [--sizes 512 1024 2048] [--repeat 3]
+#       [--json results.json] [--baseline baseline.json] [--tolerance 0.25]
+#
+# imageWarp and the end-to-end run_geometrics benchmarks write the AOI as
+# GeoTIFFs, and are skipped when GDAL is unavailable.
+#
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+
+from synthetic import syntheticAOI, writeAOI, CLS_BUILDING, MATERIAL_NAMES, MATERIAL_INDICES_TO_IGNORE
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from core3dmetrics.geometrics.profiling import StageProfiler
+
+
+BENCHMARKS = ('threshold_geometry', 'relative_accuracy', 'terrain_accuracy', 'material', 'image_warp', 'end_to_end')
+
+
+def hasGDAL():
+    try:
+        import gdal
+    except ImportError:
+        return False
+    return hasattr(gdal, 'Warp')
+
+
+# Benchmark functions of one AOI (name: function of no arguments)
+def aoiBenchmarks(reference, test, gsd, folder=None):
+    from core3dmetrics.geometrics.threshold_geometry_metrics import run_threshold_geometry_metrics
+    from core3dmetrics.geometrics.relative_accuracy_metrics import run_relative_accuracy_metrics
+    from core3dmetrics.geometrics.terrain_accuracy_metrics import run_terrain_accuracy_metrics
+    from core3dmetrics.geometrics.threshold_material_metrics import run_material_metrics
+
+    tform = [0, gsd, 0, 0, 0, -gsd]
+    refMask = reference['CLS'] == CLS_BUILDING
+    testMask = test['CLS'] == CLS_BUILDING
+    ignoreMask = np.zeros(refMask.shape, bool)
+
+    benchmarks = {
+        'threshold_geometry': lambda: run_threshold_geometry_metrics(reference['DSM'], reference['DTM'], refMask,
+            test['DSM'], test['DTM'], testMask, tform, ignoreMask),
+        'relative_accuracy': lambda: run_relative_accuracy_metrics(reference['DSM'], test['DSM'], refMask,
+            testMask, ignoreMask, gsd),
+        'terrain_accuracy': lambda: run_terrain_accuracy_metrics(reference['DTM'], test['DTM'], refMask),
+        'material': lambda: run_material_metrics(reference['NDX'], reference['MTL'], test['MTL'],
+            MATERIAL_NAMES, MATERIAL_INDICES_TO_IGNORE),
+    }
+
+    if folder is not None:
+        from core3dmetrics.geometrics.image import imageWarp
+        from core3dmetrics.run_geometrics import run_geometrics
+
+        configfile = writeAOI(folder, reference, test, gsd)
+        outputpath = os.path.join(folder, 'output')
+        os.makedirs(outputpath, exist_ok=True)
+
+        # sub-pixel registration offset, so the test DSM is resampled
+        benchmarks['image_warp'] = lambda: imageWarp(os.path.join(folder, 'test-DSM.tif'),
+            os.path.join(folder, 'ref-CLS.tif'), offset=(0.3 * gsd, 0.2 * gsd, 0))
+        benchmarks['end_to_end'] = lambda: run_geometrics(configfile, outputpath=outputpath,
+            align=False, use_cache=False)
+
+    return benchmarks
+
+
+# best wall time of "repeat" runs, and the peak traced memory (bytes) & peak
+# RSS of a separate run (memory tracing slows the timed runs)
+def measure(func, repeat):
+    best = np.inf
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+
+    profiler = StageProfiler()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with profiler.stage('run'):
+                func()
+    finally:
+        profiler.close()
+    record = profiler.stages[0]
+    return best, record['peak_traced'], record['peak_rss']
+
+
+# Regressions of results relative to a baseline: (name, size, quantity,
+# baseline, result) where time or peak memory grew by more than "tolerance"
+def compareBaseline(results, baseline, tolerance):
+    previous = {(r['benchmark'], r['size']): r for r in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get((result['benchmark'], result['size']))
+        if base is None:
+            continue
+        for key in ('time', 'peak_traced'):
+            if base.get(key) and result.get(key) and result[key] > base[key] * (1 + tolerance):
+                regressions.append((result['benchmark'], result['size'], key, base[key], result[key]))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='metrics benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--gsd', type=float, default=0.5)
+    parser.add_argument('--noise', type=float, default=0.1, help='test height noise (m)')
+    parser.add_argument('--shift', type=float, nargs=3, default=[1.5, -2.25, 0.3], metavar=('ROWS', 'COLS', 'DZ'),
+        help='test model displacement (pixels, pixels, meters)')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--json', help='save results to a JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+        help='allowed relative increase of time & peak memory over the baseline')
+    args = parser.parse_args(args)
+
+    gdalBenchmarks = [name for name in ('image_warp', 'end_to_end') if name in args.benchmarks]
+    if gdalBenchmarks and not hasGDAL():
+        print('GDAL not available, skipping {}'.format(', '.join(gdalBenchmarks)))
+        args.benchmarks = [name for name in args.benchmarks if name not in gdalBenchmarks]
+        gdalBenchmarks = []
+
+    results = []
+    print('{:>6} {:>20} {:>10} {:>10} {:>12}'.format('size', 'benchmark', 'time (s)', 'Mpix/s', 'peak (MB)'))
+    for size in args.sizes:
+        reference, test = syntheticAOI((size, size), gsd=args.gsd, noise=args.noise,
+            shift=tuple(args.shift))
+        folder = tempfile.mkdtemp(prefix='core3dmetrics-bench-') if gdalBenchmarks else None
+        try:
+            benchmarks = aoiBenchmarks(reference, test, args.gsd, folder)
+            for name in args.benchmarks:
+                seconds, peak, rss = measure(benchmarks[name], args.repeat)
+                results.append({'benchmark': name, 'size': size, 'time': seconds,
+                    'peak_traced': peak, 'peak_rss': rss})
+                print('{:>6} {:>20} {:>10.4f} {:>10.2f} {:>12.1f}'.format(size, name, seconds,
+                    size * size / seconds / 1e6, (peak or 0) / 2**20))
+        finally:
+            if folder is not None:
+                shutil.rmtree(folder, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as fid:
+            json.dump(results, fid, indent=2)
+        print('Results saved to <{}>'.format(args.json))
+
+    if args.baseline:
+        with open(args.baseline, 'r') as fid:
+            regressions = compareBaseline(results, json.load(fid), args.tolerance)
+        for name, size, key, base, result in regressions:
+            print('REGRESSION: {} size {} {}: {:.4g} -> {:.4g} ({:+.0%})'.format(name, size, key, base, result,
+                result / base - 1))
+        if regressions:
+            sys.exit(1)
+        print('No regressions (tolerance {:.0%})'.format(args.tolerance))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#
+# Benchmark in-process registration (estimateXYZoffset) on synthetic shifted DSMs,
+# optionally comparing against the align3d executable when available.
+#
+#   python3 benchmarks/bench_registration.py [--sizes 512 1024 2048] [--align3d]
+#
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+from synthetic import syntheticSurface, shiftedSurface
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from core3dmetrics.geometrics.registration import estimateXYZoffset
+
+
+# (drow, dcol, dz) test displacements
+SHIFTS = [(3, -7, 1.5), (10.4, 4.7, -2.0), (-1.3, 0.6, 0.2), (-6.5, -12.25, 0.0)]
+
+
+def writeGeotiff(filename, img, tform):
+    import gdal
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(filename, img.shape[1], img.shape[0], 1, gdal.GDT_Float32)
+    dataset.SetGeoTransform(tform)
+    dataset.GetRasterBand(1).WriteArray(img)
+    dataset = None
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='registration benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--gsd', type=float, default=0.5)
+    parser.add_argument('--noise', type=float, default=0.1, help='test height noise (m)')
+    parser.add_argument('--align3d', action='store_true', help='compare against align3d executable')
+    args = parser.parse_args(args)
+
+    if args.align3d and shutil.which('align3d') is None:
+        print('align3d executable not found on $PATH, skipping comparison')
+        args.align3d = False
+
+    print('{:>6} {:>28} {:>10} {:>10} {:>10}'.format('size', 'shift (row,col,dz)', 'method', 'time (s)', 'xy err (m)'))
+    for size in args.sizes:
+        tform = [0, args.gsd, 0, 0, 0, -args.gsd]
+        dsm, dtm, ndx = syntheticSurface((size, size), gsd=args.gsd)
+
+        for drow, dcol, dz in SHIFTS:
+            test = shiftedSurface(dsm, drow, dcol, dz, noise=args.noise)
+            truth = np.array([dcol * tform[1], drow * tform[5], dz])
+
+            results = []
+            start = time.perf_counter()
+            offset = estimateXYZoffset(dsm, test, tform)
+            results.append(('inprocess', time.perf_counter() - start, offset))
+
+            if args.align3d:
+                from core3dmetrics.geometrics.registration import align3d
+                with tempfile.TemporaryDirectory() as folder:
+                    refFile = os.path.join(folder, 'ref.tif')
+                    testFile = os.path.join(folder, 'test.tif')
+                    writeGeotiff(refFile, dsm, tform)
+                    writeGeotiff(testFile, test, tform)
+                    start = time.perf_counter()
+                    offset = align3d(refFile, testFile)
+                    results.append(('align3d', time.perf_counter() - start, offset))
+
+            for method, elapsed, offset in results:
+                err = np.asarray(offset) - truth
+                print('{:>6} {:>28} {:>10} {:>10.3f} {:>10.3f}   dz err {:.3f}'.format(
+                    size, str((drow, dcol, dz)), method, elapsed, np.hypot(err[0], err[1]), err[2]))
+
+
+if __name__ == '__main__':
+    main()
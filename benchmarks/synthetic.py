@@ -0,0 +1,196 @@
+#
+# Synthetic reference/test surfaces and AOIs for benchmarking.
+#
+#   python3 benchmarks/synthetic.py <output folder> [--size 1024 1024] [--noise 0.1]
+#
+
+import os
+import json
+import argparse
+import numpy as np
+from scipy import ndimage
+
+
+# Smooth terrain with rectangular buildings of random size & height.
+# Returns DSM, DTM and building index (NDX, 0 = no building) arrays.
+def syntheticSurface(shape, gsd=0.5, buildingDensity=0.002, seed=0):
+    rng = np.random.RandomState(seed)
+    nrows, ncols = shape
+
+    # terrain: low frequency noise, a few meters of relief
+    terrain = ndimage.gaussian_filter(rng.normal(0, 1, shape), sigma=max(shape) / 16)
+    terrain = 100 + 5 * terrain / (np.abs(terrain).max() or 1)
+    dtm = terrain.astype(np.float32)
+
+    # buildings
+    dsm = dtm.copy()
+    ndx = np.zeros(shape, np.uint16)
+    numBuildings = max(1, int(buildingDensity * nrows * ncols))
+    for label in range(1, numBuildings + 1):
+        h, w = (rng.uniform(8, 40, size=2) / gsd).astype(int)
+        y, x = rng.randint(0, max(1, nrows - h)), rng.randint(0, max(1, ncols - w))
+        footprint = np.s_[y:y+h, x:x+w]
+        dsm[footprint] = dtm[footprint].max() + rng.uniform(3, 30)
+        ndx[footprint] = label
+
+    return dsm, dtm, ndx
+
+
+# Test DSM displaced from a reference DSM by (drow, dcol) pixels and dz meters,
+# such that estimateXYZoffset should recover shift (drow, dcol) and offset dz,
+# with optional additive height noise (meters)
+def shiftedSurface(dsm, drow, dcol, dz, noise=0.0, seed=0):
+    rng = np.random.RandomState(seed)
+    test = ndimage.shift(dsm, (-drow, -dcol), order=1, mode='nearest') - dz
+    if noise:
+        test = test + rng.normal(0, noise, dsm.shape)
+    return test.astype(np.float32)
+
+
+# classification values (ASPRS LAS classes, as the CORE3D CLS products)
+CLS_GROUND = 2
+CLS_VEGETATION = 5
+CLS_BUILDING = 6
+
+# material labels (see aoi-example configurations)
+MATERIAL_NAMES = ['Unclassified', 'Asphalt', 'Concrete/Stone', 'Glass', 'Tree', 'Non-tree vegetation',
+    'Metal', 'Ceramic', 'Soil', 'Solar panel', 'Water', 'Polymer', 'Unscored', 'Indeterminate']
+MATERIAL_INDICES_TO_IGNORE = [0, 12, 13]
+ROOF_MATERIALS = [2, 3, 6, 7, 9, 11]
+GROUND_MATERIALS = [1, 8]
+
+
+# Synthetic AOI: reference and test models of the same scene, as dicts of
+# DSM, DTM, CLS, NDX (reference only) and MTL arrays.
+#   Reference: terrain & buildings (syntheticSurface), trees, a CLS map with
+#   ground/vegetation/building classes, and roof/ground materials.
+#   Test: the reference displaced by "shift" (rows, cols, meters), with
+#   "missRate" of buildings missed, "falseRate" (relative to the building
+#   count) spurious buildings, gaussian height "noise" (meters) and
+#   "labelNoise" fraction of pixels with random materials.
+def syntheticAOI(shape, gsd=0.5, buildingDensity=0.0001, treeDensity=0.0003, noise=0.1,
+                 shift=(0, 0, 0), missRate=0.1, falseRate=0.05, labelNoise=0.05, seed=0):
+    rng = np.random.RandomState(seed + 1)
+    nrows, ncols = shape
+    dsm, dtm, ndx = syntheticSurface(shape, gsd, buildingDensity, seed)
+
+    # trees: round canopies on open ground
+    cls = np.full(shape, CLS_GROUND, np.uint8)
+    cls[ndx > 0] = CLS_BUILDING
+    numTrees = int(treeDensity * nrows * ncols)
+    rows, cols = np.ogrid[:nrows, :ncols]
+    for _ in range(numTrees):
+        r = rng.uniform(2, 6) / gsd
+        y, x = rng.randint(0, nrows), rng.randint(0, ncols)
+        box = np.s_[max(0, int(y-r)):int(y+r)+1, max(0, int(x-r)):int(x+r)+1]
+        canopy = ((rows[box[0]] - y)**2 + (cols[:, box[1]] - x)**2 <= r**2) & (ndx[box] == 0)
+        height = dtm[box] + rng.uniform(5, 15)
+        dsm[box][canopy] = np.maximum(dsm[box], height)[canopy]
+        cls[box][canopy] = CLS_VEGETATION
+
+    # materials: roofs by building, ground in alternating blocks, trees
+    mtl = np.where((rows // 64 + cols // 64) % 2, GROUND_MATERIALS[0], GROUND_MATERIALS[1]).astype(np.uint8)
+    roof = np.asarray(rng.choice(ROOF_MATERIALS, int(ndx.max()) + 1), np.uint8)
+    mtl[ndx > 0] = roof[ndx[ndx > 0]]
+    mtl[cls == CLS_VEGETATION] = 4
+
+    reference = {'DSM': dsm, 'DTM': dtm, 'CLS': cls, 'NDX': ndx, 'MTL': mtl}
+
+    # test model: missed & spurious buildings
+    testDSM, testCLS, testMTL = dsm.copy(), cls.copy(), mtl.copy()
+    labels = np.arange(1, int(ndx.max()) + 1)
+    missed = np.isin(ndx, labels[rng.rand(labels.size) < missRate])
+    testDSM[missed] = dtm[missed]
+    testCLS[missed] = CLS_GROUND
+    testMTL[missed] = GROUND_MATERIALS[0]
+
+    for _ in range(int(falseRate * labels.size)):
+        h, w = (rng.uniform(8, 30, size=2) / gsd).astype(int)
+        y, x = rng.randint(0, max(1, nrows - h)), rng.randint(0, max(1, ncols - w))
+        box = np.s_[y:y+h, x:x+w]
+        testDSM[box] = dtm[box].max() + rng.uniform(3, 20)
+        testCLS[box] = CLS_BUILDING
+        testMTL[box] = rng.choice(ROOF_MATERIALS)
+
+    # material label noise
+    flip = rng.rand(nrows, ncols) < labelNoise
+    testMTL[flip] = rng.choice(ROOF_MATERIALS + GROUND_MATERIALS, int(flip.sum()))
+
+    # displacement & height noise
+    drow, dcol, dz = shift
+    testDTM = dtm
+    if drow or dcol or dz:
+        testDSM = shiftedSurface(testDSM, drow, dcol, dz)
+        testDTM = shiftedSurface(dtm, drow, dcol, dz)
+        testCLS = ndimage.shift(testCLS, (-drow, -dcol), order=0, mode='nearest')
+        testMTL = ndimage.shift(testMTL, (-drow, -dcol), order=0, mode='nearest')
+    if noise:
+        testDSM = (testDSM + rng.normal(0, noise, shape)).astype(np.float32)
+        testDTM = (testDTM + rng.normal(0, noise, shape)).astype(np.float32)
+
+    test = {'DSM': testDSM, 'DTM': testDTM.astype(np.float32), 'CLS': testCLS, 'MTL': testMTL}
+    return reference, test
+
+
+# Write a synthetic AOI as GeoTIFFs (UTM "epsg" projection, upper left corner
+# "origin", pixel size "gsd") with a configuration file for run_geometrics.
+# Returns the configuration filename.
+def writeAOI(folder, reference, test, gsd=0.5, origin=(500000.0, 4000000.0), epsg=32617):
+    import gdal
+    import osr
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    tform = [origin[0], gsd, 0, origin[1], 0, -gsd]
+    types = {np.dtype(np.float32): gdal.GDT_Float32, np.dtype(np.uint8): gdal.GDT_Byte,
+        np.dtype(np.uint16): gdal.GDT_UInt16}
+
+    os.makedirs(folder, exist_ok=True)
+    driver = gdal.GetDriverByName('GTiff')
+    files = {}
+    for prefix, model in (('ref', reference), ('test', test)):
+        for key, img in model.items():
+            filename = os.path.join(folder, '{}-{}.tif'.format(prefix, key))
+            img = np.asarray(img)
+            dataset = driver.Create(filename, img.shape[1], img.shape[0], 1, types[img.dtype],
+                options=['TILED=YES'])
+            dataset.SetGeoTransform(tform)
+            dataset.SetProjection(srs.ExportToWkt())
+            dataset.GetRasterBand(1).WriteArray(img)
+            dataset = None
+            files[prefix, key] = os.path.basename(filename)
+
+    config = {
+        'INPUT.REF': dict({key + 'Filename': files['ref', key] for key in reference},
+            CLSMatchValue=[[CLS_BUILDING]]),
+        'INPUT.TEST': dict({key + 'Filename': files['test', key] for key in test},
+            CLSMatchValue=[[CLS_BUILDING]]),
+        'OPTIONS': {'QuantizeHeight': False},
+        'PLOTS': {'ShowPlots': False, 'SavePlots': False},
+        'MATERIALS.REF': {'MaterialNames': MATERIAL_NAMES,
+            'MaterialIndicesToIgnore': MATERIAL_INDICES_TO_IGNORE},
+    }
+    configfile = os.path.join(folder, 'aoi.json')
+    with open(configfile, 'w') as fid:
+        json.dump(config, fid, indent=2)
+    return configfile
+
+
+# command line: write a synthetic AOI
+def main(args=None):
+    parser = argparse.ArgumentParser(description='synthetic AOI generator')
+    parser.add_argument('output', help='output folder')
+    parser.add_argument('--size', type=int, nargs=2, default=[1024, 1024], metavar=('ROWS', 'COLS'))
+    parser.add_argument('--gsd', type=float, default=0.5)
+    parser.add_argument('--noise', type=float, default=0.1, help='test height noise (m)')
+    parser.add_argument('--shift', type=float, nargs=3, default=[0, 0, 0], metavar=('ROWS', 'COLS', 'DZ'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(args)
+
+    reference, test = syntheticAOI(tuple(args.size), gsd=args.gsd, noise=args.noise,
+        shift=tuple(args.shift), seed=args.seed)
+    print(writeAOI(args.output, reference, test, gsd=args.gsd))
+
+
+if __name__ == '__main__':
+    main()
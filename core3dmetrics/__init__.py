@@ -1,5 +1,5 @@
-
-from . __main__ import main
-
-
-
+# command line entry point, imported on first call so that importing the
+# package (e.g. core3dmetrics.geometrics) does not load the full pipeline
+def main(args=None):
+    from .run_geometrics import main
+    return main(args)
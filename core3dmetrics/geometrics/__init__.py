@@ -1,14 +1,77 @@
+# Submodules are imported on first access to one of their names (PEP 562), so
+# importing the package is cheap: GDAL is only loaded for raster input/output,
+# matplotlib when plotting, and SciPy for relative accuracy, structure metrics
+# and in-process registration.
 
+import sys
+import types
+import importlib
 
-from .image import *
-from .plot import *
-from .config import *
-from .metrics_util import *
-from .threshold_material_metrics import *
-from .threshold_geometry_metrics import *
-from .registration import *
-from .relative_accuracy_metrics import *
-from .terrain_accuracy_metrics import *
 
+# public names of each submodule
+_exports = {
+    'image': ('WarpContext', 'imageLoad', 'getNoDataValue', 'getMetadata', 'openSource',
+        'imageWarp', 'WarpedRaster', 'loadConcurrent', 'tileWindows', 'arrayToGeotiff',
+        'LAS_CHUNK_POINTS', 'PointRasterizer', 'lasChunks', 'lasToRaster',
+        'POINT_CLOUD_EXTENSIONS', 'isPointCloud', 'pointCloudToGrid', 'fillHoles', 'map2pix'),
+    'plot': ('plot', 'renderFigure'),
+    'preview': ('PREVIEW_FORMATS', 'PREVIEW_BLOCK_ROWS', 'colormapLUT', 'colorize', 'writePNG',
+        'writeWorldFile', 'writeRGBGeotiff', 'writePreview', 'DECIMATION_METHODS', 'decimateImage'),
+    'config': ('SCHEMA_FILENAME', 'findfiles', 'parse_config'),
+    'metrics_util': ('calcMops', 'calcPercentiles', 'PercentileSketch', 'getUnitArea',
+        'getUnitHeight', 'getUnitWidth', 'validateMatchValues', 'getMatchValueSets', 'clsDecoderRing'),
+    'structure_index': ('StructureIndex', 'getStructures'),
+    'threshold_material_metrics': ('getStructureMaterials', 'run_material_metrics'),
+    'threshold_geometry_metrics': ('CHUNK_PIXELS', 'CLASS_PARTIALS', 'accumulate_threshold_geometry',
+        'finalize_threshold_geometry', 'accumulate_class_partials', 'class_partials_totals',
+        'run_threshold_geometry_metrics', 'run_threshold_geometry_metrics_batch'),
+    'registration': ('align3d', 'align3d_inprocess', 'estimateXYZoffset', 'shiftCost',
+        'downsampleDSM', 'readXYZoffset', 'getXYZoffsetFilename', 'unroot'),
+    'offset_cache': ('defaultCacheFilename', 'fileFingerprint', 'OffsetCache'),
+    'reference_cache': ('REFERENCE_CACHE_VERSION', 'MANIFEST_FILENAME', 'referenceSources',
+        'ReferenceCache'),
+    'scratch': ('ScratchArrays',),
+    'profiling': ('peakRSS', 'resetPeakRSS', 'StageProfiler'),
+    'relative_accuracy_metrics': ('HORIZONTAL_ACCURACY_METHODS', 'erode3x3', 'edgeMask',
+        'nearestEdgeDistance', 'run_relative_accuracy_metrics'),
+    'structure_metrics': ('STRUCTURE_COLUMNS', 'groupPercentiles', 'assignTestComponents',
+        'run_structure_metrics', 'writeStructureTable'),
+    'terrain_accuracy_metrics': ('run_terrain_accuracy_metrics', 'accumulate_terrain_accuracy',
+        'finalize_terrain_accuracy'),
+}
 
+# submodule of each public name
+_sources = {name: module for module, names in _exports.items() for name in names}
 
+__all__ = sorted(_sources)
+
+
+def __getattr__(name):
+    if name not in _sources:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    # import the submodule & bind all of its public names
+    module = importlib.import_module('.' + _sources[name], __name__)
+    for item in _exports[_sources[name]]:
+        globals()[item] = getattr(module, item)
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+# Importing a submodule binds it as an attribute of the package, which would
+# hide a public name of the same name (e.g. the "plot" class by the "plot"
+# submodule, whether imported by __getattr__ or directly). Bind the public
+# name instead.
+class _Package(types.ModuleType):
+
+    def __setattr__(self, name, value):
+        if isinstance(value, types.ModuleType) and _sources.get(name) == name \
+                and value.__name__ == '{}.{}'.format(__name__, name):
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+sys.modules[__name__].__class__ = _Package
@@ -5,12 +5,11 @@ import configparser
 import json
 import glob
 import collections
-import jsonschema
-import pkg_resources
 import ast
+import copy
 
-# module/package name
-resource_package = __name__
+# configuration schema, installed alongside this module
+SCHEMA_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config_schema.json')
 
 
 # HELPER: Locate absolute file path in dict via GLOB
@@ -50,7 +49,12 @@ def findfiles(data,path=None):
 
 
 # PARSE CONFIGURATION FILE
-def parse_config(configfile,refpath=None,testpath=None):
+# "reference" is an optional (parsed) reference configuration, whose INPUT.REF
+# section replaces that of the configuration file, and whose other sections
+# are used where missing from the configuration file (e.g. batch evaluation of
+# several test configurations against one reference).  With "require_test"
+# disabled, the INPUT.TEST section is optional (e.g. reference-only configuration).
+def parse_config(configfile,refpath=None,testpath=None,reference=None,require_test=True):
 
     print('\n=====CONFIGURATION=====')
 
@@ -65,8 +69,11 @@ def parse_config(configfile,refpath=None,testpath=None):
         raise IOError('"testpath" not a valid folder <{}>'.format(testpath))
 
     # create schema validator object (& check schema itself)
-    schema = json.loads(pkg_resources.resource_string(
-        resource_package, 'config_schema.json').decode('utf-8'))
+    import jsonschema
+    with open(SCHEMA_FILENAME, 'r') as fid:
+        schema = json.load(fid)
+    if not require_test:
+        schema['required'] = [s for s in schema['required'] if s != 'INPUT.TEST']
     validator = jsonschema.Draft4Validator(schema)
     validator.check_schema(schema)
     
@@ -93,30 +100,52 @@ def parse_config(configfile,refpath=None,testpath=None):
         config = {s:dict(parser.items(s)) for s in parser.sections()}   
 
         # special section/item parsing
-        s = 'INPUT.REF'; i = 'CLSMatchValue'; config[s][i] = ast.literal_eval(config[s][i])
-        s = 'INPUT.TEST'; i = 'CLSMatchValue'
-        if i in config[s]: # Optional Field
-            config[s][i] = ast.literal_eval(config[s][i])
-        else:
-            config[s][i] = config['INPUT.REF'][i]
+        # (sections may be missing when provided by a reference configuration)
+        for s in ('INPUT.REF','INPUT.TEST'):
+            i = 'CLSMatchValue'
+            if i in config.get(s,{}): config[s][i] = ast.literal_eval(config[s][i])
 
         # bool(config[s][i]) does not interpret 'true'/'false' strings
-        s = 'OPTIONS'; i = 'QuantizeHeight'; config[s][i] = parser.getboolean(s,i)  
-        s = 'PLOTS'; i = 'ShowPlots'; config[s][i] = parser.getboolean(s,i) 
-        s = 'PLOTS'; i = 'SavePlots'; config[s][i] = parser.getboolean(s,i)
-        s = 'MATERIALS.REF'; i = 'MaterialNames'; config[s][i] = config[s][i].split(',')
-        s = 'MATERIALS.REF'; i = 'MaterialIndicesToIgnore'; config[s][i] = [int(v) for v in config[s][i].split(',')]
+        if 'OPTIONS' in config:
+            s = 'OPTIONS'; i = 'QuantizeHeight'; config[s][i] = parser.getboolean(s,i)  
+            s = 'OPTIONS'; i = 'StructureMetrics'
+            if i in config[s]: # Optional Field
+                config[s][i] = parser.getboolean(s,i)
+        if 'PLOTS' in config:
+            s = 'PLOTS'; i = 'ShowPlots'; config[s][i] = parser.getboolean(s,i) 
+            s = 'PLOTS'; i = 'SavePlots'; config[s][i] = parser.getboolean(s,i)
+            s = 'PLOTS'; i = 'PreviewOverview'
+            if i in config[s]: # Optional Field
+                config[s][i] = parser.getint(s,i)
+        if 'MATERIALS.REF' in config:
+            s = 'MATERIALS.REF'; i = 'MaterialNames'; config[s][i] = config[s][i].split(',')
+            s = 'MATERIALS.REF'; i = 'MaterialIndicesToIgnore'; config[s][i] = [int(v) for v in config[s][i].split(',')]
 
     # unrecognized config file type
     else:
         raise IOError('Unrecognized configuration file')
 
+    # reference configuration
+    if reference is not None:
+        if 'INPUT.REF' in config:
+            print('WARNING: [INPUT.REF] replaced by reference configuration')
+        for sec in reference:
+            if sec == 'INPUT.REF' or sec not in config:
+                config[sec] = copy.deepcopy(reference[sec])
+
+    # test CLS match values default to the reference values (.config files)
+    if configfile.endswith(('.config','.CONFIG')) and 'INPUT.TEST' in config:
+        s = 'INPUT.TEST'; i = 'CLSMatchValue'
+        if i not in config[s]: # Optional Field
+            config[s][i] = config['INPUT.REF'][i]
+
 
     # locate files for each "xxxFilename" configuration parameter
     # this makes use of "refpath" and "testpath" arguments for relative filenames
     # we do this before validation to ensure required files are located
     for item in [('INPUT.REF',refpath),('INPUT.TEST',testpath)]:
         sec = item[0]; path = item[1]
+        if sec not in config: continue
         print('\nPROCESSING "{}" FILES'.format(sec))
         config[sec] = findfiles(config[sec],path)
 
@@ -140,6 +169,7 @@ def parse_config(configfile,refpath=None,testpath=None):
 
     for opt in opts:
         s = opt[0]; i = opt[1];
+        if s not in config: continue
         try:
             _ = (v for v in config[s][i])
         except:
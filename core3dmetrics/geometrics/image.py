@@ -1,10 +1,80 @@
 import os
+import time
+import threading
+import concurrent.futures
 import gdal
 import numpy as np
 
 
+# Destination grid for warping, built once from a reference file (e.g. the
+# reference CLS image) and passed in place of the destination filename to
+# imageWarp/WarpedRaster, so its metadata is only read and parsed once.
+# Metadata & no data values of files opened through the context are cached,
+# and dataset handles are reused within each thread (avoiding repeated open
+# costs on network-mounted files). GDAL datasets are not thread-safe, so
+# concurrent loads (see loadConcurrent) never share a handle.
+class WarpContext:
+
+    def __init__(self, file_dst):
+        self.filename = file_dst
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._handles = []
+        self._meta = {}
+        self.meta = self.metadata(file_dst)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # read-only dataset handle, cached for the calling thread
+    def open(self, filename):
+        datasets = getattr(self._local, 'datasets', None)
+        if datasets is None:
+            datasets = self._local.datasets = {}
+            with self.lock:
+                self._handles.append(datasets)
+
+        dataset = datasets.get(filename)
+        if dataset is None:
+            if not os.path.isfile(filename):
+                raise IOError('Cannot locate file <{}>'.format(filename))
+            dataset = gdal.Open(filename, gdal.GA_ReadOnly)
+            datasets[filename] = dataset
+        return dataset
+
+    # cached metadata (see getMetadata) & no data value of a file
+    def _cached(self, filename):
+        with self.lock:
+            cached = self._meta.get(filename)
+        if cached is None:
+            dataset = self.open(filename)
+            cached = (getMetadata(dataset), getNoDataValue(dataset))
+            with self.lock:
+                cached = self._meta.setdefault(filename, cached)
+        return cached
+
+    def metadata(self, filename):
+        meta = dict(self._cached(filename)[0])
+        meta['GeoTransform'] = list(meta['GeoTransform'])
+        return meta
+
+    def getNoDataValue(self, filename):
+        return self._cached(filename)[1]
+
+    # release the dataset handles of all threads
+    def close(self):
+        with self.lock:
+            for datasets in self._handles:
+                datasets.clear()
+            self._handles = []
+        self._local = threading.local()
+
+
 def imageLoad(filename):
-    im = gdal.Open(filename, gdal.GA_ReadOnly)
+    im = filename if isinstance(filename, gdal.Dataset) else gdal.Open(filename, gdal.GA_ReadOnly)
     band = im.GetRasterBand(1)
     img = band.ReadAsArray(0, 0, im.RasterXSize, im.RasterYSize)
     transform = im.GetGeoTransform()
@@ -12,7 +82,7 @@ def imageLoad(filename):
 
 
 def getNoDataValue(filename):
-    im = gdal.Open(filename, gdal.GA_ReadOnly)
+    im = filename if isinstance(filename, gdal.Dataset) else gdal.Open(filename, gdal.GA_ReadOnly)
     band = im.GetRasterBand(1)
     nodata = band.GetNoDataValue()
     return nodata
@@ -20,6 +90,12 @@ def getNoDataValue(filename):
 
 def getMetadata(inputinfo):
 
+    # warp context input (cached metadata)
+    if isinstance(inputinfo,WarpContext):
+        meta = dict(inputinfo.meta)
+        meta['GeoTransform'] = list(meta['GeoTransform'])
+        return meta
+
     # dataset input
     if isinstance(inputinfo,gdal.Dataset):
         dataset = inputinfo
@@ -52,83 +128,198 @@ def getMetadata(inputinfo):
     return meta
 
 
-def imageWarp(file_src: str, file_dst: str, offset=None, interp_method: int = gdal.gdalconst.GRA_Bilinear, noDataValue=None):
-
-    # verbose display
-    print('Loading <{}>'.format(file_src))
-
-    # destination metadata
-    meta_dst = getMetadata(file_dst)
-
-    # GDAL memory driver
-    mem_drv = gdal.GetDriverByName('MEM')
-
-    # copy source to memory
-    tmp = gdal.Open(file_src, gdal.GA_ReadOnly)
-    dataset_src = mem_drv.CreateCopy('',tmp)   
-    tmp = None
-
-    # change no data value to new "noDataValue" input if necessary,
-    # making sure to adjust the underlying pixel values
-    band = dataset_src.GetRasterBand(1)
-    NDV = band.GetNoDataValue()
+# Open source file, via the WarpContext dataset cache (of the calling thread)
+# when available
+def openSource(file_src, file_dst):
+    if isinstance(file_dst, WarpContext):
+        return file_dst.open(file_src)
+    return gdal.Open(file_src, gdal.GA_ReadOnly)
 
-    if noDataValue is not None and noDataValue != NDV:
-        if NDV is not None:            
-            img = band.ReadAsArray()
-            img[img==NDV] = noDataValue
-            band.WriteArray(img)
-        band.SetNoDataValue(noDataValue)        
-        NDV = noDataValue
 
-    # source metadata
-    meta_src = getMetadata(dataset_src)
+# Load source image resampled onto the destination grid.
+# "file_dst" is a destination filename or WarpContext.
+# Any registration offset and no data replacement are applied lazily by a
+# WarpedRaster, so the source pixels are read exactly once (directly from disk
+# when no reprojection is necessary) into the returned array, of type "dtype"
+# if given, and allocated by "allocate" if given (see WarpedRaster.load).
+def imageWarp(file_src: str, file_dst, offset=None, interp_method: int = gdal.gdalconst.GRA_Bilinear, noDataValue=None,
+              dtype=None, allocate=None):
 
-    # Apply registration offset
-    if offset is not None:
-
-        # offset error: offset is defined in destination projection space,
-        # and cannot be applied if source and destination projections differ
-        if meta_src['Projection'] != meta_dst['Projection']:
-            print('IMAGE PROJECTION\n{}'.format(meta_src['Projection']))
-            print('OFFSET PROJECTION\n{}'.format(meta_dst['Projection']))
-            raise ValueError('Image/Offset projection mismatch')
-
-        transform = meta_src['GeoTransform']
-        transform[0] += offset[0]
-        transform[3] += offset[1]
-        dataset_src.SetGeoTransform(transform)
+    # verbose display
+    print('Loading <{}>'.format(file_src))
 
+    raster = WarpedRaster(file_src, file_dst, offset, interp_method, noDataValue)
 
-    # no reprojection necessary
-    if meta_src == meta_dst:
+    if raster.reprojected:
+        print('  REPROJECTION (adjusting {})'.format(', '.join(raster.adjusted)))
+    else:
         print('  No reprojection')
-        dataset_dst = dataset_src
 
-    # reprojection
+    # read & return image data
+    return raster.load(allocate, dtype)
+
+
+# default number of rows read at a time by WarpedRaster.load into allocated arrays
+LOAD_BLOCK_ROWS = 512
+
+
+# Source raster resampled onto a destination grid on demand.
+# The warp is described by GDAL VRTs, so pixels are only read and resampled
+# for the requested window, allowing aligned blocks of large rasters to be
+# processed without loading any full image into memory.  When the source
+# already matches the destination grid, windows are read straight from the
+# source dataset.
+class WarpedRaster:
+
+    def __init__(self, file_src: str, file_dst, offset=None,
+                 interp_method: int = gdal.gdalconst.GRA_Bilinear, noDataValue=None):
+
+        # destination metadata
+        meta_dst = getMetadata(file_dst)
+
+        # source dataset & metadata
+        dataset_src = openSource(file_src, file_dst)
+        if isinstance(file_dst, WarpContext):
+            meta_src = file_dst.metadata(file_src)
+        else:
+            meta_src = getMetadata(dataset_src)
+
+        # source no data value, and any replacement "noDataValue"
+        # (a source without no data value adopts "noDataValue")
+        NDV = dataset_src.GetRasterBand(1).GetNoDataValue()
+        self.remap = None
+        if noDataValue is not None and noDataValue != NDV:
+            if NDV is not None:
+                self.remap = (NDV, noDataValue)
+            else:
+                NDV = noDataValue
+
+        # Apply registration offset
+        if offset is not None and (offset[0] != 0 or offset[1] != 0):
+
+            # offset error: offset is defined in destination projection space,
+            # and cannot be applied if source and destination projections differ
+            if meta_src['Projection'] != meta_dst['Projection']:
+                print('IMAGE PROJECTION\n{}'.format(meta_src['Projection']))
+                print('OFFSET PROJECTION\n{}'.format(meta_dst['Projection']))
+                raise ValueError('Image/Offset projection mismatch')
+
+            # lightweight virtual copy of the source, allowing the geotransform
+            # to be adjusted without touching the pixel data
+            dataset_src = gdal.Translate('', dataset_src, format='VRT')
+
+            transform = meta_src['GeoTransform']
+            transform[0] += offset[0]
+            transform[3] += offset[1]
+            dataset_src.SetGeoTransform(transform)
+            meta_src['GeoTransform'] = transform
+
+        # no reprojection necessary
+        self.adjusted = [k for k in meta_dst if meta_dst.get(k) != meta_src.get(k)]
+        if not self.adjusted:
+            self.reprojected = False
+            self.dataset = dataset_src
+
+        # reprojection (source no data is mapped directly to the output no data value)
+        else:
+            self.reprojected = True
+
+            xsz = meta_dst['RasterXSize']
+            ysz = meta_dst['RasterYSize']
+            tform = meta_dst['GeoTransform']
+            bounds = (tform[0], tform[3] + tform[5]*ysz, tform[0] + tform[1]*xsz, tform[3])
+
+            outNDV = noDataValue if noDataValue is not None else NDV
+            self.remap = None
+            self.dataset = gdal.Warp('', dataset_src, format='VRT',
+                outputBounds=bounds, width=xsz, height=ysz,
+                dstSRS=(meta_dst['Projection'] or None), resampleAlg=interp_method,
+                srcNodata=NDV, dstNodata=outNDV, outputType=gdal.GDT_Float32)
+
+        self.RasterXSize = meta_dst['RasterXSize']
+        self.RasterYSize = meta_dst['RasterYSize']
+
+    # read a window of the destination grid (default: full image)
+    def read(self, xoff=0, yoff=0, xsize=None, ysize=None):
+        if xsize is None: xsize = self.RasterXSize - xoff
+        if ysize is None: ysize = self.RasterYSize - yoff
+
+        img = self.dataset.GetRasterBand(1).ReadAsArray(xoff, yoff, xsize, ysize)
+
+        # change no data value to new "noDataValue" if necessary (in place)
+        if self.remap is not None:
+            NDV, noDataValue = self.remap
+            if not np.can_cast(type(noDataValue), img.dtype, 'same_kind'):
+                img = img.astype(np.float32)
+            img[img == NDV] = noDataValue
+
+        return img
+
+    # read the full destination grid, as type "dtype" if given.  Given an
+    # "allocate(shape, dtype)" function (e.g. ScratchArrays.empty), the image
+    # is read into the allocated array in blocks of "blockRows" rows, so it is
+    # never held in memory in full.
+    def load(self, allocate=None, dtype=None, blockRows=LOAD_BLOCK_ROWS):
+        if allocate is None:
+            img = self.read()
+            return img if dtype is None else img.astype(dtype)
+
+        img = None
+        for yoff in range(0, self.RasterYSize, blockRows):
+            block = self.read(0, yoff, None, min(blockRows, self.RasterYSize - yoff))
+            if img is None:
+                img = allocate((self.RasterYSize, self.RasterXSize), dtype or block.dtype)
+            img[yoff:yoff + block.shape[0]] = block
+        return img
+
+
+# Run independent raster loads concurrently.
+# "jobs" maps a name to a function of no arguments returning the loaded array
+# (e.g. a lambda around imageLoad/imageWarp). Jobs run in a thread pool of
+# "workers" threads (default: one per job, up to the CPU count), as GDAL
+# releases the GIL during I/O and warping; workers=1 loads sequentially.
+# Jobs must open their datasets within the job (e.g. imageWarp with a shared
+# WarpContext), so no GDAL handle is used by two threads.
+# Returns a dict of results and a dict of per-job load times (seconds).
+def loadConcurrent(jobs, workers=None, verbose=True):
+    if workers is None:
+        workers = min(len(jobs), os.cpu_count() or 1)
+    workers = max(1, workers)
+
+    def timed(func):
+        start = time.perf_counter()
+        result = func()
+        return result, time.perf_counter() - start
+
+    results, elapsed = {}, {}
+    start = time.perf_counter()
+    if workers == 1:
+        for name, func in jobs.items():
+            results[name], elapsed[name] = timed(func)
     else:
-        keys = [k for k in meta_dst if meta_dst.get(k) != meta_src.get(k)]
-        print('  REPROJECTION (adjusting {})'.format(', '.join(keys)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(timed, func) for name, func in jobs.items()}
+            for name, future in futures.items():
+                results[name], elapsed[name] = future.result()
+    total = time.perf_counter() - start
 
-        # file, xsz, ysz, nbands, dtype
-        dataset_dst = mem_drv.Create('', meta_dst['RasterXSize'], meta_dst['RasterYSize'], 
-            meta_src['RasterCount'], gdal.GDT_Float32)
+    if verbose:
+        print('\nLoad times ({} worker{}):'.format(workers, '' if workers == 1 else 's'))
+        for name in jobs:
+            print('  {:<10} {:8.3f} s'.format(name, elapsed[name]))
+        print('  {:<10} {:8.3f} s (wall clock)'.format('total', total))
 
-        dataset_dst.SetProjection(meta_dst['Projection'])
-        dataset_dst.SetGeoTransform(meta_dst['GeoTransform'])
+    return results, elapsed
 
-        if NDV is not None:
-            band = dataset_dst.GetRasterBand(1)
-            band.SetNoDataValue(NDV)
-            band.Fill(NDV)
 
-        # input, output, inputproj, outputproj, interp
-        gdal.ReprojectImage(dataset_src, dataset_dst, meta_src['Projection'],
-             meta_dst['Projection'], interp_method)
+# Generate (xoff, yoff, xsize, ysize) windows covering a raster in square tiles
+def tileWindows(xsize, ysize, tileSize):
+    if tileSize is None or tileSize <= 0:
+        raise ValueError('Tile size must be a positive number of pixels')
 
-    # read & return image data
-    img = dataset_dst.GetRasterBand(1).ReadAsArray()    
-    return img
+    for yoff in range(0, ysize, tileSize):
+        for xoff in range(0, xsize, tileSize):
+            yield (xoff, yoff, min(tileSize, xsize - xoff), min(tileSize, ysize - yoff))
 
 
 def arrayToGeotiff(image_array, out_file_name, reference_file_name, NODATA_VALUE):
@@ -157,33 +348,186 @@ def arrayToGeotiff(image_array, out_file_name, reference_file_name, NODATA_VALUE
     return
 
 
-# Load LAS file and generate max DSM in memory
-def lasToRaster(las_filename, transform, shape_out, NODATA):
-    # Load LAS file
-    test_las = File(las_filename, mode='r')
+# default number of LAS points read & gridded at a time
+LAS_CHUNK_POINTS = 1 << 22
+
+
+# Grid point cloud heights onto a raster, one chunk of points at a time.
+# Points are mapped to the pixel grid defined by the GDAL "transform" and
+# raster shape, and reduced per pixel with "min", "mean", "max" or "count".
+# Each chunk is sorted by pixel and reduced with ufunc.reduceat, so memory is
+# bounded by the chunk size plus the output accumulators.
+class PointRasterizer:
+
+    REDUCTIONS = ('min', 'mean', 'max', 'count')
+
+    def __init__(self, transform, shape_out, reduction='max'):
+        if reduction not in self.REDUCTIONS:
+            raise ValueError('Unrecognized point reduction "{}" (expected one of {})'.format(
+                reduction, ', '.join(self.REDUCTIONS)))
+
+        self.transform = transform
+        self.shape = tuple(shape_out)
+        self.reduction = reduction
+
+        # map to pixel coefficients (inverse geotransform)
+        A = np.array([[transform[1], transform[2]], [transform[4], transform[5]]], np.float64)
+        self.inverse = np.linalg.inv(A)
+        self.origin = np.array([transform[0], transform[3]], np.float64)
+
+        size = self.shape[0] * self.shape[1]
+        self.count = np.zeros(size, np.uint32)
+        if reduction == 'max':
+            self.value = np.full(size, -np.inf, np.float64)
+        elif reduction == 'min':
+            self.value = np.full(size, np.inf, np.float64)
+        elif reduction == 'mean':
+            self.value = np.zeros(size, np.float64)
+        else:
+            self.value = None
+
+    # flat pixel index of each point (-1 for points outside the raster)
+    def pixelIndex(self, x, y):
+        dx = np.asarray(x, np.float64) - self.origin[0]
+        dy = np.asarray(y, np.float64) - self.origin[1]
+        col = np.round(self.inverse[0, 0] * dx + self.inverse[0, 1] * dy).astype(np.int64)
+        row = np.round(self.inverse[1, 0] * dx + self.inverse[1, 1] * dy).astype(np.int64)
+
+        inside = (col >= 0) & (col < self.shape[1]) & (row >= 0) & (row < self.shape[0])
+        return np.where(inside, row * self.shape[1] + col, -1)
+
+    def add(self, x, y, z):
+        index = self.pixelIndex(x, y)
+        valid = index >= 0
+        index = index[valid]
+        if index.size == 0:
+            return
+
+        # group points by pixel
+        order = np.argsort(index, kind='stable')
+        index = index[order]
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        pixels = index[starts]
+
+        self.count[pixels] += np.diff(np.r_[starts, index.size]).astype(np.uint32)
+        if self.value is None:
+            return
+
+        z = np.asarray(z, np.float64)[valid][order]
+        if self.reduction == 'max':
+            self.value[pixels] = np.maximum(self.value[pixels], np.maximum.reduceat(z, starts))
+        elif self.reduction == 'min':
+            self.value[pixels] = np.minimum(self.value[pixels], np.minimum.reduceat(z, starts))
+        else:
+            self.value[pixels] += np.add.reduceat(z, starts)
+
+    # gridded result (float32, into "out" if given), with pixels containing no
+    # points set to NODATA (the "count" reduction reports zero for empty pixels)
+    def result(self, NODATA, out=None):
+        if out is None:
+            out = np.empty(self.shape, np.float32)
+        raster = out.reshape(-1)
+
+        if self.value is None:
+            raster[:] = self.count
+            return out
+
+        empty = self.count == 0
+        if self.reduction == 'mean':
+            raster[~empty] = self.value[~empty] / self.count[~empty]
+        else:
+            raster[:] = self.value
+        raster[empty] = NODATA
+        return out
+
+
+# Iterate (x, y, z) coordinate arrays of a LAS/LAZ file in chunks of points
+def lasChunks(las_filename, chunkSize=LAS_CHUNK_POINTS):
+    import laspy
+
+    # laspy >= 2.0 streams points from disk
+    if hasattr(laspy, 'open'):
+        with laspy.open(las_filename) as reader:
+            for points in reader.chunk_iterator(chunkSize):
+                yield np.asarray(points.x), np.asarray(points.y), np.asarray(points.z)
+
+    # laspy 1.x memory maps the file, scale raw coordinates a chunk at a time
+    else:
+        from laspy.file import File
+        las = File(las_filename, mode='r')
+        try:
+            scale, offset = las.header.scale, las.header.offset
+            X, Y, Z = las.X, las.Y, las.Z
+            for start in range(0, len(X), chunkSize):
+                chunk = slice(start, start + chunkSize)
+                yield (X[chunk] * scale[0] + offset[0],
+                       Y[chunk] * scale[1] + offset[1],
+                       Z[chunk] * scale[2] + offset[2])
+        finally:
+            las.close()
+
+
+# Load LAS file and generate DSM in memory, reducing the heights of all points
+# within each pixel by "reduction" (min, mean, max or count)
+def lasToRaster(las_filename, transform, shape_out, NODATA, reduction='max', chunkSize=LAS_CHUNK_POINTS):
+    rasterizer = PointRasterizer(transform, shape_out, reduction)
+    for x, y, z in lasChunks(las_filename, chunkSize):
+        rasterizer.add(x, y, z)
+    return rasterizer.result(NODATA)
+
+
+# point cloud file extensions accepted in place of gridded height rasters
+POINT_CLOUD_EXTENSIONS = ('.las', '.laz')
+
+
+def isPointCloud(filename):
+    return filename is not None and filename.lower().endswith(POINT_CLOUD_EXTENSIONS)
+
+
+# Grid a LAS/LAZ point cloud onto the destination grid ("file_dst" is a
+# destination filename or WarpContext), reducing point heights within each
+# pixel by "reduction" (min, mean or max).  The point cloud is assumed to share
+# the destination projection.  A registration offset shifts the point XY
+# coordinates, as it would shift the geotransform of a gridded test model.
+# Empty pixels are set to "noDataValue", or filled from the nearest non-empty
+# pixel when holeFill="nearest".  The gridded heights are written to an array
+# allocated by "allocate" if given (see WarpedRaster.load).
+def pointCloudToGrid(file_src, file_dst, offset=None, reduction='max', holeFill='none',
+                     noDataValue=-9999, chunkSize=LAS_CHUNK_POINTS, allocate=None):
+
+    # verbose display
+    print('Gridding point cloud <{}> ({} height{})'.format(file_src, reduction,
+        ', nearest neighbor hole fill' if holeFill == 'nearest' else ''))
+
+    meta_dst = getMetadata(file_dst)
+    rasterizer = PointRasterizer(meta_dst['GeoTransform'],
+        (meta_dst['RasterYSize'], meta_dst['RasterXSize']), reduction)
 
-    x = test_las.x
-    y = test_las.y
-    z = test_las.z
+    for x, y, z in lasChunks(file_src, chunkSize):
+        if offset is not None:
+            x = x + offset[0]
+            y = y + offset[1]
+        rasterizer.add(x, y, z)
 
-    # Project to output image space
-    # TODO: call map2pix
-    map_to_pix = gdal.InvGeoTransform(transform)
-    x0 = np.round(map_to_pix[0] + x * map_to_pix[1] + y * map_to_pix[2])
-    y0 = np.round(map_to_pix[3] + x * map_to_pix[4] + y * map_to_pix[5])
+    img = rasterizer.result(noDataValue, None if allocate is None else allocate(rasterizer.shape, np.float32))
+    if holeFill == 'nearest':
+        fillHoles(img, img == noDataValue)
+    elif holeFill != 'none':
+        raise ValueError('Unrecognized hole fill "{}"'.format(holeFill))
 
-    x0 = x0.astype(int)
-    y0 = y0.astype(int)
+    return img
 
-    # Generate MAX value DSM
-    raster = np.zeros(shape_out, np.float32) + NODATA
-    for ii in range(0, x0.size):
-        if (x0[ii] >= 0) & (x0[ii] < raster.shape[1]) & (y0[ii] >= 0) & (
-                y0[ii] < raster.shape[0]):
-            if z[ii] > raster[y0[ii], x0[ii]]:
-                raster[y0[ii], x0[ii]] = z[ii]
 
-    return raster
+# Fill "holes" pixels in place from the nearest pixel outside the holes
+def fillHoles(img, holes):
+    from scipy import ndimage
+
+    if not np.any(holes) or np.all(holes):
+        return img
+
+    indices = ndimage.distance_transform_edt(holes, return_distances=False, return_indices=True)
+    img[holes] = img[tuple(index[holes] for index in indices)]
+    return img
 
 
 # refMat is a GDAL GeoTransform format
@@ -35,6 +35,108 @@ def calcMops(true_positives, false_negatives, false_positives):
     return s
 
 
+# Percentiles "q" (0-100) of the absolute values of "values", as a list of
+# floats.  All percentiles are selected together from a single partition of
+# one working copy, rather than one copy & partition per percentile.
+def calcPercentiles(values, q):
+    values = np.abs(np.asarray(values).ravel())
+    return [float(v) for v in np.percentile(values, q, overwrite_input=True)]
+
+
+# Mergeable approximate percentile sketch of absolute values.
+# Values are counted in logarithmically spaced bins, such that percentiles are
+# reported within "relativeAccuracy" of the exact (np.percentile) value, or
+# within "minValue" for values below it (counted as zero), and exactly at the
+# observed minimum & maximum, with memory independent of the number of values.
+# Sketches of separate blocks (e.g. tiles, or CLS match sets) are combined with
+# merge, avoiding retaining the full error vector.
+class PercentileSketch:
+
+    def __init__(self, relativeAccuracy=0.001, minValue=1e-9):
+        self.relativeAccuracy = relativeAccuracy
+        self.gamma = (1 + relativeAccuracy) / (1 - relativeAccuracy)
+        self.logGamma = np.log(self.gamma)
+        self.minValue = minValue
+
+        self.offset = 0                       # bin index of counts[0]
+        self.counts = np.zeros(0, np.int64)
+        self.zeroCount = 0                    # values below minValue
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def __len__(self):
+        return self.count
+
+    # add counts for bins [offset, offset+len(counts))
+    def _addBins(self, offset, counts):
+        if counts.size == 0:
+            return
+        if self.counts.size == 0:
+            self.offset, self.counts = offset, counts.astype(np.int64)
+            return
+
+        lo = min(self.offset, offset)
+        hi = max(self.offset + self.counts.size, offset + counts.size)
+        merged = np.zeros(hi - lo, np.int64)
+        merged[self.offset - lo:self.offset - lo + self.counts.size] += self.counts
+        merged[offset - lo:offset - lo + counts.size] += counts
+        self.offset, self.counts = lo, merged
+
+    def add(self, values):
+        values = np.abs(np.asarray(values, np.float64).ravel())
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return self
+
+        self.count += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        small = values < self.minValue
+        self.zeroCount += int(np.count_nonzero(small))
+        values = values[~small]
+        if values.size:
+            index = np.ceil(np.log(values) / self.logGamma).astype(np.int64)
+            offset = int(index.min())
+            self._addBins(offset, np.bincount(index - offset))
+        return self
+
+    def merge(self, other):
+        if other.gamma != self.gamma or other.minValue != self.minValue:
+            raise ValueError('Cannot merge percentile sketches with different accuracy')
+
+        self.count += other.count
+        self.zeroCount += other.zeroCount
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._addBins(other.offset, other.counts)
+        return self
+
+    # approximate percentiles "q" (0-100), as a list of floats
+    def percentiles(self, q):
+        if self.count == 0:
+            raise ValueError('Percentiles of an empty sketch')
+
+        # as np.percentile, interpolating between the values of adjacent ranks
+        ranks = np.asarray(q, np.float64).ravel() / 100 * (self.count - 1)
+        lo = np.floor(ranks)
+        frac = ranks - lo
+        lower = self._rankValues(lo.astype(np.int64))
+        upper = self._rankValues(np.ceil(ranks).astype(np.int64))
+        return [float(v) for v in lower + frac * (upper - lower)]
+
+    # approximate value of each rank (0-based, in sorted order)
+    def _rankValues(self, ranks):
+        values = np.zeros(ranks.size, np.float64)
+        binned = ranks >= self.zeroCount
+        if self.counts.size and np.any(binned):
+            cumulative = self.zeroCount + np.cumsum(self.counts)
+            index = np.minimum(np.searchsorted(cumulative, ranks[binned], side='right'), self.counts.size - 1)
+            values[binned] = 2 * self.gamma ** (self.offset + index) / (self.gamma + 1)
+        return np.clip(values, self.min, self.max)
+
+
 def getUnitArea(tform):
     return abs(tform[1] * tform[5])
 
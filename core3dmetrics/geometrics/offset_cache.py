@@ -0,0 +1,120 @@
+#
+# Persistent cache of registration offsets, keyed by the content of the
+# reference & test DSM files and the registration parameters.
+#
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+
+
+# default cache location (override with CORE3D_METRICS_CACHE environment variable)
+def defaultCacheFilename():
+    folder = os.getenv('CORE3D_METRICS_CACHE',
+                       os.path.join(os.path.expanduser('~'), '.cache', 'core3dmetrics'))
+    return os.path.join(folder, 'offsets.sqlite')
+
+
+# Content fingerprint of a file.
+# The default (sampled) fingerprint combines the file size, modification time
+# and a hash of blocks sampled from the start, middle and end of the file,
+# which is cheap for multi-gigabyte rasters.  The full fingerprint hashes the
+# entire file contents (independent of modification time).
+def fileFingerprint(filename, sampled=True, blockSize=1 << 20):
+    stat = os.stat(filename)
+    digest = hashlib.sha256()
+
+    with open(filename, 'rb') as fid:
+        if sampled and stat.st_size > 3 * blockSize:
+            for offset in (0, (stat.st_size - blockSize) // 2, stat.st_size - blockSize):
+                fid.seek(offset)
+                digest.update(fid.read(blockSize))
+        else:
+            for block in iter(lambda: fid.read(blockSize), b''):
+                digest.update(block)
+
+    fingerprint = {'size': stat.st_size, 'sha256': digest.hexdigest()}
+    if sampled:
+        fingerprint['mtime_ns'] = stat.st_mtime_ns
+    return fingerprint
+
+
+class OffsetCache:
+
+    def __init__(self, filename=None, maxEntries=1000):
+        self.filename = filename or defaultCacheFilename()
+        self.maxEntries = maxEntries
+
+        folder = os.path.dirname(os.path.abspath(self.filename))
+        os.makedirs(folder, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.filename)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS offsets ('
+                'key TEXT PRIMARY KEY, xyz TEXT NOT NULL, '
+                'reference TEXT, test TEXT, created REAL, last_used REAL)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    # cache key for a reference/test file pair and registration parameters
+    def key(self, reference_filename, test_filename, **params):
+        data = {
+            'reference': fileFingerprint(reference_filename),
+            'test': fileFingerprint(test_filename),
+            'params': params,
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    # cached [dx, dy, dz] offset (None if not cached)
+    def get(self, key):
+        row = self.connection.execute('SELECT xyz FROM offsets WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        with self.connection:
+            self.connection.execute('UPDATE offsets SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, offset, reference_filename=None, test_filename=None):
+        now = time.time()
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO offsets VALUES (?, ?, ?, ?, ?, ?)',
+                (key, json.dumps([float(v) for v in offset]), reference_filename, test_filename, now, now))
+        self.evict()
+
+    # Remove least recently used entries beyond "maxEntries", and entries
+    # unused for more than "maxAge" seconds. Returns number of entries removed.
+    def evict(self, maxEntries=None, maxAge=None):
+        if maxEntries is None:
+            maxEntries = self.maxEntries
+
+        removed = 0
+        with self.connection:
+            if maxAge is not None:
+                removed += self.connection.execute(
+                    'DELETE FROM offsets WHERE last_used < ?', (time.time() - maxAge,)).rowcount
+            if maxEntries is not None:
+                removed += self.connection.execute(
+                    'DELETE FROM offsets WHERE key NOT IN '
+                    '(SELECT key FROM offsets ORDER BY last_used DESC LIMIT ?)', (maxEntries,)).rowcount
+        return removed
+
+    def clear(self):
+        with self.connection:
+            return self.connection.execute('DELETE FROM offsets').rowcount
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM offsets').fetchone()[0]
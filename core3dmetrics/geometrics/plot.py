@@ -1,5 +1,7 @@
 import os
+import time
 import platform
+import concurrent.futures
 import numpy as np
 
 import matplotlib  as mpl
@@ -9,6 +11,64 @@ if os.getenv('DISPLAY') is None and not platform.system() == "Windows":
 
 import matplotlib.pyplot as plt
 
+from .preview import writePreview, decimateImage
+
+
+# Render an image figure (see plot.make), displaying it if "showPlots" and
+# saving it to "filename" if given. Returns the render time in seconds.
+def renderFigure(image, title, fig, showPlots=False, badColor='white', dpi=500, filename=None, **kwargs):
+    start = time.perf_counter()
+
+    if 'badValue' in kwargs:
+        image = np.array(image)
+        image[image == kwargs['badValue']] = np.nan
+
+    plt.figure(fig)
+    plt.clf()
+    plt.title(title)
+
+    imshow_kwargs = {}
+    keys = ['vmin','vmax']
+    for key in keys:
+        if key in kwargs:
+            imshow_kwargs[key] = kwargs[key]
+
+    hImg = plt.imshow(image,**imshow_kwargs)
+    mpl.cm.get_cmap().set_bad(color=badColor)
+
+    if 'cmap' in kwargs:
+        cmap = kwargs['cmap']
+        if type(cmap) is list:
+            cmap = mpl.colors.ListedColormap(cmap)
+        hImg.set_cmap(cmap)
+
+    if 'colorbar' in kwargs:
+        if kwargs['colorbar'] is True:
+            hCM = plt.colorbar()
+
+            if 'cm_ticks' in kwargs:
+                hCM.set_ticks(kwargs['cm_ticks'], True)
+
+            if 'cm_labels' in kwargs:
+                hCM.set_ticklabels(kwargs['cm_labels'], True)
+
+
+    if showPlots:
+        plt.show(block=False)
+
+    if filename is not None:
+        plt.savefig(filename, dpi=dpi)
+
+    if not showPlots:
+        plt.close(plt.gcf())
+
+    return time.perf_counter() - start
+
+
+# background renderer process setup
+def _initRenderer(defaultCM):
+    matplotlib.use('Agg')
+    plt.rcParams['image.cmap'] = defaultCM
 
 
 class plot:
@@ -24,6 +84,23 @@ class plot:
     autoSave = False  # Saves figure at end of call to plot.make()
     dpi = 500
 
+    # Background renderer processes for saved (not displayed) figures,
+    # 0 renders each figure synchronously in plot.make()
+    workers = 0
+
+    # Saved images may instead be written as colormapped raster previews at
+    # native resolution ('png' or 'geotiff', see writePreview), located by
+    # the reference grid "transform" & "projection"
+    preview = None
+    transform = None
+    projection = None
+    overview = None
+
+    # Images larger than the figure (at the saved resolution) are decimated
+    # before rendering (see decimateImage; a "decimate" method may be given
+    # to plot.make, or False to render at full resolution)
+    decimate = True
+
     def __init__(self, **kwargs):
 
         if 'showPlots' in kwargs:
@@ -47,67 +124,95 @@ class plot:
         if 'dpi' in kwargs:
                 self.dpi = kwargs['dpi']
 
+        if 'workers' in kwargs:
+            self.workers = kwargs['workers'] or 0
+
+        for key in ('preview', 'transform', 'projection', 'overview', 'decimate'):
+            if key in kwargs:
+                setattr(self, key, kwargs[key])
+
         if (os.getenv('DISPLAY') is None) and self.showPlots:
             if not platform.system() == "Windows":
                 print('DISPLAY not set.  Disabling plot display')
                 self.showPlots = False
-            
+
         plt.rcParams['image.cmap'] = self.defaultCM
 
+        # render times (figure name, seconds) & pending background figures
+        self.timings = []
+        self._pending = []
+        self._executor = None
+
         print("showPlots = " + str(self.showPlots))
 
-    def make(self, image=None, title='', fig=None, **kwargs):
-    
-        if 'badValue' in kwargs:
-            image = np.array(image)
-            image[image == kwargs['badValue']] = np.nan
+    # Figures are rendered in the background when saved but not displayed
+    @property
+    def asynchronous(self):
+        return self.workers > 0 and self.autoSave and not self.showPlots and not self.preview
 
-        plt.figure(fig)
-        plt.clf()
-        plt.title(title)
+    def make(self, image=None, title='', fig=None, **kwargs):
 
         # When no image is provided, setup figure and return handle to matplotlib
         if image is None:
+            plt.figure(fig)
+            plt.clf()
+            plt.title(title)
             return plt
 
-        imshow_kwargs = {}
-        keys = ['vmin','vmax']
-        for key in keys:
-            if key in kwargs:
-                imshow_kwargs[key] = kwargs[key]
-
-        hImg = plt.imshow(image,**imshow_kwargs)
-        mpl.cm.get_cmap().set_bad(color=self.badColor)
-
-        if 'cmap' in kwargs:
-            cmap = kwargs['cmap']
-            if type(cmap) is list:
-                cmap = mpl.colors.ListedColormap(cmap)
-            hImg.set_cmap(cmap)
-
-        if 'colorbar' in kwargs:
-            if kwargs['colorbar'] is True:
-                hCM = plt.colorbar()
-
-                if 'cm_ticks' in kwargs:
-                    hCM.set_ticks(kwargs['cm_ticks'], True)
-
-                if 'cm_labels' in kwargs:
-                    hCM.set_ticklabels(kwargs['cm_labels'], True)
-
+        filename = None
+        if self.autoSave:
+            filename = self.filename(kwargs.get('saveName', title), bool(self.preview))
+        name = os.path.basename(filename) if filename else title
+        kwargs.pop('saveName', None)
+
+        # raster preview in place of the saved figure
+        if self.preview and filename is not None:
+            start = time.perf_counter()
+            writePreview(filename, image, self.transform, self.projection, kwargs.get('vmin'), kwargs.get('vmax'),
+                kwargs.get('cmap', self.defaultCM), kwargs.get('badValue'), self.badColor, self.overview)
+            self.timings.append((name, time.perf_counter() - start))
+            filename = None
+            if not self.showPlots:
+                return
+
+        # decimated view at the figure resolution
+        method = kwargs.pop('decimate', None)
+        if self.decimate and method is not False:
+            factor = self.decimationFactor(np.shape(image))
+            if factor > 1:
+                image = decimateImage(image, factor, method, kwargs.get('badValue'))
+
+        # snapshot the image (which the caller may modify) for a background renderer
+        if self.asynchronous:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                    initializer=_initRenderer, initargs=(self.defaultCM,))
+
+            # bound the number of pending snapshots held in memory
+            while len(self._pending) >= 2 * self.workers:
+                self._collect(*self._pending.pop(0))
+
+            future = self._executor.submit(renderFigure, np.array(image), title, fig,
+                False, self.badColor, self.dpi, filename, **kwargs)
+            self._pending.append((name, future))
+            return
 
-        if self.showPlots:
-            plt.show(block=False)
+        seconds = renderFigure(image, title, fig, self.showPlots, self.badColor, self.dpi, filename, **kwargs)
+        self.timings.append((name, seconds))
 
-        if self.autoSave:
-            if "saveName" in kwargs:
-                title = kwargs['saveName']
-            self.save(title)
+    # Decimation factor of an image shape, so the image is no larger than the
+    # figure in pixels at the saved resolution (an upper bound on the axes)
+    def decimationFactor(self, shape):
+        width, height = plt.rcParams['figure.figsize']
+        return max(1, int(max(shape[0] / (height * self.dpi), shape[1] / (width * self.dpi))))
 
-        if not self.showPlots:
-            plt.close(plt.gcf())
+    def filename(self, saveName, preview=False):
 
+        if len(self.savePrefix) > 0:
+            saveName = self.savePrefix + saveName
 
+        saveExe = {'png': '.png', 'geotiff': '.tif'}[self.preview] if preview else self.saveExe
+        return os.path.join(self.saveDir, saveName + saveExe)
 
     def save(self, saveName, figNum=None):
 
@@ -117,8 +222,51 @@ class plot:
         if figNum is not None:
             plt.figure(figNum)
 
-        if len(self.savePrefix) > 0:
-            saveName = self.savePrefix + saveName
-
-        fn  = os.path.join(self.saveDir, saveName + self.saveExe)
-        plt.savefig(fn, dpi=self.dpi)
\ No newline at end of file
+        start = time.perf_counter()
+        fn = self.filename(saveName)
+        plt.savefig(fn, dpi=self.dpi)
+        self.timings.append((os.path.basename(fn), time.perf_counter() - start))
+
+    def _collect(self, name, future):
+        self.timings.append((name, future.result()))
+
+    # Wait for all background figures (raising any render error) and report
+    # the render time of each figure. Returns the list of (name, seconds).
+    def flush(self, verbose=True):
+        start = time.perf_counter()
+        pending, self._pending = self._pending, []
+        try:
+            for item in pending:
+                self._collect(*item)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        waited = time.perf_counter() - start
+
+        if verbose and self.timings:
+            print('\nPlot render times:')
+            for name, seconds in self.timings:
+                print('  {:8.3f} s  {}'.format(seconds, name))
+            print('  {:8.3f} s  total for {} figures{}'.format(sum(t for _, t in self.timings), len(self.timings),
+                ' ({} background workers, {:.3f} s waiting at flush)'.format(self.workers, waited)
+                if self.asynchronous else ''))
+
+        return list(self.timings)
+
+    # Discard pending background figures and stop the render workers
+    # (e.g. when an evaluation fails before flush); figures already being
+    # rendered are completed
+    def close(self):
+        pending, self._pending = self._pending, []
+        for _, future in pending:
+            future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
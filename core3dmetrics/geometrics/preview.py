@@ -0,0 +1,286 @@
+#
+# Fast raster previews: colormapped 8-bit RGB images written directly at
+# native resolution (PNG with world file, or GeoTIFF), without rendering a
+# matplotlib figure.
+#
+
+import os
+import zlib
+import struct
+import numpy as np
+
+
+# preview file formats, by extension
+PREVIEW_FORMATS = {'.png': 'png', '.tif': 'geotiff', '.tiff': 'geotiff'}
+
+# rows colormapped/encoded at a time, bounding temporary memory
+PREVIEW_BLOCK_ROWS = 1024
+
+
+# Colormap lookup table: the N RGB colors (uint8) of a matplotlib colormap
+# name, colormap or list of colors (as plot.make), plus a final entry for bad
+# (NaN / no data) pixels
+def colormapLUT(cmap='jet', badColor='white'):
+    from matplotlib import cm, colors
+
+    if isinstance(cmap, list):
+        cmap = colors.ListedColormap(cmap)
+    elif isinstance(cmap, str):
+        cmap = cm.get_cmap(cmap)
+
+    lut = np.empty((cmap.N + 1, 3), np.uint8)
+    lut[:-1] = np.round(cmap(np.arange(cmap.N))[:, :3] * 255)
+    lut[-1] = np.round(np.array(colors.to_rgb(badColor)) * 255)
+    return lut
+
+
+# Colormap an image to an RGB uint8 array, with linear scaling of [vmin, vmax]
+# (default: the range of valid pixels) to the lookup table. NaN and
+# "badValue" pixels take the bad color.
+def colorize(image, vmin=None, vmax=None, cmap='jet', badValue=None, badColor='white', lut=None):
+    image = np.asarray(image)
+    if lut is None:
+        lut = colormapLUT(cmap, badColor)
+
+    if image.dtype == bool:
+        vmin = 0 if vmin is None else vmin
+        vmax = 1 if vmax is None else vmax
+
+    # value range of valid pixels
+    if vmin is None or vmax is None:
+        lo, hi = np.inf, -np.inf
+        for start in range(0, image.shape[0], PREVIEW_BLOCK_ROWS):
+            block = image[start:start+PREVIEW_BLOCK_ROWS]
+            valid = _validMask(block, badValue)
+            if np.any(valid):
+                lo = min(lo, block[valid].min())
+                hi = max(hi, block[valid].max())
+        if lo > hi:
+            lo, hi = 0, 1
+        vmin = lo if vmin is None else vmin
+        vmax = hi if vmax is None else vmax
+
+    # matplotlib binning: color floor(N * (value - vmin) / (vmax - vmin))
+    N = lut.shape[0] - 1
+    scale = N / (vmax - vmin) if vmax > vmin else 0
+    rgb = np.empty(image.shape + (3,), np.uint8)
+    for start in range(0, image.shape[0], PREVIEW_BLOCK_ROWS):
+        block = image[start:start+PREVIEW_BLOCK_ROWS]
+        with np.errstate(invalid='ignore'):
+            index = (block.astype(np.float32) - vmin) * scale
+            np.clip(index, 0, N - 1, out=index)
+            index = index.astype(np.intp)
+        index[~_validMask(block, badValue)] = N
+        rgb[start:start+PREVIEW_BLOCK_ROWS] = lut[index]
+    return rgb
+
+
+def _validMask(block, badValue):
+    valid = np.ones(block.shape, bool) if block.dtype.kind in 'biu' else np.isfinite(block)
+    if badValue is not None:
+        valid &= (block != badValue)
+    return valid
+
+
+# DECIMATION: reduce an image by an integer "factor" in each dimension, each
+# output pixel summarizing a factor x factor block (partial blocks at the
+# right/bottom edges) of valid pixels, one band of rows at a time:
+#   'mean'  average (floating point output)
+#   'max'   maximum (for boolean masks: any pixel set, keeping thin regions)
+#   'mode'  most frequent value (integer class/label maps)
+# The default method is 'max' for boolean, 'mode' for integer and 'mean' for
+# floating point images. NaN and "badValue" pixels are excluded; blocks without
+# valid pixels are NaN (floating point output) or "badValue".
+DECIMATION_METHODS = ('mean', 'max', 'mode')
+
+
+def decimateImage(image, factor, method=None, badValue=None):
+    image = np.asarray(image)
+    factor = int(factor)
+
+    if method is None:
+        method = 'max' if image.dtype == bool else 'mode' if image.dtype.kind in 'iu' else 'mean'
+    if method not in DECIMATION_METHODS:
+        raise ValueError('Unrecognized decimation method <{}>'.format(method))
+    if method == 'mode' and image.dtype.kind not in 'biu':
+        raise ValueError('Mode decimation requires an integer or boolean image')
+    if factor <= 1:
+        return image
+
+    rows, cols = image.shape
+    dtype = np.result_type(image.dtype, np.float32) if method == 'mean' else image.dtype
+    out = np.empty((-(-rows // factor), -(-cols // factor)), dtype)
+
+    bandRows = factor * max(1, PREVIEW_BLOCK_ROWS // factor)
+    for start in range(0, rows, bandRows):
+        band = image[start:start+bandRows]
+        out[start // factor:(start + band.shape[0] - 1) // factor + 1] = \
+            _decimateBand(band, factor, method, badValue, dtype)
+    return out
+
+
+def _decimateBand(band, factor, method, badValue, dtype):
+    rows, cols = band.shape
+    outShape = (-(-rows // factor), -(-cols // factor))
+    valid = _validMask(band, badValue)
+
+    # pad to whole blocks, as invalid pixels
+    pad = ((0, outShape[0] * factor - rows), (0, outShape[1] * factor - cols))
+    valid = np.pad(valid, pad)
+    anyValid = _blocks(valid, outShape, factor).any(axis=(1, 3))
+    missing = np.nan if dtype.kind == 'f' else (badValue if badValue is not None else 0)
+
+    if method == 'mean':
+        values = np.pad(np.where(valid[:rows, :cols], band, 0).astype(np.float64), pad)
+        total = _blocks(values, outShape, factor).sum(axis=(1, 3))
+        count = _blocks(valid, outShape, factor).sum(axis=(1, 3))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = total / count
+
+    elif method == 'max':
+        if band.dtype == bool:
+            low = False
+        elif band.dtype.kind == 'f':
+            low = -np.inf
+        else:
+            low = np.iinfo(band.dtype).min
+        values = np.pad(np.where(valid[:rows, :cols], band, low).astype(band.dtype, copy=False), pad,
+            constant_values=low)
+        result = _blocks(values, outShape, factor).max(axis=(1, 3))
+
+    else:
+        # most frequent (block, value) pair of each block, ties to the smallest value
+        blockIndex = (np.arange(rows)[:, None] // factor) * outShape[1] + np.arange(cols)[None, :] // factor
+        keep = valid[:rows, :cols]
+        blockIndex = blockIndex[keep]
+        values = band[keep].astype(np.int64)
+        numBlocks = outShape[0] * outShape[1]
+        result = np.zeros(numBlocks, np.int64)
+        if values.size:
+            vmin = values.min()
+            numValues = int(values.max() - vmin) + 1
+            keys = blockIndex * numValues + (values - vmin)
+            if numBlocks * numValues <= 4 * keys.size:
+                # dense (block, value) histogram
+                counts = np.bincount(keys, minlength=numBlocks * numValues).reshape(numBlocks, numValues)
+                result[:] = np.argmax(counts, axis=1) + vmin
+            else:
+                keys, counts = np.unique(keys, return_counts=True)
+                blocks, values = np.divmod(keys, numValues)
+                order = np.lexsort((-values, counts, blocks))
+                last = np.r_[blocks[order][1:] != blocks[order][:-1], True]
+                result[blocks[order][last]] = values[order][last] + vmin
+        result = result.reshape(outShape)
+
+    result = result.astype(dtype, copy=False)
+    result[~anyValid] = missing
+    return result
+
+
+# view of an array (whole blocks) as (block rows, factor, block cols, factor)
+def _blocks(array, outShape, factor):
+    return array.reshape(outShape[0], factor, outShape[1], factor)
+
+
+# Write an RGB (rows, cols, 3) or grayscale (rows, cols) uint8 array as PNG,
+# compressed a block of rows at a time
+def writePNG(filename, image, level=1):
+    image = np.asarray(image, np.uint8)
+    rows, cols = image.shape[:2]
+    colorType = 2 if image.ndim == 3 else 0
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    compressor = zlib.compressobj(level)
+    data = []
+    for start in range(0, rows, PREVIEW_BLOCK_ROWS):
+        block = image[start:start+PREVIEW_BLOCK_ROWS].reshape(-1, image[0].size)
+        # filter type 0 (none) at the start of every row
+        block = np.concatenate((np.zeros((block.shape[0], 1), np.uint8), block), axis=1)
+        data.append(compressor.compress(block.tobytes()))
+    data.append(compressor.flush())
+
+    with open(filename, 'wb') as fid:
+        fid.write(b'\x89PNG\r\n\x1a\n')
+        fid.write(chunk(b'IHDR', struct.pack('>IIBBBBB', cols, rows, 8, colorType, 0, 0, 0)))
+        fid.write(chunk(b'IDAT', b''.join(data)))
+        fid.write(chunk(b'IEND', b''))
+
+
+# Write the world file (e.g. ".pgw" for ".png") of a GDAL geotransform,
+# locating an image in GIS software
+def writeWorldFile(filename, transform):
+    base, ext = os.path.splitext(filename)
+    worldFilename = base + ext[:2] + ext[-1] + 'w'
+    x0, dx, rx, y0, ry, dy = transform
+    # world files reference the center of the upper left pixel
+    values = (dx, ry, rx, dy, x0 + dx/2 + rx/2, y0 + ry/2 + dy/2)
+    with open(worldFilename, 'w') as fid:
+        fid.write('\n'.join('{:.12f}'.format(v) for v in values) + '\n')
+    return worldFilename
+
+
+# Write an RGB uint8 array as a tiled, compressed GeoTIFF with the geotransform
+# & projection of the reference grid, and internal overviews (factors 2, 4,
+# ... up to "overview") when requested
+def writeRGBGeotiff(filename, rgb, transform=None, projection=None, overview=None):
+    import gdal
+
+    driver = gdal.GetDriverByName('GTiff')
+    out_image = driver.Create(filename, rgb.shape[1], rgb.shape[0], 3, gdal.GDT_Byte,
+        options=['TILED=YES', 'COMPRESS=DEFLATE', 'PHOTOMETRIC=RGB'])
+    if out_image is None:
+        raise IOError('Could not create output GeoTIFF <{}>'.format(filename))
+
+    if transform is not None:
+        out_image.SetGeoTransform(transform)
+    if projection:
+        out_image.SetProjection(projection)
+
+    for band in range(3):
+        out_image.GetRasterBand(band + 1).WriteArray(rgb[:, :, band], 0, 0)
+
+    if overview:
+        factors = [2**k for k in range(1, int(np.log2(overview)) + 1)]
+        if factors:
+            out_image.BuildOverviews('NEAREST', factors)
+
+    out_image.FlushCache()
+    # Ignore pep warning here, aids in memory management performance
+    out_image = None
+
+
+# Write a colormapped preview of an image (see colorize) at native
+# resolution, as PNG (plus a world file when "transform" is given) or GeoTIFF,
+# by file extension. With "overview" (a decimation factor), a downsampled
+# overview is added: "<name>_overview.png" for PNG, internal overviews for
+# GeoTIFF. Returns the list of files written.
+def writePreview(filename, image, transform=None, projection=None, vmin=None, vmax=None,
+                 cmap='jet', badValue=None, badColor='white', overview=None):
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in PREVIEW_FORMATS:
+        raise ValueError('Unrecognized preview format <{}>'.format(ext))
+
+    rgb = colorize(image, vmin, vmax, cmap, badValue, badColor)
+    files = [filename]
+
+    if PREVIEW_FORMATS[ext] == 'geotiff':
+        writeRGBGeotiff(filename, rgb, transform, projection, overview)
+        return files
+
+    writePNG(filename, rgb)
+    if transform is not None:
+        files.append(writeWorldFile(filename, transform))
+
+    if overview and overview > 1:
+        overviewFilename = os.path.splitext(filename)[0] + '_overview.png'
+        writePNG(overviewFilename, rgb[::overview, ::overview])
+        files.append(overviewFilename)
+        if transform is not None:
+            x0, dx, rx, y0, ry, dy = transform
+            files.append(writeWorldFile(overviewFilename,
+                (x0, dx*overview, rx*overview, y0, ry*overview, dy*overview)))
+
+    return files
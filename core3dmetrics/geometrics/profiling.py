@@ -0,0 +1,169 @@
+#
+# Stage-level profiling: wall time, CPU time and peak memory of named
+# processing stages (e.g. registration, loading, each metric).
+#
+
+import re
+import sys
+import time
+import contextlib
+import tracemalloc
+
+
+# Peak resident set size of this process (bytes): VmHWM on Linux, otherwise
+# the lifetime maximum from getrusage (None if unavailable)
+def peakRSS():
+    try:
+        with open('/proc/self/status', 'r') as fid:
+            match = re.search(r'VmHWM:\s+(\d+)\s+kB', fid.read())
+        if match:
+            return int(match.group(1)) * 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+# Reset the peak resident set size (Linux), returning success
+def resetPeakRSS():
+    try:
+        with open('/proc/self/clear_refs', 'w') as fid:
+            fid.write('5')
+        return True
+    except OSError:
+        return False
+
+
+# Records stages, which may be nested and labeled (e.g. by CLS match set):
+#   profiler.start('relative_accuracy', CLSSet=0) ... profiler.stop()
+#   with profiler.stage('terrain_accuracy'): ...
+# Peak memory is the tracemalloc peak of Python/NumPy allocations and the peak
+# RSS of the process within each stage (where the RSS peak cannot be reset,
+# the process peak so far). CPU time includes all threads of this process,
+# but not child processes (e.g. background plot renderers).
+# A disabled profiler records nothing.
+class StageProfiler:
+
+    def __init__(self, enabled=True, traceMemory=True):
+        self.enabled = enabled
+        self.traceMemory = traceMemory and enabled
+        self.stages = []
+        self._stack = []
+        self._resettableRSS = False
+        self._startedTracing = False
+        self._start = None
+        self._peakRSS = None
+
+        if self.enabled:
+            if self.traceMemory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._startedTracing = True
+            self._resettableRSS = resetPeakRSS()
+            self._start = (time.perf_counter(), time.process_time())
+
+    # fold the memory peaks since the last update into all open stages
+    def _updatePeaks(self):
+        rss = peakRSS()
+        if rss is not None:
+            self._peakRSS = max(self._peakRSS or 0, rss)
+        traced = tracemalloc.get_traced_memory()[1] if self.traceMemory else None
+        for record in self._stack:
+            if rss is not None:
+                record['peak_rss'] = max(record['peak_rss'] or 0, rss)
+            if traced is not None:
+                record['peak_traced'] = max(record['peak_traced'] or 0, traced)
+
+        if self._resettableRSS:
+            resetPeakRSS()
+        if self.traceMemory:
+            self._resetTracedPeak()
+
+    # reset the traced memory peak (tracemalloc.reset_peak needs Python 3.9;
+    # otherwise tracing is restarted, if started by this profiler)
+    def _resetTracedPeak(self):
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        elif self._startedTracing:
+            tracemalloc.stop()
+            tracemalloc.start()
+
+    def start(self, name, **labels):
+        if not self.enabled:
+            return
+        self._updatePeaks()
+        record = {'stage': name}
+        record.update(labels)
+        record.update({'wall': time.perf_counter(), 'cpu': time.process_time(),
+            'peak_rss': None, 'peak_traced': None})
+        self._stack.append(record)
+        self.stages.append(record)
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self._updatePeaks()
+        record = self._stack.pop()
+        record['wall'] = time.perf_counter() - record['wall']
+        record['cpu'] = time.process_time() - record['cpu']
+        record['depth'] = len(self._stack)
+
+    @contextlib.contextmanager
+    def stage(self, name, **labels):
+        self.start(name, **labels)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    # Profile report (JSON-compatible): stages in start order (with nesting
+    # "depth"), and totals since the profiler was created
+    def report(self):
+        if not self.enabled:
+            return None
+
+        self._updatePeaks()
+        self._peakRSS = max(self._peakRSS or 0, peakRSS() or 0)
+
+        return {
+            'stages': self.stages,
+            'total': {
+                'wall': time.perf_counter() - self._start[0],
+                'cpu': time.process_time() - self._start[1],
+                'peak_rss': self._peakRSS,
+                'peak_rss_per_stage': self._resettableRSS,
+            },
+        }
+
+    # Print the stages as a table
+    def printReport(self):
+        if not self.enabled:
+            return
+        print('\n=====PROFILE=====')
+        print('{:<36} {:>9} {:>9} {:>12} {:>12}'.format('stage', 'wall (s)', 'cpu (s)', 'rss (MB)', 'traced (MB)'))
+        for record in self.stages:
+            labels = ''.join(' {}={}'.format(k, v) for k, v in record.items()
+                if k not in ('stage', 'wall', 'cpu', 'peak_rss', 'peak_traced', 'depth'))
+            print('{:<36} {:>9.3f} {:>9.3f} {:>12} {:>12}'.format(
+                '  ' * record['depth'] + record['stage'] + labels, record['wall'], record['cpu'],
+                _megabytes(record['peak_rss']), _megabytes(record['peak_traced'])))
+
+    # stop tracing memory (if started by this profiler)
+    def close(self):
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _megabytes(value):
+    return '-' if value is None else '{:.1f}'.format(value / 2**20)
@@ -0,0 +1,113 @@
+#
+# Persistent on-disk cache of prepared reference products (reference rasters
+# warped to the CLS grid, ignore mask, CLS values, structure index), stored as
+# .npy files for memory mapping, with a manifest of the source file
+# fingerprints used to invalidate the cache when the reference changes.
+#
+
+import os
+import json
+import numpy as np
+
+from .offset_cache import fileFingerprint
+from .structure_index import StructureIndex
+
+
+# manifest format version (increment when the prepared products change)
+REFERENCE_CACHE_VERSION = 1
+
+MANIFEST_FILENAME = 'manifest.json'
+
+
+# Reference source files of a configuration, keyed by INPUT.REF item
+def referenceSources(config):
+    return {key: value for key, value in config['INPUT.REF'].items()
+            if key.lower().endswith('filename') and value}
+
+
+class ReferenceCache:
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.manifestFilename = os.path.join(folder, MANIFEST_FILENAME)
+
+    # Manifest identifying the prepared products: cache version, source file
+    # fingerprints and preparation parameters
+    def identity(self, sources, params=None):
+        return {
+            'version': REFERENCE_CACHE_VERSION,
+            'sources': {key: {'filename': os.path.abspath(filename), 'fingerprint': fileFingerprint(filename)}
+                        for key, filename in sorted(sources.items())},
+            'params': params or {},
+        }
+
+    # Prepared reference products (arrays memory mapped read-only when "mmap"
+    # is set), or None if not cached or if the sources/parameters changed
+    def load(self, sources, params=None, mmap=True):
+        if not os.path.isfile(self.manifestFilename):
+            return None
+
+        try:
+            with open(self.manifestFilename, 'r') as fid:
+                manifest = json.load(fid)
+        except (OSError, ValueError):
+            print('WARNING: unreadable reference cache manifest <{}>'.format(self.manifestFilename))
+            return None
+
+        identity = self.identity(sources, params)
+        for key in identity:
+            if manifest.get(key) != identity[key]:
+                print('Reference cache <{}> is out of date ({} changed)'.format(self.folder, key))
+                return None
+
+        mode = 'r' if mmap else None
+        data = dict(manifest['values'])
+        for key, item in manifest['arrays'].items():
+            data[key] = np.load(os.path.join(self.folder, item), mmap_mode=mode, allow_pickle=False)
+        for key, items in manifest['structures'].items():
+            data[key] = StructureIndex(*(np.load(os.path.join(self.folder, items[name]),
+                mmap_mode=mode, allow_pickle=False) for name in ('labels', 'starts', 'lengths', 'offsets')),
+                shape=tuple(manifest['values'][key + '_shape']))
+            del data[key + '_shape']
+
+        return data
+
+    # Save prepared reference products: arrays, StructureIndex objects and
+    # JSON-compatible values. The manifest is written last, so an interrupted
+    # save leaves the cache invalid rather than inconsistent.
+    def save(self, data, sources, params=None):
+        os.makedirs(self.folder, exist_ok=True)
+        if os.path.isfile(self.manifestFilename):
+            os.remove(self.manifestFilename)
+
+        manifest = self.identity(sources, params)
+        manifest.update({'arrays': {}, 'structures': {}, 'values': {}})
+
+        for key, value in data.items():
+            if isinstance(value, np.ndarray):
+                manifest['arrays'][key] = key + '.npy'
+                np.save(os.path.join(self.folder, key + '.npy'), value, allow_pickle=False)
+            elif isinstance(value, StructureIndex):
+                manifest['structures'][key] = {}
+                for name in ('labels', 'starts', 'lengths', 'offsets'):
+                    filename = '{}_{}.npy'.format(key, name)
+                    manifest['structures'][key][name] = filename
+                    np.save(os.path.join(self.folder, filename), getattr(value, name), allow_pickle=False)
+                manifest['values'][key + '_shape'] = list(value.shape)
+            else:
+                manifest['values'][key] = value
+
+        tmp = self.manifestFilename + '.tmp'
+        with open(tmp, 'w') as fid:
+            json.dump(manifest, fid, indent=2)
+        os.replace(tmp, self.manifestFilename)
+
+    # remove all cached products
+    def clear(self):
+        if not os.path.isdir(self.folder):
+            return
+        if os.path.isfile(self.manifestFilename):
+            os.remove(self.manifestFilename)
+        for filename in os.listdir(self.folder):
+            if filename.endswith('.npy'):
+                os.remove(os.path.join(self.folder, filename))
@@ -1,5 +1,6 @@
 #
-# Align two gridded 3D models using align3d executable.
+# Align two gridded 3D models using align3d executable,
+# or the in-process NumPy/SciPy estimator.
 #
 
 import os
@@ -7,8 +8,10 @@ import platform
 import numpy as np
 import gdal
 
+from .image import imageLoad, imageWarp, getNoDataValue, isPointCloud, pointCloudToGrid
 
-def align3d(reference_filename, test_filename, exec_path=None):
+
+def align3d(reference_filename, test_filename, exec_path=None, maxt=10.0):
 
     # align3d executable (typically on the system $PATH)
     exec_filename = 'align3d'
@@ -26,7 +29,7 @@ def align3d(reference_filename, test_filename, exec_path=None):
     test_filename = os.path.abspath(test_filename)
 
     # Run align3d.
-    command = exec_filename + " " + reference_filename + " " + test_filename + ' maxt=10.0'
+    command = exec_filename + " " + reference_filename + " " + test_filename + ' maxt={}'.format(float(maxt))
     print("")
     print("Registering test model to reference model to determine XYZ offset.")
     print("")
@@ -50,6 +53,147 @@ def align3d(reference_filename, test_filename, exec_path=None):
     return offsets
 
 
+# Register test model to reference model in-process, without the align3d executable
+# or any intermediate files.  The test DSM (or LAS/LAZ point cloud, gridded with
+# the point reduction & hole fill used for evaluation) is resampled onto the
+# reference DSM grid and the XYZ offset is estimated by estimateXYZoffset.
+def align3d_inprocess(reference_filename, test_filename, maxt=10.0, pointCloudReduction='max',
+                      pointCloudHoleFill='none'):
+
+    print("")
+    print("Registering test model to reference model to determine XYZ offset (in-process).")
+    print("")
+
+    noDataValue = -9999
+    refDSM, tform = imageLoad(reference_filename)
+    refDSM = refDSM.astype(np.float32)
+    refNDV = getNoDataValue(reference_filename)
+    if refNDV is not None:
+        refDSM[refDSM == refNDV] = np.nan
+
+    if isPointCloud(test_filename):
+        testDSM = pointCloudToGrid(test_filename, reference_filename, reduction=pointCloudReduction,
+            holeFill=pointCloudHoleFill, noDataValue=noDataValue)
+    else:
+        testDSM = imageWarp(test_filename, reference_filename, noDataValue=noDataValue).astype(np.float32)
+    testDSM[testDSM == noDataValue] = np.nan
+
+    offsets = estimateXYZoffset(refDSM, testDSM, tform, maxt=maxt)
+    print('XYZ offset = {}'.format(offsets))
+    return offsets
+
+
+# Estimate the XYZ offset [dx, dy, dz] (in map units) that registers testDSM
+# to refDSM, where both are on the same grid (GDAL geotransform "tform") with
+# invalid pixels set to NaN.  Following align3d, the offset is applied by
+# adding dx/dy to the test geotransform and dz to the test heights.
+#
+# The horizontal offset is found by a coarse-to-fine search over integer pixel
+# shifts on an image pyramid (exhaustive within "maxt" at the coarsest level,
+# +/-1 pixel at each finer level), scoring each shift by the mean absolute
+# deviation of the height differences from their median.  The final shift is
+# refined to sub-pixel precision by a parabolic fit to the neighboring scores,
+# and dz is the median height difference at that shift.
+def estimateXYZoffset(refDSM, testDSM, tform, maxt=10.0, minPyramidSize=64, verbose=False):
+
+    refDSM = np.asarray(refDSM, dtype=np.float32)
+    testDSM = np.asarray(testDSM, dtype=np.float32)
+    if refDSM.shape != testDSM.shape:
+        raise ValueError('Reference and test DSMs must share the same grid')
+
+    # search radius (pixels) at full resolution
+    gsd = (abs(tform[1]) + abs(tform[5])) / 2
+    radius = max(1, int(np.ceil(maxt / gsd)))
+
+    # pyramid levels: coarsest search radius of a few pixels, while keeping
+    # enough pixels to score each shift
+    numLevels = 0
+    while (radius >> numLevels) > 4 and (min(refDSM.shape) >> (numLevels+1)) >= minPyramidSize:
+        numLevels += 1
+
+    pyramid = [(refDSM, testDSM)]
+    for level in range(numLevels):
+        pyramid.append((downsampleDSM(pyramid[-1][0]), downsampleDSM(pyramid[-1][1])))
+
+    # coarse-to-fine integer search
+    shift = None
+    for level in reversed(range(numLevels+1)):
+        ref, test = pyramid[level]
+        if shift is None:
+            r = int(np.ceil(radius / 2**level))
+            candidates = [(dr, dc) for dr in range(-r, r+1) for dc in range(-r, r+1)]
+        else:
+            shift = (2*shift[0], 2*shift[1])
+            candidates = [(shift[0]+dr, shift[1]+dc) for dr in (-1,0,1) for dc in (-1,0,1)]
+
+        # no valid overlap at any candidate (e.g. mostly no data): keep the
+        # current shift (zero at the coarsest level)
+        costs = [shiftCost(ref, test, dr, dc) for dr, dc in candidates]
+        if np.all(np.isnan(costs)):
+            shift = shift or (0, 0)
+            if verbose:
+                print('  level {}: no valid overlap, shift (row,col) = {}'.format(level, shift))
+            continue
+
+        shift = candidates[int(np.nanargmin(costs))]
+        if verbose:
+            print('  level {}: shift (row,col) = {}, cost = {:.4f}'.format(level, shift, np.nanmin(costs)))
+
+    # sub-pixel refinement
+    row, col = float(shift[0]), float(shift[1])
+    center = shiftCost(refDSM, testDSM, *shift)
+    for axis in (0, 1):
+        step = (1, 0) if axis == 0 else (0, 1)
+        lo = shiftCost(refDSM, testDSM, shift[0]-step[0], shift[1]-step[1])
+        hi = shiftCost(refDSM, testDSM, shift[0]+step[0], shift[1]+step[1])
+        denom = lo - 2*center + hi
+        if np.isfinite(denom) and denom > 0:
+            delta = float(np.clip(0.5 * (lo - hi) / denom, -0.5, 0.5))
+            if axis == 0: row += delta
+            else: col += delta
+
+    # vertical offset at the final shift
+    from scipy import ndimage
+    shifted = ndimage.shift(testDSM, (row, col), order=1, mode='constant', cval=np.nan)
+    delta = refDSM - shifted
+    delta = delta[np.isfinite(delta)]
+    dz = float(np.median(delta)) if delta.size else 0.0
+
+    # pixel shift to map units
+    dx = col * tform[1]
+    dy = row * tform[5]
+    return [float(dx), float(dy), dz]
+
+
+# Mean absolute deviation of refDSM - testDSM from its median,
+# with testDSM shifted by (drow, dcol) integer pixels
+def shiftCost(refDSM, testDSM, drow, dcol):
+    nrows, ncols = refDSM.shape
+    if abs(drow) >= nrows or abs(dcol) >= ncols:
+        return np.nan
+
+    ref = refDSM[max(drow,0):nrows+min(drow,0), max(dcol,0):ncols+min(dcol,0)]
+    test = testDSM[max(-drow,0):nrows+min(-drow,0), max(-dcol,0):ncols+min(-dcol,0)]
+
+    delta = ref - test
+    delta = delta[np.isfinite(delta)]
+    if delta.size == 0:
+        return np.nan
+
+    return float(np.mean(np.abs(delta - np.median(delta))))
+
+
+# Downsample DSM by a factor of two (NaN-aware block average)
+def downsampleDSM(img):
+    nrows, ncols = (img.shape[0] // 2) * 2, (img.shape[1] // 2) * 2
+    blocks = img[:nrows, :ncols].reshape(nrows // 2, 2, ncols // 2, 2)
+    valid = np.isfinite(blocks)
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    count = valid.sum(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (total / count).astype(np.float32)
+
+
 def readXYZoffset(filename):
     with open(filename, "r") as fid:
         offsetstr = fid.readlines()        
@@ -1,9 +1,73 @@
 
 import numpy as np
-from scipy.signal import convolve2d
+from scipy import ndimage
 from scipy.spatial import cKDTree
 
-def run_relative_accuracy_metrics(refDSM, testDSM, refMask, testMask, ignoreMask, gsd, plot=None):
+from .metrics_util import calcPercentiles
+
+# nearest test edge search methods for relative horizontal accuracy
+HORIZONTAL_ACCURACY_METHODS = ('kdtree', 'distance_transform')
+
+
+# Binary erosion of "mask" by a 3x3 square, where neighbors beyond the image
+# boundary mirror the boundary pixels.  Equivalent to a symmetric-boundary 3x3
+# convolution sum equal to 9, computed as separable row & column AND tests on
+# a bool array.
+def erode3x3(mask):
+    padded = np.pad(np.asarray(mask, dtype=bool), 1, mode='edge')
+    rows = padded[:-2] & padded[1:-1]
+    rows &= padded[2:]
+    eroded = rows[:, :-2] & rows[:, 1:-1]
+    eroded &= rows[:, 2:]
+    return eroded
+
+
+# Perimeter pixels of "mask" (mask pixels with any 3x3 neighbor outside the
+# mask), optionally restricted to "validInterior" (e.g. erode3x3(validMask),
+# excluding pixels adjacent to invalid data)
+def edgeMask(mask, validInterior=None):
+    edge = erode3x3(mask)
+    np.logical_not(edge, out=edge)
+    edge &= mask
+    if validInterior is not None:
+        edge &= validInterior
+    return edge
+
+
+# Nearest test edge pixel to each reference edge pixel, returning distances
+# (pixels) and nearest (rows, cols), the latter only if "nearest" is set.
+# "kdtree" queries a KD tree of all test edge pixels, while "distance_transform"
+# reads an exact Euclidean distance transform of the test edge map at the
+# reference edge pixels, which scales with image size rather than with the
+# number of (possibly noisy) test edge pixels.
+# Without test edge pixels, all distances are infinite (and the nearest points
+# are the reference points themselves) for either method.
+def nearestEdgeDistance(refEdge, testEdge, method='kdtree', nearest=False):
+    if method not in HORIZONTAL_ACCURACY_METHODS:
+        raise ValueError('Unrecognized horizontal accuracy method "{}"'.format(method))
+
+    refPts = refEdge.nonzero()
+
+    if not np.any(testEdge):
+        return np.full(len(refPts[0]), np.inf), (refPts if nearest else None)
+
+    if method == 'distance_transform':
+        result = ndimage.distance_transform_edt(~testEdge, return_indices=nearest)
+        if not nearest:
+            return result[refPts], None
+        distanceMap, indices = result
+        return distanceMap[refPts], (indices[0][refPts], indices[1][refPts])
+
+    testPts = testEdge.nonzero()
+    tree = cKDTree(np.transpose(testPts))
+    dist, indexes = tree.query(np.transpose(refPts))
+    if not nearest:
+        return dist, None
+    return dist, (testPts[0][indexes], testPts[1][indexes])
+
+
+def run_relative_accuracy_metrics(refDSM, testDSM, refMask, testMask, ignoreMask, gsd, plot=None,
+                                  method='kdtree'):
 
     PLOTS_ENABLE = True
     if plot is None: PLOTS_ENABLE = False
@@ -18,9 +82,7 @@ def run_relative_accuracy_metrics(refDSM, testDSM, refMask, testMask, ignoreMask
     # Z68 approximates ZRMSE assuming normal error distribution.
     delta = testDSM - refDSM
     overlap = refMask & testMask & validMask
-    z68 = np.percentile(abs(delta[overlap]),68)
-    z50 = np.percentile(abs(delta[overlap]),50)
-    z90 = np.percentile(abs(delta[overlap]),90)
+    z68, z50, z90 = calcPercentiles(delta[overlap], [68, 50, 90])
 
     # Generate relative vertical accuracy plots
     if PLOTS_ENABLE:
@@ -34,25 +96,17 @@ def run_relative_accuracy_metrics(refDSM, testDSM, refMask, testMask, ignoreMask
     # Consider only objects selected in reference mask.
 
     # Find region edge pixels
-    kernel = np.ones((3, 3), np.int)
-    refEdge = convolve2d(refMask.astype(np.int), kernel, mode="same", boundary="symm")
-    testEdge = convolve2d(testMask.astype(np.int), kernel, mode="same", boundary="symm")
-    validEdge = convolve2d(validMask.astype(np.int), kernel, mode="same", boundary="symm")
-    refEdge = (refEdge < 9) & refMask & (validEdge == 9) 
-    testEdge = (testEdge < 9) & testMask & (validEdge == 9)
-    refPts = refEdge.nonzero()
-    testPts = testEdge.nonzero()
+    validInterior = erode3x3(validMask)
+    refEdge = edgeMask(refMask, validInterior)
+    testEdge = edgeMask(testMask, validInterior)
 
-    # Use KD Tree to find test point nearest each reference point
-    tree = cKDTree(np.transpose(testPts))
-    dist, indexes = tree.query(np.transpose(refPts))
+    # Find test point nearest each reference point
+    dist, nearestPts = nearestEdgeDistance(refEdge, testEdge, method, nearest=PLOTS_ENABLE)
     dist = dist * gsd
 
     # Calculate horizontal percentile errors.
     # H63 approximates HRMSE assuming binormal error distribution.
-    h63 = np.percentile(abs(dist),63)
-    h50 = np.percentile(abs(dist),50)
-    h90 = np.percentile(abs(dist),90)
+    h63, h50, h90 = calcPercentiles(dist, [63, 50, 90])
 
     # Generate relative horizontal accuracy plots
     if PLOTS_ENABLE:
@@ -63,10 +117,12 @@ def run_relative_accuracy_metrics(refDSM, testDSM, refMask, testMask, ignoreMask
 
         plt = plot.make(None,'Relative Horizontal Accuracy')
         plt.imshow(refMask & validMask, cmap='Greys')
+        refPts = refEdge.nonzero()
+        testPts = testEdge.nonzero()
         plt.plot(refPts[1], refPts[0], 'r,')
         plt.plot(testPts[1], testPts[0], 'b,')
 
-        plt.plot((refPts[1], testPts[1][indexes]), (refPts[0], testPts[0][indexes]), 'y', linewidth=0.05)
+        plt.plot((refPts[1], nearestPts[1]), (refPts[0], nearestPts[0]), 'y', linewidth=0.05)
         plot.save("relHorzAcc_nearestPoints")
 
     metrics = {
@@ -0,0 +1,67 @@
+#
+# Scratch storage for large intermediate arrays.
+#
+
+import os
+import shutil
+import tempfile
+import weakref
+import numpy as np
+
+
+# Allocates intermediate arrays as np.memmap files in a private scratch folder
+# (created within "folder"), so large rasters & masks are backed by the page
+# cache rather than private heap, allowing the OS to write back and evict them
+# under memory pressure when several evaluations share one node.  The folder
+# is removed by close (or when the object is garbage collected / at exit).
+# Without a folder, arrays are ordinary in-memory NumPy arrays.
+class ScratchArrays:
+
+    def __init__(self, folder=None):
+        self.folder = None
+        self.count = 0
+        self._finalizer = None
+
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+            self.folder = tempfile.mkdtemp(prefix='core3dmetrics-', dir=folder)
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self.folder, True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def enabled(self):
+        return self.folder is not None
+
+    # uninitialized array (memory mapped files are zero filled)
+    def empty(self, shape, dtype=np.float64):
+        shape = tuple(shape) if np.iterable(shape) else (shape,)
+        if not self.enabled or int(np.prod(shape)) == 0:
+            return np.empty(shape, dtype)
+
+        self.count += 1
+        filename = os.path.join(self.folder, '{:04d}.dat'.format(self.count))
+        return np.memmap(filename, dtype=dtype, mode='w+', shape=shape)
+
+    def zeros(self, shape, dtype=np.float64):
+        if not self.enabled:
+            return np.zeros(shape, dtype)
+        return self.empty(shape, dtype)
+
+    # copy of an array in scratch storage (the array itself when disabled)
+    def store(self, array):
+        if not self.enabled or array is None:
+            return array
+        out = self.empty(array.shape, array.dtype)
+        out[...] = array
+        return out
+
+    # remove the scratch folder; arrays allocated here must no longer be used
+    def close(self):
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
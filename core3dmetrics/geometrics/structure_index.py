@@ -0,0 +1,95 @@
+#
+# Compact index of structure pixel membership for NDX rasters.
+#
+
+import numpy as np
+
+
+# Pixel membership of each structure in a label image, stored in CSR form.
+# Flat (row-major) pixel offsets are grouped by structure and sorted within
+# each group, so the pixels of labels[k] are offsets[starts[k]:starts[k]+lengths[k]].
+class StructureIndex:
+
+    def __init__(self, labels, starts, lengths, offsets, shape):
+        self.labels = np.asarray(labels)
+        self.starts = np.asarray(starts)
+        self.lengths = np.asarray(lengths)
+        self.offsets = np.asarray(offsets)
+        self.shape = tuple(int(v) for v in shape)
+
+    @classmethod
+    def fromImage(cls, img, minPixels=10):
+        img = np.asarray(img)
+        flat = img.ravel()
+        if np.issubdtype(flat.dtype, np.signedinteger):
+            flat = np.maximum(flat, 0)
+
+        # pixel count per structure index (index 0 is background)
+        counts = np.bincount(flat)
+        counts[:1] = 0
+
+        # Remove very small structures that occur due to an issue with slightly overlapping structure footprints
+        # TODO: Fix structure footprint generation, then remove this code
+        keep = counts >= minPixels
+        labels = np.flatnonzero(keep)
+
+        # group pixel offsets by label (stable sort keeps raster order within each structure)
+        offsetType = np.uint32 if flat.size <= np.iinfo(np.uint32).max else np.uint64
+        pixels = np.flatnonzero(keep[flat]).astype(offsetType)
+        offsets = pixels[np.argsort(flat[pixels], kind='stable')]
+
+        lengths = counts[labels].astype(offsetType)
+        starts = np.zeros_like(lengths)
+        np.cumsum(lengths[:-1], out=starts[1:])
+
+        return cls(labels.astype(img.dtype), starts, lengths, offsets, img.shape)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename, allow_pickle=False) as data:
+            return cls(data['labels'], data['starts'], data['lengths'], data['offsets'], data['shape'])
+
+    def save(self, filename):
+        np.savez(filename, labels=self.labels, starts=self.starts, lengths=self.lengths,
+                 offsets=self.offsets, shape=np.array(self.shape))
+
+    def __len__(self):
+        return self.labels.size
+
+    def __contains__(self, label):
+        return self.position(label) is not None
+
+    # position of a structure label within the index (None if not indexed)
+    def position(self, label):
+        k = np.searchsorted(self.labels, label)
+        if k < self.labels.size and self.labels[k] == label:
+            return int(k)
+        return None
+
+    # flat pixel offsets of a single structure
+    def pixels(self, label):
+        k = self.position(label)
+        if k is None:
+            raise KeyError('Structure {} is not indexed'.format(label))
+        return self.offsets[self.starts[k]:self.starts[k] + self.lengths[k]]
+
+    # (row, column) coordinates of a single structure
+    def coordinates(self, label):
+        return np.unravel_index(self.pixels(label), self.shape)
+
+    # structure position for every indexed pixel, aligned with self.offsets
+    def memberPositions(self):
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    # values of an image sampled at every indexed pixel, aligned with self.offsets
+    def sample(self, img):
+        img = np.asarray(img)
+        if img.shape != self.shape:
+            raise ValueError('Image shape {} does not match structure index shape {}'.format(
+                img.shape, self.shape))
+        return img.ravel()[self.offsets]
+
+
+# Return index of structures identified by their NDX values.
+def getStructures(img, minPixels=10):
+    return StructureIndex.fromImage(img, minPixels)
@@ -0,0 +1,180 @@
+#
+# Per-structure threshold geometry & relative accuracy metrics, keyed by the
+# reference structure index (refNDX) label.
+#
+
+import csv
+import numpy as np
+from scipy import ndimage
+
+from .metrics_util import getUnitArea, getUnitWidth
+from .relative_accuracy_metrics import erode3x3, edgeMask, nearestEdgeDistance
+
+
+# table columns, in output order
+STRUCTURE_COLUMNS = (
+    'index',
+    'ref_area', 'test_area', 'tp_area', 'fn_area', 'fp_area',
+    'completeness_2d', 'correctness_2d',
+    'ref_volume', 'test_volume', 'tp_volume', 'fn_volume', 'fp_volume',
+    'z50', 'zrmse', 'z90',
+    'h50', 'hrmse', 'h90',
+)
+
+
+# Percentiles "q" (0-100) of "values" within each group "labels" (integers in
+# [0, numLabels)), matching np.percentile linear interpolation.  All groups are
+# evaluated together from a single (label, value) sort.  Returns an array of
+# shape (numLabels, len(q)), NaN for empty groups.
+def groupPercentiles(labels, values, q, numLabels):
+    q = np.asarray(q, np.float64) / 100
+    out = np.full((numLabels, q.size), np.nan)
+
+    labels = np.asarray(labels).ravel()
+    if labels.size == 0:
+        return out
+
+    order = np.lexsort((values, labels))
+    values = np.asarray(values, np.float64).ravel()[order]
+
+    counts = np.bincount(labels, minlength=numLabels)
+    starts = np.cumsum(counts) - counts
+    present = np.flatnonzero(counts)
+
+    pos = (counts[present, None] - 1) * q[None, :]
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, counts[present, None] - 1)
+    frac = pos - lo
+    base = starts[present, None]
+    out[present] = values[base + lo] * (1 - frac) + values[base + hi] * frac
+    return out
+
+
+# Test footprint components are attributed to the reference structure they
+# overlap most; returns the structure label of every component (0 = none)
+def assignTestComponents(testComponents, numComponents, refLabels, numLabels):
+    assigned = np.zeros(numComponents + 1, np.int64)
+
+    overlap = (testComponents > 0) & (refLabels > 0)
+    if not np.any(overlap):
+        return assigned
+
+    pairs = testComponents[overlap].astype(np.int64) * numLabels + refLabels[overlap]
+    pairs, counts = np.unique(pairs, return_counts=True)
+    comps, labels = np.divmod(pairs, numLabels)
+
+    # largest overlap per component (last after sorting by component, count)
+    order = np.lexsort((counts, comps))
+    last = np.r_[comps[order][1:] != comps[order][:-1], True]
+    assigned[comps[order][last]] = labels[order][last]
+    return assigned
+
+
+# Per-structure metrics, computed in one vectorized pass with label-indexed
+# bincounts.  Reference footprint pixels belong to their refNDX structure; test
+# only (FP) pixels belong to the structure overlapped most by their connected
+# test component, or to index 0 if that component overlaps no structure.
+# Areas are in pixels and volumes in cubic meters, following the scene-wide
+# threshold geometry metrics.  Height (z) errors are taken over TP pixels, and
+# horizontal (h) errors over the reference edge pixels of each structure.
+# Returns a columnar table (dict of equal length arrays, see STRUCTURE_COLUMNS)
+# with one row per structure that has any reference or test area.
+def run_structure_metrics(refNDX, refDSM, refDTM, refMask, testDSM, testDTM, testMask,
+                          tform, ignoreMask, horizontalMethod='kdtree'):
+
+    refNDX = np.asarray(refNDX).astype(np.int64, copy=False)
+    numLabels = int(refNDX.max()) + 1 if refNDX.size else 1
+
+    # 2D footprints for evaluation
+    validMask = ~ignoreMask
+    refFootprint = refMask & validMask
+    testFootprint = testMask & validMask
+    tpMask = refFootprint & testFootprint
+    fpMask = testFootprint & ~refFootprint
+
+    # owning structure of every pixel
+    testComponents, numComponents = ndimage.label(testFootprint)
+    assigned = assignTestComponents(testComponents, numComponents,
+        np.where(refFootprint, refNDX, 0), numLabels)
+    owner = np.where(refFootprint, refNDX, assigned[testComponents]).ravel()
+
+    def count(mask):
+        return np.bincount(owner, weights=mask.ravel(), minlength=numLabels)
+
+    # building heights, with reference underground structures flipped
+    # (see threshold geometry metrics)
+    refHeight = np.where(refFootprint, refDSM - refDTM, 0).astype(np.float64)
+    testHeight = np.where(testFootprint, testDSM - testDTM, 0).astype(np.float64)
+    flip = refHeight < 0
+    refHeight = np.abs(refHeight)
+    testHeight[flip] *= -1
+
+    above = np.maximum(testHeight, 0)
+    below = np.abs(testHeight) - above
+    tpHeight = np.minimum(refHeight, above)
+
+    unitArea = getUnitArea(tform)
+
+    def volume(height):
+        return np.bincount(owner, weights=height.ravel(), minlength=numLabels) * unitArea
+
+    table = {
+        'ref_area': count(refFootprint),
+        'test_area': count(testFootprint),
+        'tp_area': count(tpMask),
+        'fn_area': count(refFootprint & ~testFootprint),
+        'fp_area': count(fpMask),
+        'ref_volume': volume(refHeight),
+        'test_volume': volume(np.abs(testHeight)),
+        'tp_volume': volume(tpHeight),
+        'fn_volume': volume(refHeight - tpHeight),
+        'fp_volume': volume(above - tpHeight + below),
+    }
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table['completeness_2d'] = table['tp_area'] / (table['tp_area'] + table['fn_area'])
+        table['correctness_2d'] = table['tp_area'] / (table['tp_area'] + table['fp_area'])
+
+    # height errors over TP pixels (z68 approximates ZRMSE)
+    zerr = groupPercentiles(refNDX[tpMask], np.abs(testDSM - refDSM)[tpMask], [50, 68, 90], numLabels)
+    table['z50'], table['zrmse'], table['z90'] = zerr.T
+
+    # horizontal errors at reference edge pixels (h63 approximates HRMSE)
+    validInterior = erode3x3(validMask)
+    refEdge = edgeMask(refMask, validInterior)
+    testEdge = edgeMask(testMask, validInterior)
+    if np.any(refEdge) and np.any(testEdge):
+        dist, _ = nearestEdgeDistance(refEdge, testEdge, horizontalMethod)
+        herr = groupPercentiles(refNDX[refEdge], dist * getUnitWidth(tform), [50, 63, 90], numLabels)
+    else:
+        herr = np.full((numLabels, 3), np.nan)
+    table['h50'], table['hrmse'], table['h90'] = herr.T
+
+    # rows with any reference or test area
+    rows = np.flatnonzero((table['ref_area'] > 0) | (table['test_area'] > 0))
+    table = {key: table[key][rows] for key in table}
+    table['index'] = rows
+    for key in ('ref_area', 'test_area', 'tp_area', 'fn_area', 'fp_area'):
+        table[key] = table[key].astype(np.int64)
+
+    return {key: table[key] for key in STRUCTURE_COLUMNS}
+
+
+# Write a columnar table (dict of equal length arrays) as CSV, with optional
+# constant leading columns (e.g. the CLS match set)
+def writeStructureTable(filename, tables):
+    if isinstance(tables, dict):
+        tables = [({}, tables)]
+
+    with open(filename, 'w', newline='') as fid:
+        writer = None
+        for extra, table in tables:
+            columns = list(extra) + list(table)
+            if writer is None:
+                writer = csv.writer(fid)
+                writer.writerow(columns)
+
+            numRows = len(next(iter(table.values()))) if table else 0
+            values = [table[key].tolist() for key in table]
+            for row in range(numRows):
+                writer.writerow(list(extra.values()) + [column[row] for column in values])
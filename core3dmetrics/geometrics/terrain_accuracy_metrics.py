@@ -2,7 +2,7 @@ import numpy as np
 import os
 import sys
 
-from .metrics_util import calcMops
+from .metrics_util import calcMops, calcPercentiles, PercentileSketch
 
 def run_terrain_accuracy_metrics(refDTM, testDTM, refMask, threshold=1, plot=None):
 
@@ -11,15 +11,13 @@ def run_terrain_accuracy_metrics(refDTM, testDTM, refMask, threshold=1, plot=Non
 
     # Compute Z error percentiles.
     # Ignore objects identified by the reference mask because the
-    # ground is not expected to be observable under those objects.
+    # ground is not expected to be observable under those objects,
+    # and non-finite errors (e.g. NaN heights), as PercentileSketch does.
     delta = testDTM - refDTM
-    delta_minus_mask = delta[np.where(refMask == 0)]
-    z68 = np.percentile(abs(delta_minus_mask),68)
-    z50 = np.percentile(abs(delta_minus_mask),50)
-    z90 = np.percentile(abs(delta_minus_mask),90)
+    z68, z50, z90 = calcPercentiles(delta[(refMask == 0) & np.isfinite(delta)], [68, 50, 90])
 
     # Compute DTM completeness.
-    match = abs(testDTM - refDTM) < threshold
+    match = abs(delta) < threshold
     completeness = np.sum(match)/np.size(match)
 
     # This is a hack to avoid water flattening at z = -1 in reference DTM files from 133 US Cities 
@@ -44,4 +42,50 @@ def run_terrain_accuracy_metrics(refDTM, testDTM, refMask, threshold=1, plot=Non
 		'completeness_water_removed': completeness_water_removed
     }
 
-    return metrics
\ No newline at end of file
+    return metrics
+
+
+# Accumulate terrain accuracy totals over one block of aligned inputs (e.g.
+# tiles of a larger raster): Z errors in a mergeable PercentileSketch (which
+# drops non-finite errors, as run_terrain_accuracy_metrics), and pixel counts
+# for DTM completeness. Totals from separate blocks are combined by
+# passing in the running totals, and reported by finalize_terrain_accuracy.
+def accumulate_terrain_accuracy(refDTM, testDTM, refMask, threshold=1, totals=None, relativeAccuracy=0.001):
+
+    if totals is None:
+        totals = {
+            'sketch': PercentileSketch(relativeAccuracy),
+            'pixels': 0, 'matched': 0,
+            'pixels_water_removed': 0, 'matched_water_removed': 0,
+        }
+
+    delta = testDTM - refDTM
+    totals['sketch'].add(delta[refMask == 0])
+
+    match = abs(delta) < threshold
+    notWater = abs(refDTM + 1.0) > 0.2
+    totals['pixels'] += match.size
+    totals['matched'] += int(np.count_nonzero(match))
+    totals['pixels_water_removed'] += int(np.count_nonzero(notWater))
+    totals['matched_water_removed'] += int(np.count_nonzero(match & notWater))
+
+    return totals
+
+
+# Terrain accuracy metrics (as run_terrain_accuracy_metrics, with approximate
+# percentiles) of accumulated totals
+def finalize_terrain_accuracy(totals):
+    z68, z50, z90 = totals['sketch'].percentiles([68, 50, 90])
+
+    def ratio(matched, pixels):
+        return matched / pixels if pixels else np.nan
+
+    metrics = {
+        'z50': z50,
+        'zrmse': z68,
+        'z90': z90,
+        'completeness': ratio(totals['matched'], totals['pixels']),
+        'completeness_water_removed': ratio(totals['matched_water_removed'], totals['pixels_water_removed'])
+    }
+
+    return metrics
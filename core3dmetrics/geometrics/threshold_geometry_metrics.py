@@ -1,5 +1,4 @@
 import numpy as np
-import os
 import json
 import math
 
@@ -7,77 +6,156 @@ from .metrics_util import calcMops
 from .metrics_util import getUnitArea
 
 
-def run_threshold_geometry_metrics(refDSM, refDTM, refMask, testDSM, testDTM, testMask,
-                                   tform, ignoreMask, plot=None, verbose=True):
-
-
-    # INPUT PARSING==========
-
-    # parse plot input
-    if plot is None:
-        PLOTS_ENABLE = False
-    else:
-        PLOTS_ENABLE = True
-        PLOTS_SAVE_PREFIX = "thresholdGeometry_"
+# Default number of pixels processed per chunk when accumulating totals
+CHUNK_PIXELS = 1 << 20
+
+# Partial sums of each (reference, test) class pair (see accumulate_class_partials)
+CLASS_PARTIALS = ('count', 'ref_abs', 'test_abs', 'tp', 'fn', 'fp')
+
+
+# Accumulate threshold geometry totals (areas in pixels, volumes in height units
+# per pixel) over one block of aligned inputs. Totals from separate blocks
+# (e.g. tiles of a larger raster) are combined by passing in the running totals.
+#
+# All 2D/3D totals are computed in a single pass over row chunks of about
+# "chunkSize" pixels, reusing a fixed set of scratch buffers, so no full-size
+# temporaries are allocated. Heights are computed in "dtype" precision
+# (float32 halves scratch memory), while sums are always accumulated in float64.
+def accumulate_threshold_geometry(refDSM, refDTM, refMask, testDSM, testDTM, testMask,
+                                  ignoreMask, totals=None, chunkSize=CHUNK_PIXELS, dtype=np.float64):
+
+    if totals is None:
+        totals = {
+            'ref_area': 0, 'test_area': 0,
+            'tp_area': 0, 'fn_area': 0, 'fp_area': 0,
+            'ref_volume': 0.0, 'test_volume': 0.0,
+            'tp_volume': 0.0, 'fn_volume': 0.0, 'fp_volume': 0.0,
+            'ref_height_range': [np.inf, -np.inf],
+            'test_height_range': [np.inf, -np.inf],
+        }
+
+    if refDSM.size == 0:
+        return totals
+
+    # rows per chunk & scratch buffers
+    nrows, ncols = refDSM.shape
+    chunkRows = int(max(1, min(nrows, (chunkSize or nrows*ncols) // max(ncols, 1))))
+    bufshape = (chunkRows, ncols)
+
+    ref_height = np.empty(bufshape, dtype)
+    test_height = np.empty(bufshape, dtype)
+    test_above = np.empty(bufshape, dtype)
+    test_below = np.empty(bufshape, dtype)
+    overlap = np.empty(bufshape, dtype)
+
+    ref_footprint = np.empty(bufshape, bool)
+    test_footprint = np.empty(bufshape, bool)
+    valid = np.empty(bufshape, bool)
+    flag = np.empty(bufshape, bool)
+
+    def fsum(x):
+        return float(np.sum(x, dtype=np.float64))
+
+    for r0 in range(0, nrows, chunkRows):
+        rows = slice(r0, min(r0 + chunkRows, nrows))
+        n = rows.stop - rows.start
+
+        rh = ref_height[:n]; th = test_height[:n]
+        above = test_above[:n]; below = test_below[:n]; tp = overlap[:n]
+        rfp = ref_footprint[:n]; tfp = test_footprint[:n]; vld = valid[:n]; tf = flag[:n]
+
+        # 2D footprints for evaluation
+        np.logical_not(ignoreMask[rows], out=vld)
+        np.logical_and(refMask[rows], vld, out=rfp)
+        np.logical_and(testMask[rows], vld, out=tfp)
+
+        # building height (DSM-DTM, with zero elevation outside footprint)
+        np.subtract(refDSM[rows], refDTM[rows], out=rh, dtype=dtype, casting='unsafe')
+        np.logical_not(rfp, out=tf)
+        np.copyto(rh, 0, where=tf)
+
+        np.subtract(testDSM[rows], testDTM[rows], out=th, dtype=dtype, casting='unsafe')
+        np.logical_not(tfp, out=tf)
+        np.copyto(th, 0, where=tf)
+
+        for key, height in (('ref_height_range', rh), ('test_height_range', th)):
+            totals[key] = [min(totals[key][0], float(np.amin(height))),
+                           max(totals[key][1], float(np.amax(height)))]
+
+        # total 2D area (in pixels)
+        ref_area = int(np.count_nonzero(rfp))
+        test_area = int(np.count_nonzero(tfp))
+        totals['ref_area'] += ref_area
+        totals['test_area'] += test_area
+
+        # 2D total area (in pixels): TP, FN (ref only), FP (test only)
+        np.logical_and(rfp, tfp, out=tf)
+        totals['tp_area'] += int(np.count_nonzero(tf))
+        np.logical_not(tfp, out=tf)
+        np.logical_and(rfp, tf, out=tf)
+        totals['fn_area'] += int(np.count_nonzero(tf))
+        np.logical_not(rfp, out=tf)
+        np.logical_and(tfp, tf, out=tf)
+        totals['fp_area'] += int(np.count_nonzero(tf))
+
+        # Flip underground reference structures
+        # flip all heights where ref_height is less than zero, allowing subsequent calculations
+        # to only consider difference relative to positive/absolute reference structures
+        np.less(rh, 0, out=tf)
+        np.absolute(rh, out=rh)
+        np.negative(th, out=th, where=tf)
+
+        # total 3D volume
+        np.absolute(th, out=below)
+        totals['ref_volume'] += fsum(rh)
+        totals['test_volume'] += fsum(below)
+
+        # separate test height into above & below ground sets
+        np.maximum(th, 0, out=above)
+        np.subtract(below, above, out=below)
+
+        # 3D metric totals
+        np.minimum(rh, above, out=tp)   # ref/test height overlap
+        totals['tp_volume'] += fsum(tp)
+
+        np.subtract(rh, tp, out=rh)     # test too short
+        totals['fn_volume'] += fsum(rh)
+
+        np.subtract(above, tp, out=above)  # test too tall OR test below ground
+        np.add(above, below, out=above)
+        totals['fp_volume'] += fsum(above)
+
+    return totals
+
+
+# Convert accumulated threshold geometry totals into final metrics,
+# checking TP/FN/FP consistency against the reference & test totals
+def finalize_threshold_geometry(totals, tform, verbose=True):
 
     # Determine evaluation units.
     unitArea = getUnitArea(tform)
 
-    # 2D footprints for evaluation
-    ref_footprint = refMask & ~ignoreMask
-    test_footprint = testMask & ~ignoreMask
-
-    # building height (DSM-DTM, with zero elevation outside footprint)
-    ref_height = refDSM.astype(np.float64) - refDTM.astype(np.float64)
-    ref_height[~ref_footprint] = 0
-
-    test_height = testDSM.astype(np.float64) - testDTM.astype(np.float64)
-    test_height[~test_footprint] = 0
+    ref_total_area = totals['ref_area']
+    test_total_area = totals['test_area']
+    tp_total_area = totals['tp_area']
+    fn_total_area = totals['fn_area']
+    fp_total_area = totals['fp_area']
 
-    # total 2D area (in pixels)
-    ref_total_area = np.sum(ref_footprint,dtype=np.uint64)
-    test_total_area = np.sum(test_footprint,dtype=np.uint64)
-
-    # total 3D volume (in meters^3)
-    ref_total_volume = np.sum(np.absolute(ref_height)) * unitArea
-    test_total_volume = np.sum(np.absolute(test_height)) * unitArea
+    # volumes (in meters^3)
+    ref_total_volume = totals['ref_volume'] * unitArea
+    test_total_volume = totals['test_volume'] * unitArea
+    tp_total_volume = totals['tp_volume'] * unitArea
+    fn_total_volume = totals['fn_volume'] * unitArea
+    fp_total_volume = totals['fp_volume'] * unitArea
 
     # verbose reporting
     if verbose:
-        print('REF height range [mn,mx] = [{},{}]'.format(np.amin(ref_height),np.amax(ref_height)))
-        print('TEST height range [mn,mx] = [{},{}]'.format(np.amin(test_height),np.amax(test_height)))
+        if 'ref_height_range' in totals:
+            print('REF height range [mn,mx] = [{},{}]'.format(*totals['ref_height_range']))
+            print('TEST height range [mn,mx] = [{},{}]'.format(*totals['test_height_range']))
         print('REF area (px), volume (m^3) = [{},{}]'.format(ref_total_area,ref_total_volume))
         print('TEST area (px), volume (m^3) =  [{},{}]'.format(test_total_area,test_total_volume))
 
-    # plot
-    if PLOTS_ENABLE:
-        print('Input plots...')
-
-        plot.make(ref_footprint, 'Reference Object Regions', 211, saveName=PLOTS_SAVE_PREFIX+"refObjMask")
-        plot.make(ref_height, 'Reference Object Height', 212, saveName=PLOTS_SAVE_PREFIX+"refObjHgt", colorbar=True)
-
-        plot.make(test_footprint, 'Test Object Regions', 251, saveName=PLOTS_SAVE_PREFIX+"testObjMask")
-        plot.make(test_height, 'Test Object Height', 252, saveName=PLOTS_SAVE_PREFIX+"testObjHgt", colorbar=True)
-
-        errorMap = (test_height-ref_height)
-        errorMap[~ref_footprint & ~test_footprint] = np.nan
-        plot.make(errorMap, 'Height Error', 291, saveName=PLOTS_SAVE_PREFIX+"errHgt", colorbar=True)
-        plot.make(errorMap, 'Height Error (clipped)', 292, saveName=PLOTS_SAVE_PREFIX+"errHgtClipped", colorbar=True,
-            vmin=-5,vmax=5)
-
-
-    # 2D ANALYSIS==========
-
-    # 2D metric arrays
-    tp_2D_array =  test_footprint &  ref_footprint
-    fn_2D_array = ~test_footprint &  ref_footprint
-    fp_2D_array =  test_footprint & ~ref_footprint
-
-    # 2D total area (in pixels)
-    tp_total_area = np.sum(tp_2D_array,dtype=np.uint64)
-    fn_total_area = np.sum(fn_2D_array,dtype=np.uint64)
-    fp_total_area = np.sum(fp_2D_array,dtype=np.uint64)
-
     # error check (exact, as this is an integer comparison)
     if (tp_total_area + fn_total_area) != ref_total_area:
         raise ValueError('2D TP+FN ({}+{}) does not equal ref area ({})'.format(
@@ -93,41 +171,6 @@ def run_threshold_geometry_metrics(refDSM, refDTM, refMask, testDSM, testDTM, te
         print('2D TP+FP ({}+{}) equals test area ({})'.format(
             tp_total_area, fp_total_area, test_total_area))
 
-    # plot
-    if PLOTS_ENABLE:
-        print('2D analysis plots...')
-        plot.make(tp_2D_array, 'True Positive Regions',  283, saveName=PLOTS_SAVE_PREFIX+"truePositive")
-        plot.make(fn_2D_array, 'False Negative Regions', 281, saveName=PLOTS_SAVE_PREFIX+"falseNegetive")
-        plot.make(fp_2D_array, 'False Positive Regions', 282, saveName=PLOTS_SAVE_PREFIX+"falsePositive")
-
-
-    # 3D ANALYSIS==========
-
-    # Flip underground reference structures
-    # flip all heights where ref_height is less than zero, allowing subsequent calculations
-    # to only consider difference relative to positive/absolute reference structures
-    tf = ref_height < 0
-    ref_height[tf] = -ref_height[tf]
-    test_height[tf] = -test_height[tf]
-
-    # separate test height into above & below ground sets
-    test_above = np.copy(test_height)
-    test_above[test_height<0] = 0
-
-    test_below = np.copy(test_height)
-    test_below[test_height>0] = 0
-    test_below = np.absolute(test_below)
-
-    # 3D metric arrays
-    tp_3D_array = np.minimum(ref_height,test_above) # ref/test height overlap
-    fn_3D_array = (ref_height - tp_3D_array) # test too short
-    fp_3D_array = (test_above - tp_3D_array) + test_below # test too tall OR test below ground
-
-    # 3D metric total volume (in meters^3)
-    tp_total_volume = np.sum(tp_3D_array)*unitArea
-    fn_total_volume = np.sum(fn_3D_array)*unitArea
-    fp_total_volume = np.sum(fp_3D_array)*unitArea
-
     # error check (floating point comparison via math.isclose)
     if not math.isclose((tp_total_volume + fn_total_volume), ref_total_volume):
         raise ValueError('3D TP+FN ({}+{}) does not equal ref volume ({})'.format(
@@ -143,9 +186,6 @@ def run_threshold_geometry_metrics(refDSM, refDTM, refMask, testDSM, testDTM, te
         print('3D TP+FP ({}+{}) equals test volume ({})'.format(
             tp_total_volume, fp_total_volume, test_total_volume))
 
-
-    # CLEANUP==========
-
     # final metrics
     metrics = {
         '2D': calcMops(tp_total_area, fn_total_area, fp_total_area),
@@ -157,5 +197,196 @@ def run_threshold_geometry_metrics(refDSM, refDTM, refMask, testDSM, testDTM, te
         print('METRICS REPORT:')
         print(json.dumps(metrics,indent=2))
 
-    # return metric dictionary
     return metrics
+
+
+# Accumulate threshold geometry partial sums for every combination of reference
+# and test classification value, from which totals for any set of CLS match
+# values can later be derived (see class_partials_totals) without re-scanning
+# the rasters. "refClasses"/"testClasses" must list every value present in
+# refCLS/testCLS (e.g. np.unique). Partials from separate blocks are combined
+# by passing in the running partials, whose classes are extended with any new
+# values of the block, so the classes of a raster need not be known upfront.
+def accumulate_class_partials(refDSM, refDTM, refCLS, testDSM, testDTM, testCLS, ignoreMask,
+                              refClasses, testClasses, partials=None, chunkSize=CHUNK_PIXELS,
+                              dtype=np.float64):
+
+    refClasses = np.asarray(refClasses)
+    testClasses = np.asarray(testClasses)
+
+    if partials is None:
+        partials = {'refClasses': refClasses, 'testClasses': testClasses}
+        for key in CLASS_PARTIALS:
+            partials[key] = np.zeros((refClasses.size, testClasses.size),
+                np.uint64 if key == 'count' else np.float64)
+    else:
+        partials = _extend_class_partials(partials, refClasses, testClasses)
+        refClasses, testClasses = partials['refClasses'], partials['testClasses']
+    shape = (refClasses.size, testClasses.size)
+
+    if refDSM.size == 0:
+        return partials
+
+    nrows, ncols = refDSM.shape
+    chunkRows = int(max(1, min(nrows, (chunkSize or nrows*ncols) // max(ncols, 1))))
+
+    for r0 in range(0, nrows, chunkRows):
+        rows = slice(r0, min(r0 + chunkRows, nrows))
+
+        # (reference, test) class pair of each pixel, with ignored pixels
+        # assigned to an extra bin that is discarded
+        pairs = np.searchsorted(refClasses, refCLS[rows].ravel())
+        pairs *= shape[1]
+        pairs += np.searchsorted(testClasses, testCLS[rows].ravel())
+        pairs[ignoreMask[rows].ravel()] = shape[0]*shape[1]
+
+        # building heights, assuming pixel is in both the reference & test footprints
+        ref_height = np.subtract(refDSM[rows], refDTM[rows], dtype=dtype, casting='unsafe').ravel()
+        test_height = np.subtract(testDSM[rows], testDTM[rows], dtype=dtype, casting='unsafe').ravel()
+
+        # flip underground reference structures
+        tf = ref_height < 0
+        np.absolute(ref_height, out=ref_height)
+        np.negative(test_height, out=test_height, where=tf)
+
+        test_below = np.absolute(test_height)
+        test_above = np.maximum(test_height, 0)
+        del test_height, tf
+
+        def add(key, weights=None):
+            sums = np.bincount(pairs, weights, minlength=shape[0]*shape[1]+1)[:-1].reshape(shape)
+            partials[key] += sums.astype(partials[key].dtype)
+
+        add('count')
+        add('ref_abs', ref_height)
+        add('test_abs', test_below)
+
+        np.subtract(test_below, test_above, out=test_below)
+        tp = np.minimum(ref_height, test_above)
+        add('tp', tp)
+        add('fn', ref_height - tp)
+        add('fp', (test_above - tp) + test_below)
+
+    return partials
+
+
+# Class partials over the union of their classes and "refClasses"/"testClasses"
+# (the partials themselves when no class is new)
+def _extend_class_partials(partials, refClasses, testClasses):
+    refUnion = np.union1d(partials['refClasses'], refClasses)
+    testUnion = np.union1d(partials['testClasses'], testClasses)
+    if refUnion.size == partials['refClasses'].size and testUnion.size == partials['testClasses'].size:
+        return partials
+
+    index = np.ix_(np.searchsorted(refUnion, partials['refClasses']),
+                   np.searchsorted(testUnion, partials['testClasses']))
+    extended = {'refClasses': refUnion, 'testClasses': testUnion}
+    for key in CLASS_PARTIALS:
+        extended[key] = np.zeros((refUnion.size, testUnion.size), partials[key].dtype)
+        extended[key][index] = partials[key]
+    return extended
+
+
+# Threshold geometry totals for one set of reference & test CLS match values,
+# derived from class partial sums
+def class_partials_totals(partials, refMatchValue, testMatchValue):
+
+    refSel = np.isin(partials['refClasses'], refMatchValue)
+    testSel = np.isin(partials['testClasses'], testMatchValue)
+    both = np.outer(refSel, testSel)
+    refOnly = np.outer(refSel, ~testSel)
+    testOnly = np.outer(~refSel, testSel)
+
+    count = partials['count']
+    totals = {
+        'ref_area': int(count[refSel].sum()),
+        'test_area': int(count[:,testSel].sum()),
+        'tp_area': int(count[both].sum()),
+        'fn_area': int(count[refOnly].sum()),
+        'fp_area': int(count[testOnly].sum()),
+        'ref_volume': float(partials['ref_abs'][refSel].sum()),
+        'test_volume': float(partials['test_abs'][:,testSel].sum()),
+        'tp_volume': float(partials['tp'][both].sum()),
+        'fn_volume': float(partials['fn'][both].sum() + partials['ref_abs'][refOnly].sum()),
+        'fp_volume': float(partials['fp'][both].sum() + partials['test_abs'][testOnly].sum()),
+    }
+    return totals
+
+
+def run_threshold_geometry_metrics(refDSM, refDTM, refMask, testDSM, testDTM, testMask,
+                                   tform, ignoreMask, plot=None, verbose=True, dtype=np.float64):
+
+
+    # INPUT PARSING==========
+
+    # parse plot input
+    if plot is None:
+        PLOTS_ENABLE = False
+    else:
+        PLOTS_ENABLE = True
+        PLOTS_SAVE_PREFIX = "thresholdGeometry_"
+
+    # plot
+    if PLOTS_ENABLE:
+        print('Input plots...')
+
+        # 2D footprints for evaluation
+        ref_footprint = refMask & ~ignoreMask
+        test_footprint = testMask & ~ignoreMask
+
+        # building height (DSM-DTM, with zero elevation outside footprint)
+        ref_height = refDSM.astype(np.float64) - refDTM.astype(np.float64)
+        ref_height[~ref_footprint] = 0
+
+        test_height = testDSM.astype(np.float64) - testDTM.astype(np.float64)
+        test_height[~test_footprint] = 0
+
+        plot.make(ref_footprint, 'Reference Object Regions', 211, saveName=PLOTS_SAVE_PREFIX+"refObjMask")
+        plot.make(ref_height, 'Reference Object Height', 212, saveName=PLOTS_SAVE_PREFIX+"refObjHgt", colorbar=True)
+
+        plot.make(test_footprint, 'Test Object Regions', 251, saveName=PLOTS_SAVE_PREFIX+"testObjMask")
+        plot.make(test_height, 'Test Object Height', 252, saveName=PLOTS_SAVE_PREFIX+"testObjHgt", colorbar=True)
+
+        errorMap = (test_height-ref_height)
+        errorMap[~ref_footprint & ~test_footprint] = np.nan
+        plot.make(errorMap, 'Height Error', 291, saveName=PLOTS_SAVE_PREFIX+"errHgt", colorbar=True)
+        plot.make(errorMap, 'Height Error (clipped)', 292, saveName=PLOTS_SAVE_PREFIX+"errHgtClipped", colorbar=True,
+            vmin=-5,vmax=5)
+        del ref_height, test_height, errorMap
+
+        print('2D analysis plots...')
+        plot.make( test_footprint &  ref_footprint, 'True Positive Regions',  283, saveName=PLOTS_SAVE_PREFIX+"truePositive")
+        plot.make(~test_footprint &  ref_footprint, 'False Negative Regions', 281, saveName=PLOTS_SAVE_PREFIX+"falseNegetive")
+        plot.make( test_footprint & ~ref_footprint, 'False Positive Regions', 282, saveName=PLOTS_SAVE_PREFIX+"falsePositive")
+
+
+    # 2D/3D ANALYSIS==========
+
+    totals = accumulate_threshold_geometry(refDSM, refDTM, refMask, testDSM, testDTM, testMask, ignoreMask,
+                                           dtype=dtype)
+
+    # return metric dictionary
+    return finalize_threshold_geometry(totals, tform, verbose=verbose)
+
+
+# Threshold geometry metrics for several sets of CLS match values in one sweep.
+# Partial sums are accumulated once per combination of reference & test CLS
+# value, and the metrics for every requested set (including unions) are derived
+# from those partials.  Returns a list of metric dictionaries, one per set.
+def run_threshold_geometry_metrics_batch(refDSM, refDTM, refCLS, testDSM, testDTM, testCLS,
+                                         tform, ignoreMask, refCLS_matchSets, testCLS_matchSets,
+                                         refClasses=None, testClasses=None, verbose=True,
+                                         dtype=np.float64):
+
+    if refClasses is None: refClasses = np.unique(refCLS)
+    if testClasses is None: testClasses = np.unique(testCLS)
+
+    partials = accumulate_class_partials(refDSM, refDTM, refCLS, testDSM, testDTM, testCLS,
+                                         ignoreMask, refClasses, testClasses, dtype=dtype)
+
+    results = []
+    for refMatchValue, testMatchValue in zip(refCLS_matchSets, testCLS_matchSets):
+        totals = class_partials_totals(partials, refMatchValue, testMatchValue)
+        results.append(finalize_threshold_geometry(totals, tform, verbose=verbose))
+
+    return results
@@ -4,77 +4,73 @@
 #
 
 import numpy as np
-from collections import defaultdict
-
-# Define structure information data structure.
-class Structure:
-    def __init__(self):
-        self.pixels = []  # list of pixel coordinate (x,y) tuples
-        self.truthPrimaryMaterial = 0  # index of truth primary structure material
-        self.testPrimaryMaterial = 0  # index of test primary structure material
-
-
-# Return dictionary of structures identified by their indices.
-def getStructures(img):
-    structuresDic = defaultdict(Structure)
-    for y in range(len(img)):
-        for x in range(len(img[y])):
-            val = img[y][x]
-            if val > 0:
-                structuresDic[val].pixels.append((x, y))  # add pixel to list for this structure index
-
-    # Remove very small structures that occur due to an issue with slightly overlapping structure footprints
-    # TODO: Fix structure footprint generation, then remove this code
-    for k in list(structuresDic.keys()):
-        if len(structuresDic[k].pixels) < 10:
-            del structuresDic[k]
-    return structuresDic
-
-
-# Determine the most abundant material index within a structure footprint
-#     Returns -1 if no valid material present
-def getMaterialFromStructurePixels(img, pixels, materialIndicesToIgnore):
-    # Count pixels of each material
-    indexCounts = defaultdict(int)
-    for p in range(len(pixels)):
-        indexCounts[img[pixels[p][1]][pixels[p][0]]] += 1
+
+from .structure_index import getStructures
+
+
+# Determine the most abundant material index within each structure footprint
+#     Ties are resolved in favor of the material encountered first in raster order
+#     Returns -1 for structures with no valid material present
+def getStructureMaterials(img, structures, materialIndicesToIgnore):
+    positions = structures.memberPositions()
+    materials = structures.sample(img).astype(np.intp)
+
+    # Discard ignored materials
+    keep = ~np.isin(materials, materialIndicesToIgnore)
+    positions = positions[keep]
+    materials = materials[keep]
+
+    # Count pixels of each material within each structure, recording where each
+    # (structure, material) pair first occurs
+    numMaterials = int(materials.max()) + 1 if materials.size else 1
+    keys, first, counts = np.unique(positions * numMaterials + materials,
+                                    return_index=True, return_counts=True)
+    keyPositions = keys // numMaterials
+    keyMaterials = keys % numMaterials
+
     # Find most abundant material
-    maxMaterialCount = -1
-    maxMaterialCountIndex = -1
-    for k in indexCounts.keys():
-        if indexCounts[k] > maxMaterialCount and k not in materialIndicesToIgnore:
-            maxMaterialCount = indexCounts[k]
-            maxMaterialCountIndex = k
-    return maxMaterialCountIndex
+    order = np.lexsort((first, -counts, keyPositions))
+    keyPositions = keyPositions[order]
+    isBest = np.ones(keyPositions.size, dtype=bool)
+    isBest[1:] = keyPositions[1:] != keyPositions[:-1]
+
+    primaryMaterial = np.full(len(structures), -1, dtype=np.intp)
+    primaryMaterial[keyPositions[isBest]] = keyMaterials[order][isBest]
+    return primaryMaterial
 
 
 # Run material labeling metrics and report results.
-def run_material_metrics(refNDX, refMTL, testMTL, materialNames, materialIndicesToIgnore):
+# A StructureIndex of refNDX may be supplied to avoid rebuilding it for each test model.
+def run_material_metrics(refNDX, refMTL, testMTL, materialNames, materialIndicesToIgnore, structures=None):
     print("Defined materials:",', '.join(materialNames))
     print("Ignored materials in truth: ",', '.join([materialNames[x] for x in materialIndicesToIgnore]))
 
-    print("Building dictionary of reference structure locations and labels...")
-    structuresDic = getStructures(refNDX)
-    print("There are ", len(structuresDic), "reference structures.")
+    numMaterialNames = len(materialNames)
+
+    if structures is None:
+        print("Building index of reference structure locations and labels...")
+        structures = getStructures(refNDX)
+    print("There are ", len(structures), "reference structures.")
 
     print("Selecting the most abundant material for each structure in reference model...")
-    for k in structuresDic.keys():
-        maxIdx = getMaterialFromStructurePixels(refMTL, structuresDic[k].pixels, materialIndicesToIgnore)
-        structuresDic[k].truthPrimaryMaterial = maxIdx
+    truthPrimaryMaterial = getStructureMaterials(refMTL, structures, materialIndicesToIgnore)
 
     print("Selecting the most abundant material for each structure in test model...")
-    for k in structuresDic.keys():
-        maxIdx = getMaterialFromStructurePixels(testMTL, structuresDic[k].pixels, materialIndicesToIgnore)
-        structuresDic[k].testPrimaryMaterial = maxIdx
+    testPrimaryMaterial = getStructureMaterials(testMTL, structures, materialIndicesToIgnore)
 
     # Create pixel label confusion matrix
+    # Limit evaluation to inside structure outlines and to valid materials
     np.set_printoptions(linewidth=120)
-    pixelConfMatrix = np.zeros((len(materialNames), len(materialNames)), dtype=np.int32)
-    for y in range(len(refMTL)):
-        for x in range(len(refMTL[y])):
-            if refNDX[y][x] != 0: # Limit evaluation to inside structure outlines
-                if refMTL[y][x] not in materialIndicesToIgnore: # Limit evaluation to valid materials
-                    pixelConfMatrix[refMTL[y][x]][testMTL[y][x]] += 1
+    scored = (refNDX != 0) & ~np.isin(refMTL, materialIndicesToIgnore)
+    refScored = refMTL[scored].astype(np.intp)
+    testScored = testMTL[scored].astype(np.intp)
+    for img in (refScored, testScored):
+        if img.size and img.max() >= numMaterialNames:
+            raise IndexError('Material index {} exceeds number of material names ({})'.format(
+                img.max(), numMaterialNames))
+    pixelPairs = refScored * numMaterialNames + testScored
+    pixelConfMatrix = np.bincount(pixelPairs, minlength=numMaterialNames**2).astype(np.int32)
+    pixelConfMatrix = pixelConfMatrix.reshape((numMaterialNames, numMaterialNames))
 
     # Print pixel statistics
     print()
@@ -89,13 +85,12 @@ def run_material_metrics(refNDX, refMTL, testMTL, materialNames, materialIndices
     print()
 
     # Create structure label confusion matrix
-    unscoredCount = 0
-    structureConfMatrix = np.zeros((len(materialNames), len(materialNames)), dtype = np.int32)
-    for k in structuresDic.keys():
-        if structuresDic[k].truthPrimaryMaterial not in materialIndicesToIgnore and structuresDic[k].truthPrimaryMaterial != -1:
-            structureConfMatrix[structuresDic[k].truthPrimaryMaterial][structuresDic[k].testPrimaryMaterial] += 1
-        else:
-            unscoredCount += 1
+    # (a test structure without valid material is counted in the final column)
+    scoredStructures = (truthPrimaryMaterial != -1) & ~np.isin(truthPrimaryMaterial, materialIndicesToIgnore)
+    unscoredCount = int(np.sum(~scoredStructures))
+    structureConfMatrix = np.zeros((numMaterialNames, numMaterialNames), dtype = np.int32)
+    np.add.at(structureConfMatrix,
+              (truthPrimaryMaterial[scoredStructures], testPrimaryMaterial[scoredStructures]), 1)
 
     # Print structure statistics
     scoredStructuresCount = np.sum(structureConfMatrix)
@@ -113,7 +108,5 @@ def run_material_metrics(refNDX, refMTL, testMTL, materialNames, materialIndices
         'fraction_structures_correct': correctStructuresFraction,
         'fraction_pixels_correct': correctPixelsFraction
     }
-	
-    return metrics
-	
 
+    return metrics
@@ -0,0 +1,304 @@
+#
+# Evaluate many test models (submissions) against one reference model.
+#
+
+import os
+import sys
+import glob
+import time
+import json
+import argparse
+import traceback
+import concurrent.futures
+import numpy as np
+from multiprocessing import shared_memory
+
+try:
+    import core3dmetrics.geometrics as geo
+    from core3dmetrics.run_geometrics import run_geometrics, load_reference
+except:
+    import geometrics as geo
+    from run_geometrics import run_geometrics, load_reference
+
+
+# StructureIndex arrays, shared as separate blocks
+STRUCTURE_ARRAYS = ('labels', 'starts', 'lengths', 'offsets')
+
+
+# Copy an array into a new shared memory block, returning the block and a
+# picklable description of the array
+def _share_array(array):
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+# Read-only array view of a shared memory block described by _share_array
+def _attach_array(item):
+    name, shape, dtype = item
+    block = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return block, array
+
+
+# Copy the arrays of a dict (including the arrays of StructureIndex values)
+# into shared memory blocks.
+# Returns the blocks (to be closed & unlinked by the owner) and a picklable
+# description of the dict, from which attach_shared rebuilds it in another
+# process without copying the array data.
+def share_arrays(data):
+    blocks = []
+    description = {}
+
+    for key, value in data.items():
+        if isinstance(value, np.ndarray):
+            block, item = _share_array(value)
+            blocks.append(block)
+            description[key] = ('array',) + item
+
+        elif isinstance(value, geo.StructureIndex):
+            items = {}
+            for name in STRUCTURE_ARRAYS:
+                block, items[name] = _share_array(getattr(value, name))
+                blocks.append(block)
+            description[key] = ('structures', items, value.shape)
+
+        else:
+            description[key] = ('value', value)
+
+    return blocks, description
+
+
+# Rebuild a dict described by share_arrays, with read-only array views of the
+# shared memory blocks (which must remain open while the arrays are in use)
+def attach_shared(description):
+    blocks = []
+    data = {}
+
+    for key, item in description.items():
+        if item[0] == 'value':
+            data[key] = item[1]
+
+        elif item[0] == 'structures':
+            arrays = {}
+            for name in STRUCTURE_ARRAYS:
+                block, arrays[name] = _attach_array(item[1][name])
+                blocks.append(block)
+            data[key] = geo.StructureIndex(shape=item[2], **arrays)
+
+        else:
+            block, data[key] = _attach_array(item[1:])
+            blocks.append(block)
+
+    return blocks, data
+
+
+# worker process state: shared reference configuration & arrays
+_worker = {}
+
+
+def _init_worker(reference_config, description):
+    _worker['config'] = reference_config
+    _worker['blocks'], _worker['reference'] = attach_shared(description)
+
+
+# Evaluate one test configuration against the shared reference,
+# returning a summary of the run (errors are reported, not raised)
+def _evaluate(configfile, kwargs):
+    start = time.perf_counter()
+    summary = {'config': configfile}
+    try:
+        metrics = run_geometrics(configfile, reference_config=_worker.get('config'),
+            reference=_worker.get('reference'), **kwargs)
+        summary['status'] = 'ok'
+        summary.update(summarize_metrics(metrics))
+    except Exception as err:
+        summary['status'] = 'error'
+        summary['error'] = '{}: {}'.format(type(err).__name__, err)
+        summary['traceback'] = traceback.format_exc()
+    summary['elapsed'] = time.perf_counter() - start
+    return summary
+
+
+# Compact summary of a metrics report: 2D/3D scores per CLS match set,
+# relative & terrain accuracy and registration offset
+def summarize_metrics(metrics):
+    summary = {}
+
+    scores = []
+    for result in metrics.get('threshold_geometry', []):
+        score = {'CLSValue': result.get('CLSValue')}
+        for dim in ('2D', '3D'):
+            for key in ('completeness', 'correctness', 'fscore', 'jaccardIndex'):
+                score['{}_{}'.format(dim, key)] = result[dim][key]
+        scores.append(score)
+    summary['threshold_geometry'] = scores
+
+    for key in ('relative_accuracy', 'terrain_accuracy', 'registration_offset'):
+        if key in metrics:
+            summary[key] = metrics[key]
+
+    if 'profile' in metrics:
+        summary['profile'] = metrics['profile']['total']
+
+    return summary
+
+
+# Expand test configuration filenames & glob patterns, in order without duplicates
+def find_configs(patterns):
+    configs = []
+    for pattern in patterns:
+        files = sorted(glob.glob(pattern)) or [pattern]
+        for file in files:
+            file = os.path.abspath(file)
+            if file not in configs:
+                configs.append(file)
+    return configs
+
+
+# PRIMARY FUNCTION: RUN_BATCH
+# The reference model described by "refconfig" (INPUT.REF, plus default
+# OPTIONS/PLOTS/MATERIALS.REF sections for the test configurations) is loaded
+# once and shared with "workers" evaluation processes via shared memory. Each
+# test configuration is evaluated by run_geometrics (with keyword arguments
+# "kwargs"), writing its own metrics report, and a combined summary is written
+# to "<outputpath>/batch_summary.json". The reference may be prepared from (or
+# saved to) a persistent "reference_cache" folder. Saved plots are rendered
+# synchronously in each evaluation process, unless "plot_workers" background
+# renderers are requested (per evaluation process).
+def run_batch(refconfig, testconfigs, refpath=None, outputpath=None, workers=None,
+              reference_cache=None, **kwargs):
+
+    # check inputs
+    if not os.path.isfile(refconfig):
+        raise IOError("Reference configuration file does not exist")
+
+    if outputpath is not None and not os.path.isdir(outputpath):
+        raise IOError('"outputpath" not a valid folder <{}>'.format(outputpath))
+
+    testconfigs = find_configs(testconfigs)
+    missing = [f for f in testconfigs if not os.path.isfile(f)]
+    if missing:
+        raise IOError('Test configuration file(s) do not exist: {}'.format(', '.join(missing)))
+    if not testconfigs:
+        raise ValueError('No test configuration files')
+
+    # reports are named by configuration file, and must not collide
+    if outputpath is not None:
+        names = [os.path.basename(f) for f in testconfigs]
+        duplicates = sorted(set(n for n in names if names.count(n) > 1))
+        if duplicates:
+            raise ValueError('Duplicate test configuration names in one output folder: {}'.format(
+                ', '.join(duplicates)))
+
+    # reference configuration & model
+    reference_config = geo.parse_config(refconfig,
+        refpath=(refpath or os.path.dirname(refconfig)), require_test=False)
+    reference_config.pop('INPUT.TEST', None)
+
+    start = time.perf_counter()
+    reference = load_reference(reference_config, kwargs.get('load_workers'), reference_cache)
+    print('Reference prepared in {:.3f} s'.format(time.perf_counter() - start))
+
+    if workers is None:
+        workers = min(len(testconfigs), os.cpu_count() or 1)
+    workers = max(1, workers)
+    if outputpath is not None:
+        kwargs['outputpath'] = outputpath
+    kwargs['plot_workers'] = kwargs.get('plot_workers') or 0
+
+    # evaluate submissions in worker processes sharing the reference arrays
+    print('\n=====BATCH EVALUATION: {} test configurations, {} workers====='.format(len(testconfigs), workers))
+    blocks, description = share_arrays(reference)
+    del reference
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                initializer=_init_worker, initargs=(reference_config, description)) as executor:
+            futures = [executor.submit(_evaluate, f, kwargs) for f in testconfigs]
+            results = []
+            for future in futures:
+                result = future.result()
+                print('[{}] {} ({:.1f} s){}'.format(result['status'].upper(), result['config'],
+                    result['elapsed'], ': ' + result['error'] if 'error' in result else ''))
+                results.append(result)
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    # combined summary
+    summary = {
+        'reference': os.path.abspath(refconfig),
+        'elapsed': time.perf_counter() - start,
+        'results': results,
+    }
+    fileout = os.path.join(outputpath or os.path.dirname(os.path.abspath(refconfig)), 'batch_summary.json')
+    with open(fileout, 'w') as fid:
+        json.dump(summary, fid, indent=2)
+    print("Batch summary: " + fileout)
+
+    return summary
+
+
+# command line function
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    # parse inputs
+    parser = argparse.ArgumentParser(description='core3dmetrics batch entry point', prog='core3d-metrics-batch')
+
+    parser.add_argument('-c', '--reference-config', dest='refconfig',
+                        help='Reference configuration file', required=True, metavar='')
+    parser.add_argument('-t', '--test-configs', dest='testconfigs', nargs='+',
+                        help='Test configuration files (or glob patterns)', required=True, metavar='')
+    parser.add_argument('-r', '--reference', dest='refpath',
+                        help='Reference data folder', required=False, metavar='')
+    parser.add_argument('-o', '--output', dest='outputpath',
+                        help='Output folder', required=False, metavar='')
+    parser.add_argument('-j', '--workers', dest='workers', type=int,
+                        help='Number of evaluation processes (default: CPU count)', required=False, metavar='')
+    group = parser.add_mutually_exclusive_group(required=False)
+    group.add_argument('--align', dest='align', action='store_true', help="Enable alignment (default)")
+    group.add_argument('--no-align', dest='align', action='store_false', help="Disable alignment")
+    group.set_defaults(align=True)
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+        help="Disable the registration offset cache")
+    parser.add_argument('--reference-cache', dest='reference_cache',
+        help="Folder of prepared reference products (created or refreshed as needed)", required=False, metavar='')
+    parser.add_argument('--load-workers', dest='load_workers', type=int,
+        help="Number of threads loading & warping rasters per evaluation", required=False, metavar='')
+    parser.add_argument('--scratch-dir', dest='scratch_dir',
+        help="Folder for memory mapped intermediate arrays of each evaluation", required=False, metavar='')
+    parser.add_argument('--plot-workers', dest='plot_workers', type=int,
+        help="Number of background processes rendering saved plots per evaluation (default: 0, synchronous)",
+        required=False, metavar='')
+    parser.add_argument('--profile', dest='profile', action='store_true',
+        help="Record stage profiles in each metrics report")
+
+    args = parser.parse_args(args)
+
+    print('RUN_BATCH input arguments:')
+    print(args)
+
+    # gather optional arguments
+    kwargs = {}
+    kwargs['align'] = args.align
+    kwargs['use_cache'] = args.use_cache
+    if args.refpath: kwargs['refpath'] = args.refpath
+    if args.outputpath: kwargs['outputpath'] = args.outputpath
+    if args.workers: kwargs['workers'] = args.workers
+    if args.load_workers: kwargs['load_workers'] = args.load_workers
+    if args.reference_cache: kwargs['reference_cache'] = args.reference_cache
+    if args.scratch_dir: kwargs['scratch_dir'] = args.scratch_dir
+    if args.plot_workers: kwargs['plot_workers'] = args.plot_workers
+    if args.profile: kwargs['profile'] = args.profile
+
+    # run process
+    run_batch(args.refconfig, args.testconfigs, **kwargs)
+
+
+if __name__ == "__main__":
+    main()
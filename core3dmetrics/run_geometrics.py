@@ -5,6 +5,7 @@
 import os
 import sys
 import shutil
+import contextlib
 import gdalconst
 import numpy as np
 import argparse
@@ -17,9 +18,316 @@ except:
     import geometrics as geo
 
 
+# Apply registration offset, only to valid data to allow better tracking of bad data
+def applyHeightOffset(testDSM, testDTM, zOffset, noDataValue):
+    testValidData = (testDSM != noDataValue)
+    if testDTM is not None:
+        testValidData &= (testDTM != noDataValue)
+
+    testDSM[testValidData] = testDSM[testValidData] + zOffset
+    if testDTM is not None:
+        testDTM[testValidData] = testDTM[testValidData] + zOffset
+
+
+# Create mask for ignoring points labeled NoData in reference files,
+# optionally including test NoDataValue(s)
+# ("refIgnoreMask" is a previously computed reference-only ignore mask,
+# "out" an optional preallocated boolean array for the result)
+def buildIgnoreMask(refDSM, refDTM, refCLS, noDataValue, refCLS_NoDataValue,
+    testCLS=None, testDSM=None, testDTM=None, testCLS_NoDataValue=None,
+    allow_test_ignore=False, verbose=True, refIgnoreMask=None, out=None):
+
+    if out is not None:
+        ignoreMask = out
+        ignoreMask[...] = False if refIgnoreMask is None else refIgnoreMask
+    elif refIgnoreMask is not None:
+        ignoreMask = np.array(refIgnoreMask, dtype=bool)
+    else:
+        ignoreMask = np.zeros_like(refCLS, np.bool)
+
+    if refIgnoreMask is None:
+        refDSM_NoDataValue = noDataValue
+        refDTM_NoDataValue = noDataValue
+
+        if refDSM_NoDataValue is not None:
+            ignoreMask[refDSM == refDSM_NoDataValue] = True
+        if refDTM_NoDataValue is not None:
+            ignoreMask[refDTM == refDTM_NoDataValue] = True
+        if refCLS_NoDataValue is not None:
+            ignoreMask[refCLS == refCLS_NoDataValue] = True
+
+    # optionally ignore test NoDataValue(s)
+    if allow_test_ignore:
+
+        if allow_test_ignore == 1:
+            if testCLS_NoDataValue is not None:
+                if verbose: print('Ignoring test CLS NoDataValue')
+                ignoreMask[testCLS == testCLS_NoDataValue] = True
+
+        elif allow_test_ignore == 2:
+            testDSM_NoDataValue = noDataValue
+            testDTM_NoDataValue = noDataValue
+            if testDSM_NoDataValue is not None:
+                if verbose: print('Ignoring test DSM NoDataValue')
+                ignoreMask[testDSM == testDSM_NoDataValue] = True
+            if testDTM is not None and testDTM_NoDataValue is not None:
+                if verbose: print('Ignoring test DTM NoDataValue')
+                ignoreMask[testDTM == testDTM_NoDataValue] = True
+
+        else:
+            raise IOError('Unrecognized test ignore value={}'.format(allow_test_ignore))
+
+        if verbose: print("")
+
+    return ignoreMask
+
+
+# Quantize heights to multiples of "unitHgt", optionally into a preallocated array "out"
+def quantizeHeight(img, unitHgt, out=None):
+    if out is None:
+        return np.round(img / unitHgt) * unitHgt
+    np.divide(img, unitHgt, out=out)
+    np.round(out, out=out)
+    out *= unitHgt
+    return out
+
+
+# Mask of pixels matching any of the CLS "values", optionally into a preallocated array "out"
+def matchMask(img, values, out=None):
+    if out is None:
+        return np.isin(img, values)
+    out[...] = False
+    for value in values:
+        out |= (img == value)
+    return out
+
+
+# Explicitly assign a no data value to warped images to track filled pixels
+NO_DATA_VALUE = -9999
+
+
+# Reference model load jobs (see geo.loadConcurrent), warping all reference
+# files onto the reference CLS grid ("grid" WarpContext), into arrays allocated
+# by "allocate" if given (see geo.WarpedRaster.load)
+def reference_jobs(config, grid, noDataValue=NO_DATA_VALUE, allocate=None):
+    refDSMFilename = config['INPUT.REF']['DSMFilename']
+    refDTMFilename = config['INPUT.REF']['DTMFilename']
+    refCLSFilename = config['INPUT.REF']['CLSFilename']
+    refNDXFilename = config['INPUT.REF']['NDXFilename']
+    refMTLFilename = config['INPUT.REF'].get('MTLFilename',None)
+
+    jobs = {
+        'refCLS': lambda: geo.WarpedRaster(refCLSFilename, grid).load(allocate),
+        'refDSM': lambda: geo.imageWarp(refDSMFilename, grid, noDataValue=noDataValue, allocate=allocate),
+        'refDTM': lambda: geo.imageWarp(refDTMFilename, grid, noDataValue=noDataValue, allocate=allocate),
+        'refNDX': lambda: geo.imageWarp(refNDXFilename, grid, interp_method=gdalconst.GRA_NearestNeighbour,
+            dtype=np.uint16, allocate=allocate),
+    }
+
+    if refMTLFilename:
+        jobs['refMTL'] = lambda: geo.imageWarp(refMTLFilename, grid, interp_method=gdalconst.GRA_NearestNeighbour,
+            dtype=np.uint8, allocate=allocate)
+    else:
+        print('NO REFERENCE MTL')
+
+    return jobs
+
+
+# PREPARED REFERENCE: load reference model files once, for evaluation of any
+# number of test models via run_geometrics(..., reference=prepared).
+# Returns a dict of reference arrays (refCLS, refDSM, refDTM, refNDX and
+# optional refMTL), the grid "tform" and "refCLS_NoDataValue", and derived
+# products: reference-only "refIgnoreMask", "refCLS_classes" (np.unique(refCLS))
+# and "refStructures" (StructureIndex of refNDX).
+#
+# With "cache_folder", prepared products are saved to (or memory mapped from)
+# a persistent reference cache, invalidated when the reference files change.
+def load_reference(config, load_workers=None, cache_folder=None):
+    refCLSFilename = config['INPUT.REF']['CLSFilename']
+
+    if cache_folder:
+        cache = geo.ReferenceCache(cache_folder)
+        sources = geo.referenceSources(config)
+        params = {'noDataValue': NO_DATA_VALUE}
+        reference = cache.load(sources, params)
+        if reference is not None:
+            print('\nUSING PREPARED REFERENCE from <{}>'.format(cache_folder))
+            return reference
+
+    print("\nReading reference model files...")
+    with geo.WarpContext(refCLSFilename) as grid:
+        reference, _ = geo.loadConcurrent(reference_jobs(config, grid), workers=load_workers)
+        reference['tform'] = list(grid.meta['GeoTransform'])
+        reference['refCLS_NoDataValue'] = grid.getNoDataValue(refCLSFilename)
+
+    reference['refIgnoreMask'] = buildIgnoreMask(reference['refDSM'], reference['refDTM'],
+        reference['refCLS'], NO_DATA_VALUE, reference['refCLS_NoDataValue'], verbose=False)
+    reference['refCLS_classes'] = np.unique(reference['refCLS'])
+    reference['refStructures'] = geo.getStructures(reference['refNDX'])
+
+    if cache_folder:
+        cache.save(reference, sources, params)
+        print('Prepared reference saved to <{}>'.format(cache_folder))
+
+    return reference
+
+
+# PREPARE REFERENCE: write the prepared reference products of a configuration
+# (only INPUT.REF is required) to a persistent reference cache
+def prepare_reference(configfile, cache_folder, refpath=None, load_workers=None):
+    if not os.path.isfile(configfile):
+        raise IOError("Configuration file does not exist")
+
+    config = geo.parse_config(configfile,
+        refpath=(refpath or os.path.dirname(configfile)), require_test=False)
+    geo.ReferenceCache(cache_folder).clear()
+    return load_reference(config, load_workers, cache_folder)
+
+
+# Write metrics report to the output folder
+def writeMetrics(metrics, configfile, outputpath):
+    fileout = os.path.join(outputpath,os.path.basename(configfile) + "_metrics.json")
+    with open(fileout,'w') as fid:
+        json.dump(metrics,fid,indent=2)
+    print(json.dumps(metrics,indent=2))
+    print("Metrics report: " + fileout)
+
+
+# TILED EVALUATION: threshold geometry (and, given a test DTM, terrain accuracy)
+# metrics accumulated over aligned blocks read directly from the input files, so
+# peak memory is bounded by the tile size rather than by the size of the rasters.
+# Terrain accuracy percentiles are approximate, from error sketches merged
+# across tiles (see PercentileSketch).
+def run_tiled_metrics(config, xyzOffset, noDataValue, tilesize,
+    allow_test_ignore=False):
+
+    testDSMFilename = config['INPUT.TEST']['DSMFilename']
+    testDTMFilename = config['INPUT.TEST'].get('DTMFilename',None)
+    testCLSFilename = config['INPUT.TEST']['CLSFilename']
+    refDSMFilename = config['INPUT.REF']['DSMFilename']
+    refDTMFilename = config['INPUT.REF']['DTMFilename']
+    refCLSFilename = config['INPUT.REF']['CLSFilename']
+    QUANTIZE = config['OPTIONS']['QuantizeHeight']
+    PRECISION = np.dtype(config['OPTIONS'].get('WorkingPrecision','float64'))
+
+    print("\nPreparing tiled readers ({0}x{0} pixel tiles)...".format(tilesize))
+    with geo.WarpContext(refCLSFilename) as grid:
+        meta = grid.meta
+        tform = meta['GeoTransform']
+
+        refCLS_NoDataValue = grid.getNoDataValue(refCLSFilename)
+        testCLS_NoDataValue = grid.getNoDataValue(testCLSFilename) if allow_test_ignore == 1 else None
+
+        refCLSReader = geo.WarpedRaster(refCLSFilename, grid)
+        refDSMReader = geo.WarpedRaster(refDSMFilename, grid, noDataValue=noDataValue)
+        refDTMReader = geo.WarpedRaster(refDTMFilename, grid, noDataValue=noDataValue)
+        testCLSReader = geo.WarpedRaster(testCLSFilename, grid, xyzOffset, gdalconst.GRA_NearestNeighbour)
+        testDSMReader = geo.WarpedRaster(testDSMFilename, grid, xyzOffset, noDataValue=noDataValue)
+        testDTMReader = None
+        if testDTMFilename:
+            testDTMReader = geo.WarpedRaster(testDTMFilename, grid, xyzOffset, noDataValue=noDataValue)
+
+        windows = list(geo.tileWindows(meta['RasterXSize'], meta['RasterYSize'], tilesize))
+        print("Number of tiles = {}".format(len(windows)))
+
+        # terrain accuracy ignores elevated objects (default: building and bridge deck)
+        dtm_z_threshold = config['OPTIONS'].get('TerrainZErrorThreshold',1)
+        dtm_CLS_ignore_values = config['INPUT.REF'].get('TerrainCLSIgnoreValues', [6, 17])
+        terrain_totals = None
+
+        # accumulate partial sums for each combination of CLS values, tile by tile
+        # (collecting the classification values present in the CLS images)
+        partials = None
+        numDataVoids = 0
+
+        for window in windows:
+            refCLS = refCLSReader.read(*window)
+            refDSM = refDSMReader.read(*window)
+            refDTM = refDTMReader.read(*window)
+            testCLS = testCLSReader.read(*window)
+            testDSM = testDSMReader.read(*window)
+            testDTM = testDTMReader.read(*window) if testDTMReader else None
+
+            applyHeightOffset(testDSM, testDTM, xyzOffset[2], noDataValue)
+
+            ignoreMask = buildIgnoreMask(refDSM, refDTM, refCLS, noDataValue, refCLS_NoDataValue,
+                testCLS, testDSM, testDTM, testCLS_NoDataValue, allow_test_ignore, verbose=False)
+            numDataVoids += int(np.sum(ignoreMask))
+
+            if QUANTIZE:
+                unitHgt = geo.getUnitHeight(tform)
+                refDSM = np.round(refDSM / unitHgt) * unitHgt
+                refDTM = np.round(refDTM / unitHgt) * unitHgt
+                testDSM = np.round(testDSM / unitHgt) * unitHgt
+                if testDTM is not None:
+                    testDTM = np.round(testDTM / unitHgt) * unitHgt
+
+            # refDTM is used as the testDTM to mitigate effects of terrain modeling uncertainty
+            # (terrain CLS ignore values of 256, i.e. all non-zero classes, are resolved per tile)
+            tileRefClasses = np.unique(refCLS)
+            partials = geo.accumulate_class_partials(refDSM, refDTM, refCLS, testDSM, refDTM, testCLS,
+                ignoreMask, tileRefClasses, np.unique(testCLS), partials, dtype=PRECISION)
+
+            if testDTM is not None:
+                refMaskTerrainAcc = np.isin(refCLS,
+                    geo.validateMatchValues(dtm_CLS_ignore_values, tileRefClasses.tolist()))
+                terrain_totals = geo.accumulate_terrain_accuracy(refDTM, testDTM, refMaskTerrainAcc,
+                    dtm_z_threshold, terrain_totals)
+
+        # sanity check
+        if numDataVoids == meta['RasterXSize'] * meta['RasterYSize']:
+            raise ValueError('All pixels are ignored')
+        print('Number of data voids in ignore mask = ', numDataVoids)
+
+        refCLS_classes = partials['refClasses'].tolist()
+        testCLS_classes = partials['testClasses'].tolist()
+        refCLS_matchSets, testCLS_matchSets = geo.getMatchValueSets(config['INPUT.REF']['CLSMatchValue'],
+            config['INPUT.TEST']['CLSMatchValue'], refCLS_classes, testCLS_classes)
+
+        threshold_geometry_results = []
+        for index, (refMatchValue,testMatchValue) in enumerate(zip(refCLS_matchSets,testCLS_matchSets)):
+            print("Evaluating CLS values")
+            print("  Reference match values: " + str(refMatchValue))
+            print("  Test match values: " + str(testMatchValue))
+
+            totals = geo.class_partials_totals(partials, refMatchValue, testMatchValue)
+            result = geo.finalize_threshold_geometry(totals, tform)
+            if refMatchValue == testMatchValue:
+                result['CLSValue'] = refMatchValue
+            else:
+                result['CLSValue'] = {'Ref': refMatchValue, "Test": testMatchValue}
+            threshold_geometry_results.append(result)
+
+    metrics = {'threshold_geometry': threshold_geometry_results}
+    if terrain_totals is not None:
+        metrics['terrain_accuracy'] = geo.finalize_terrain_accuracy(terrain_totals)
+    else:
+        print('WARNING: No test DTM file, skipping terrain accuracy metrics')
+    return metrics
+
+
 # PRIMARY FUNCTION: RUN_GEOMETRICS
+# (resources of the evaluation, e.g. memory tracing by the stage profiler,
+# are released however the evaluation ends)
 def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
-    align=True,allow_test_ignore=False):
+    align=True,allow_test_ignore=False,tilesize=None,
+    use_cache=True,cache_file=None,cache_max_entries=1000,clear_cache=False,
+    load_workers=None,reference_config=None,reference=None,reference_cache=None,
+    scratch_dir=None,plot_workers=None,profile=False):
+
+    with contextlib.ExitStack() as resources:
+        return _run_geometrics(resources,configfile,refpath,testpath,outputpath,
+            align,allow_test_ignore,tilesize,
+            use_cache,cache_file,cache_max_entries,clear_cache,
+            load_workers,reference_config,reference,reference_cache,
+            scratch_dir,plot_workers,profile)
+
+
+def _run_geometrics(resources,configfile,refpath=None,testpath=None,outputpath=None,
+    align=True,allow_test_ignore=False,tilesize=None,
+    use_cache=True,cache_file=None,cache_max_entries=1000,clear_cache=False,
+    load_workers=None,reference_config=None,reference=None,reference_cache=None,
+    scratch_dir=None,plot_workers=None,profile=False):
 
     # check inputs
     if not os.path.isfile(configfile):
@@ -28,12 +336,16 @@ def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
     if outputpath is not None and not os.path.isdir(outputpath):
         raise IOError('"outputpath" not a valid folder <{}>'.format(outputpath))
 
+    # Stage profiling (wall & CPU time, peak memory), reported in the metrics
+    profiler = resources.enter_context(geo.StageProfiler(enabled=profile))
+
     # parse configuration
     configpath = os.path.dirname(configfile)
 
     config = geo.parse_config(configfile,
         refpath=(refpath or configpath), 
-        testpath=(testpath or configpath))
+        testpath=(testpath or configpath),
+        reference=reference_config)
 
     # Get test model information from configuration file.
     testDSMFilename = config['INPUT.TEST']['DSMFilename']
@@ -56,6 +368,7 @@ def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
     PLOTS_SHOW   = config['PLOTS']['ShowPlots']
     PLOTS_SAVE   = config['PLOTS']['SavePlots']
     PLOTS_ENABLE = PLOTS_SHOW or PLOTS_SAVE
+    PLOTS_PREVIEW = config['PLOTS'].get('RasterPreview','none')
 
     # default output path
     if outputpath is None:
@@ -63,109 +376,195 @@ def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
 
     # Configure plotting
     basename = os.path.basename(testDSMFilename)
+    # (saved figures are rendered by "plot_workers" background processes)
     if PLOTS_ENABLE:
-        plot = geo.plot(saveDir=outputpath, autoSave=PLOTS_SAVE, savePrefix=basename+'_', badColor='black',showPlots=PLOTS_SHOW, dpi=900)
+        if plot_workers is None:
+            plot_workers = min(4, os.cpu_count() or 1)
+        # (background render workers are stopped however the evaluation ends)
+        plot = resources.enter_context(geo.plot(saveDir=outputpath, autoSave=PLOTS_SAVE, savePrefix=basename+'_', badColor='black',showPlots=PLOTS_SHOW, dpi=900,
+            workers=plot_workers, preview=(None if PLOTS_PREVIEW == 'none' else PLOTS_PREVIEW),
+            overview=config['PLOTS'].get('PreviewOverview')))
     else:
         plot = None
         
-    # copy testDSM to the output path
-    # this is a workaround for the "align3d" function with currently always
-    # saves new files to the same path as the testDSM
-    src = testDSMFilename
-    dst = os.path.join(outputpath,os.path.basename(src))
-    if not os.path.isfile(dst): shutil.copyfile(src,dst)
-    testDSMFilename_copy = dst
+    # Point cloud test DSM/DTM gridding (for registration & evaluation)
+    pointCloudReduction = config['INPUT.TEST'].get('PointCloudReduction','max')
+    pointCloudHoleFill = config['INPUT.TEST'].get('PointCloudHoleFill','none')
+
+    # Registration offset cache, keyed by reference/test DSM content and registration parameters
+    # (including the gridding of a point cloud test DSM)
+    registration_method = config['OPTIONS'].get('RegistrationMethod','align3d')
+    registration_maxt = 10.0
+    registration_params = dict(method=registration_method, maxt=registration_maxt)
+    if geo.isPointCloud(testDSMFilename):
+        registration_params.update(pointCloudReduction=pointCloudReduction, pointCloudHoleFill=pointCloudHoleFill)
+    xyzOffset = None
+    offset_cache = None
+
+    profiler.start('registration')
+    if align and (use_cache or clear_cache):
+        offset_cache = geo.OffsetCache(cache_file, maxEntries=cache_max_entries)
+        if clear_cache:
+            print('\nClearing registration offset cache <{}>'.format(offset_cache.filename))
+            offset_cache.clear()
+
+    if align and use_cache:
+        offset_key = offset_cache.key(refDSMFilename, testDSMFilename, **registration_params)
+        xyzOffset = offset_cache.get(offset_key)
 
     # Register test model to ground truth reference model.
     if not align:
         print('\nSKIPPING REGISTRATION')
         xyzOffset = (0.0,0.0,0.0)
+    elif xyzOffset is not None:
+        print('\nUSING CACHED REGISTRATION from <{}>'.format(offset_cache.filename))
+        print('XYZ offset = {}'.format(xyzOffset))
+        offset_cache.close()
+        offset_cache = None
+    elif registration_method == 'inprocess':
+        print('\n=====REGISTRATION====='); sys.stdout.flush()
+        xyzOffset = geo.align3d_inprocess(refDSMFilename, testDSMFilename, maxt=registration_maxt,
+            pointCloudReduction=pointCloudReduction, pointCloudHoleFill=pointCloudHoleFill)
     else:
+        # copy testDSM to the output path
+        # this is a workaround for the "align3d" function with currently always
+        # saves new files to the same path as the testDSM
+        # (a test point cloud is gridded onto the reference DSM grid instead)
+        src = testDSMFilename
+        if geo.isPointCloud(src):
+            dst = os.path.join(outputpath,os.path.splitext(os.path.basename(src))[0])
+            geo.arrayToGeotiff(geo.pointCloudToGrid(src, refDSMFilename, reduction=pointCloudReduction,
+                holeFill=pointCloudHoleFill), dst, refDSMFilename, -9999)
+            dst = dst + '.tif'
+        else:
+            dst = os.path.join(outputpath,os.path.basename(src))
+            if not os.path.isfile(dst): shutil.copyfile(src,dst)
+        testDSMFilename_copy = dst
+
         print('\n=====REGISTRATION====='); sys.stdout.flush()
         try:
             align3d_path = config['REGEXEPATH']['Align3DPath']
         except:
             align3d_path = None
-        xyzOffset = geo.align3d(refDSMFilename, testDSMFilename_copy, exec_path=align3d_path)
+        xyzOffset = geo.align3d(refDSMFilename, testDSMFilename_copy, exec_path=align3d_path, maxt=registration_maxt)
 
-    # Explicitly assign a no data value to warped images to track filled pixels
-    noDataValue = -9999
+    if offset_cache is not None:
+        if use_cache:
+            offset_cache.put(offset_key, xyzOffset, refDSMFilename, testDSMFilename)
+        offset_cache.close()
+    profiler.stop()
 
-    # Read reference model files.
-    print("\nReading reference model files...")
-    refCLS, tform = geo.imageLoad(refCLSFilename)
-    refDSM = geo.imageWarp(refDSMFilename, refCLSFilename, noDataValue=noDataValue)
-    refDTM = geo.imageWarp(refDTMFilename, refCLSFilename, noDataValue=noDataValue)
-    refNDX = geo.imageWarp(refNDXFilename, refCLSFilename, interp_method=gdalconst.GRA_NearestNeighbour).astype(np.uint16)
+    # Explicitly assign a no data value to warped images to track filled pixels
+    noDataValue = NO_DATA_VALUE
 
-    if refMTLFilename:
-        refMTL = geo.imageWarp(refMTLFilename, refCLSFilename, interp_method=gdalconst.GRA_NearestNeighbour).astype(np.uint8)
+    # Tiled evaluation (threshold geometry & terrain accuracy)
+    if tilesize:
+        if geo.isPointCloud(testDSMFilename) or geo.isPointCloud(testDTMFilename):
+            raise ValueError('Tiled evaluation requires gridded test DSM/DTM files, not point clouds')
+        if PLOTS_ENABLE:
+            print('WARNING: Plots are not available in tiled evaluation')
+        print('WARNING: Tiled evaluation, skipping relative accuracy and material metrics')
+
+        with profiler.stage('tiled_metrics'):
+            metrics = run_tiled_metrics(config, xyzOffset, noDataValue,
+                tilesize, allow_test_ignore=allow_test_ignore)
+        if align:
+            metrics['registration_offset'] = xyzOffset
+
+        if profile:
+            metrics['profile'] = profiler.report()
+            profiler.printReport()
+
+        writeMetrics(metrics, configfile, outputpath)
+        return metrics
+
+    # Prepared reference from the persistent reference cache
+    if reference is None and reference_cache:
+        with profiler.stage('reference_cache'):
+            reference = load_reference(config, load_workers, reference_cache)
+
+    # Reference CLS grid, shared by all warps (closed once no longer needed,
+    # or however the evaluation ends)
+    grid = resources.enter_context(geo.WarpContext(refCLSFilename))
+
+    # Large intermediate arrays are optionally memory mapped in a scratch folder
+    # (removed however the evaluation ends), input rasters being read directly
+    # into them
+    scratch = resources.enter_context(geo.ScratchArrays(scratch_dir))
+    allocate = scratch.empty if scratch.enabled else None
+    if scratch.enabled:
+        print('Scratch arrays in <{}>'.format(scratch.folder))
+
+    # Test height models may be gridded rasters or LAS/LAZ point clouds,
+    # the latter gridded directly onto the reference grid
+    def loadTestHeight(filename):
+        if geo.isPointCloud(filename):
+            return geo.pointCloudToGrid(filename, grid, xyzOffset, pointCloudReduction,
+                pointCloudHoleFill, noDataValue, allocate=allocate)
+        return geo.imageWarp(filename, grid, xyzOffset, noDataValue=noDataValue, allocate=allocate)
+
+    # Read reference (unless prepared) & test model files, applying XYZ offsets to test files.
+    # Loads are independent, and run concurrently on "load_workers" threads.
+    print("\nReading reference & test model files...")
+    jobs = {
+        'testCLS': lambda: geo.imageWarp(testCLSFilename, grid, xyzOffset, gdalconst.GRA_NearestNeighbour,
+            allocate=allocate),
+        'testDSM': lambda: loadTestHeight(testDSMFilename),
+    }
+
+    if reference is None:
+        jobs.update(reference_jobs(config, grid, noDataValue, allocate))
     else:
-        print('NO REFERENCE MTL')
-
-    # Read test model files and apply XYZ offsets.
-    print("\nReading test model files...")
-    testCLS = geo.imageWarp(testCLSFilename, refCLSFilename, xyzOffset, gdalconst.GRA_NearestNeighbour)
-    testDSM = geo.imageWarp(testDSMFilename, refCLSFilename, xyzOffset, noDataValue=noDataValue)
+        print('Using prepared reference')
 
     if testDTMFilename:
-        testDTM = geo.imageWarp(testDTMFilename, refCLSFilename, xyzOffset, noDataValue=noDataValue)
+        jobs['testDTM'] = lambda: loadTestHeight(testDTMFilename)
     else:
         print('NO TEST DTM: defaults to reference DTM')
-        testDTM = refDTM
 
     if testMTLFilename:
-        testMTL = geo.imageWarp(testMTLFilename, refCLSFilename, xyzOffset, gdalconst.GRA_NearestNeighbour).astype(np.uint8)
+        jobs['testMTL'] = lambda: geo.imageWarp(testMTLFilename, grid, xyzOffset, gdalconst.GRA_NearestNeighbour,
+            dtype=np.uint8, allocate=allocate)
     else:
         print('NO TEST MTL')
 
+    with profiler.stage('load'):
+        rasters, _ = geo.loadConcurrent(jobs, workers=load_workers)
+    if reference is not None:
+        rasters.update((k, reference[k]) for k in ('refCLS','refDSM','refDTM','refNDX','refMTL') if k in reference)
+
+    tform = grid.meta['GeoTransform']
+    if PLOTS_ENABLE:
+        plot.transform = tform
+        plot.projection = grid.meta.get('Projection')
+    refCLS = rasters['refCLS']
+    refDSM = rasters['refDSM']
+    refDTM = rasters['refDTM']
+    refNDX = rasters['refNDX']
+    refMTL = rasters.get('refMTL')
+    testCLS = rasters['testCLS']
+    testDSM = rasters['testDSM']
+    testDTM = rasters.get('testDTM', refDTM)
+    testMTL = rasters.get('testMTL')
+    del rasters
+
     print("\n\n")
 
     # Apply registration offset, only to valid data to allow better tracking of bad data
-    testValidData = (testDSM != noDataValue)
-    if testDTMFilename:
-        testValidData &= (testDTM != noDataValue)
-
-    testDSM[testValidData] = testDSM[testValidData] + xyzOffset[2]
-    if testDTMFilename:
-        testDTM[testValidData] = testDTM[testValidData] + xyzOffset[2]
+    profiler.start('ignore_mask')
+    applyHeightOffset(testDSM, testDTM if testDTMFilename else None, xyzOffset[2], noDataValue)
 
     # Create mask for ignoring points labeled NoData in reference files.
-    refDSM_NoDataValue = noDataValue
-    refDTM_NoDataValue = noDataValue
-    refCLS_NoDataValue = geo.getNoDataValue(refCLSFilename)
-    ignoreMask = np.zeros_like(refCLS, np.bool)
-
-    if refDSM_NoDataValue is not None:
-        ignoreMask[refDSM == refDSM_NoDataValue] = True
-    if refDTM_NoDataValue is not None:
-        ignoreMask[refDTM == refDTM_NoDataValue] = True
-    if refCLS_NoDataValue is not None:
-        ignoreMask[refCLS == refCLS_NoDataValue] = True
-
-    # optionally ignore test NoDataValue(s)
-    if allow_test_ignore:
-
-        if allow_test_ignore == 1:
-            testCLS_NoDataValue = geo.getNoDataValue(testCLSFilename)
-            if testCLS_NoDataValue is not None:
-                print('Ignoring test CLS NoDataValue')
-                ignoreMask[testCLS == testCLS_NoDataValue] = True
-
-        elif allow_test_ignore == 2:
-            testDSM_NoDataValue = noDataValue
-            testDTM_NoDataValue = noDataValue
-            if testDSM_NoDataValue is not None:
-                print('Ignoring test DSM NoDataValue')
-                ignoreMask[testDSM == testDSM_NoDataValue] = True
-            if testDTMFilename and testDTM_NoDataValue is not None:
-                print('Ignoring test DTM NoDataValue')
-                ignoreMask[testDTM == testDTM_NoDataValue] = True
-
-        else:
-            raise IOError('Unrecognized test ignore value={}'.format(allow_test_ignore))
+    if reference is None:
+        refCLS_NoDataValue = grid.getNoDataValue(refCLSFilename)
+    else:
+        refCLS_NoDataValue = reference['refCLS_NoDataValue']
+    testCLS_NoDataValue = grid.getNoDataValue(testCLSFilename) if allow_test_ignore == 1 else None
+    grid.close()
 
-        print("")
+    ignoreMask = buildIgnoreMask(refDSM, refDTM, refCLS, noDataValue, refCLS_NoDataValue,
+        testCLS, testDSM, testDTM if testDTMFilename else None, testCLS_NoDataValue, allow_test_ignore,
+        refIgnoreMask=(reference or {}).get('refIgnoreMask'), out=scratch.empty(refCLS.shape, bool))
 
     # sanity check
     if np.all(ignoreMask):
@@ -179,13 +578,14 @@ def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
     QUANTIZE = config['OPTIONS']['QuantizeHeight']
     if QUANTIZE:
         unitHgt = geo.getUnitHeight(tform)
-        refDSM = np.round(refDSM / unitHgt) * unitHgt
-        refDTM = np.round(refDTM / unitHgt) * unitHgt
-        testDSM = np.round(testDSM / unitHgt) * unitHgt
-        testDTM = np.round(testDTM / unitHgt) * unitHgt
+        refDSM, refDTM, testDSM, testDTM = (quantizeHeight(img, unitHgt,
+            scratch.empty(img.shape, np.result_type(img, unitHgt)) if scratch.enabled else None)
+            for img in (refDSM, refDTM, testDSM, testDTM))
         noDataValue = np.round(noDataValue / unitHgt) * unitHgt
+    profiler.stop()
        
     if PLOTS_ENABLE:
+        profiler.start('input_plots')
         # Reference models can include data voids, so ignore invalid data on display
         plot.make(refDSM, 'Reference DSM', 111, colorbar=True, saveName="input_refDSM", badValue=noDataValue)
         plot.make(refDTM, 'Reference DTM', 112, colorbar=True, saveName="input_refDTM", badValue=noDataValue)
@@ -204,6 +604,7 @@ def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
         if refMTLFilename and testMTLFilename:
             plot.make(refMTL, 'Reference Materials', 191, colorbar=True, saveName="input_refMTL",vmin=0,vmax=13)
             plot.make(testMTL, 'Test Materials', 192, colorbar=True, saveName="input_testMTL",vmin=0,vmax=13)
+        profiler.stop()
 
     # Run the threshold geometry metrics and report results.
     metrics = dict()
@@ -213,12 +614,34 @@ def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
     relative_accuracy_results = []
     
     # Check that match values are valid
-    refCLS_matchSets, testCLS_matchSets = geo.getMatchValueSets(config['INPUT.REF']['CLSMatchValue'], config['INPUT.TEST']['CLSMatchValue'], np.unique(refCLS).tolist(), np.unique(testCLS).tolist())
+    refCLS_classes = (reference or {}).get('refCLS_classes')
+    if refCLS_classes is None:
+        refCLS_classes = np.unique(refCLS)
+    testCLS_classes = np.unique(testCLS)
+    refCLS_matchSets, testCLS_matchSets = geo.getMatchValueSets(config['INPUT.REF']['CLSMatchValue'], config['INPUT.TEST']['CLSMatchValue'], refCLS_classes.tolist(), testCLS_classes.tolist())
+
+    # Evaluate threshold geometry metrics for all sets of CLS match values in a single sweep,
+    # using refDTM as the testDTM to mitigate effects of terrain modeling uncertainty.
+    # Plots require the per-set maps, so are generated by evaluating each set separately.
+    PRECISION = np.dtype(config['OPTIONS'].get('WorkingPrecision','float64'))
+    if not PLOTS_ENABLE:
+        with profiler.stage('threshold_geometry'):
+            threshold_geometry_batch = geo.run_threshold_geometry_metrics_batch(refDSM, refDTM, refCLS,
+                testDSM, refDTM, testCLS, tform, ignoreMask, refCLS_matchSets, testCLS_matchSets,
+                refClasses=refCLS_classes, testClasses=testCLS_classes, dtype=PRECISION)
 
     if PLOTS_ENABLE:
         # Update plot prefix include counter to be unique for each set of CLS value evaluated
         original_save_prefix = plot.savePrefix
 
+    # Per-structure metrics (keyed by refNDX) for each set of CLS match values
+    STRUCTURE_METRICS = config['OPTIONS'].get('StructureMetrics',False)
+    structure_tables = []
+
+    # object masks, reused for every set of CLS match values when in scratch storage
+    refMask = scratch.empty(refCLS.shape, bool) if scratch.enabled else None
+    testMask = scratch.empty(testCLS.shape, bool) if scratch.enabled else None
+
     # Loop through sets of CLS match values
     for index, (refMatchValue,testMatchValue) in enumerate(zip(refCLS_matchSets,testCLS_matchSets)):
         print("Evaluating CLS values")
@@ -226,14 +649,8 @@ def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
         print("  Test match values: " + str(testMatchValue))
 
         # object masks based on CLSMatchValue(s)
-        refMask = np.zeros_like(refCLS, np.bool)
-        for v in refMatchValue:
-            refMask[refCLS == v] = True
-
-        testMask = np.zeros_like(testCLS, np.bool)
-        if len(testMatchValue):
-            for v in testMatchValue:
-                testMask[testCLS == v] = True
+        refMask = matchMask(refCLS, refMatchValue, refMask if scratch.enabled else None)
+        testMask = matchMask(testCLS, testMatchValue, testMask if scratch.enabled else None)
 
         if PLOTS_ENABLE:
             plot.savePrefix = original_save_prefix + "%03d"%(index) + "_"
@@ -241,7 +658,12 @@ def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
             plot.make(refMask.astype(np.int), 'Reference Evaluation Mask', 114, colorbar=True, saveName="input_refMask")
 
         # Evaluate threshold geometry metrics using refDTM as the testDTM to mitigate effects of terrain modeling uncertainty
-        result = geo.run_threshold_geometry_metrics(refDSM, refDTM, refMask, testDSM, refDTM, testMask, tform, ignoreMask, plot=plot)
+        if PLOTS_ENABLE:
+            with profiler.stage('threshold_geometry', CLSSet=index):
+                result = geo.run_threshold_geometry_metrics(refDSM, refDTM, refMask, testDSM, refDTM, testMask, tform, ignoreMask, plot=plot,
+                    dtype=PRECISION)
+        else:
+            result = threshold_geometry_batch[index]
         if refMatchValue == testMatchValue:
             result['CLSValue'] = refMatchValue
         else:
@@ -251,13 +673,22 @@ def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
         # Run the relative accuracy metrics and report results.
         # Skip relative accuracy is all of testMask or refMask is assigned as "object"
         if not ((refMask.size == np.count_nonzero(refMask)) or (testMask.size == np.count_nonzero(testMask))) and len(testMatchValue) != 0:
-            result = geo.run_relative_accuracy_metrics(refDSM, testDSM, refMask, testMask, ignoreMask, geo.getUnitWidth(tform), plot=plot)
+            with profiler.stage('relative_accuracy', CLSSet=index):
+                result = geo.run_relative_accuracy_metrics(refDSM, testDSM, refMask, testMask, ignoreMask, geo.getUnitWidth(tform), plot=plot,
+                    method=config['OPTIONS'].get('HorizontalAccuracyMethod','kdtree'))
             if refMatchValue == testMatchValue:
                 result['CLSValue'] = refMatchValue
             else:
                 result['CLSValue'] = {'Ref': refMatchValue, "Test": testMatchValue}
             relative_accuracy_results.append(result)
 
+        # Per-structure threshold geometry & relative accuracy metrics, using refDTM as the testDTM
+        if STRUCTURE_METRICS:
+            with profiler.stage('structure_metrics', CLSSet=index):
+                table = geo.run_structure_metrics(refNDX, refDSM, refDTM, refMask, testDSM, refDTM, testMask,
+                    tform, ignoreMask, horizontalMethod=config['OPTIONS'].get('HorizontalAccuracyMethod','kdtree'))
+            structure_tables.append(({'CLSSet': index, 'CLSValue': json.dumps(result['CLSValue'])}, table))
+
     if PLOTS_ENABLE:
         # Reset plot prefix
         plot.savePrefix = original_save_prefix
@@ -270,36 +701,55 @@ def run_geometrics(configfile,refpath=None,testpath=None,outputpath=None,
 
     # Run the terrain model metrics and report results.
     if testDTMFilename:
+        profiler.start('terrain_accuracy')
         dtm_z_threshold = config['OPTIONS'].get('TerrainZErrorThreshold',1)
 
         # Make reference mask for terrain evaluation that identified elevated object where underlying terrain estimate
         # is expected to be inaccurate
         dtm_CLS_ignore_values = config['INPUT.REF'].get('TerrainCLSIgnoreValues', [6, 17]) # Default to building and bridge deck
         dtm_CLS_ignore_values = geo.validateMatchValues(dtm_CLS_ignore_values,np.unique(refCLS).tolist())
-        refMaskTerrainAcc = np.zeros_like(refCLS, np.bool)
+        refMaskTerrainAcc = scratch.zeros(refCLS.shape, bool)
         for v in dtm_CLS_ignore_values:
             refMaskTerrainAcc[refCLS == v] = True
 
         metrics['terrain_accuracy'] = geo.run_terrain_accuracy_metrics(refDTM, testDTM, refMaskTerrainAcc, dtm_z_threshold, plot=plot)
+        profiler.stop()
     else:
         print('WARNING: No test DTM file, skipping terrain accuracy metrics')
 
     # Run the threshold material metrics and report results.
     if testMTLFilename:
-        metrics['threshold_materials'] = geo.run_material_metrics(refNDX, refMTL, testMTL, materialNames, materialIndicesToIgnore)
+        with profiler.stage('material_metrics'):
+            metrics['threshold_materials'] = geo.run_material_metrics(refNDX, refMTL, testMTL, materialNames, materialIndicesToIgnore,
+                structures=(reference or {}).get('refStructures'))
     else:
         print('WARNING: No test MTL file, skipping material metrics')
 
-    fileout = os.path.join(outputpath,os.path.basename(configfile) + "_metrics.json")
-    with open(fileout,'w') as fid:
-        json.dump(metrics,fid,indent=2)
-    print(json.dumps(metrics,indent=2))
-    print("Metrics report: " + fileout)
+    # wait for background figures
+    if PLOTS_ENABLE:
+        with profiler.stage('plot_flush'):
+            plot_timings = plot.flush()
+
+    # profile report, including the render time of each figure
+    if profile:
+        metrics['profile'] = profiler.report()
+        if PLOTS_ENABLE:
+            metrics['profile']['plots'] = [{'figure': name, 'wall': seconds} for name, seconds in plot_timings]
+        profiler.printReport()
+
+    writeMetrics(metrics, configfile, outputpath)
+
+    if structure_tables:
+        fileout = os.path.join(outputpath,os.path.basename(configfile) + "_structures.csv")
+        geo.writeStructureTable(fileout, structure_tables)
+        print("Per-structure metrics: " + fileout)
 
     #  If displaying figures, wait for user before existing
     if PLOTS_SHOW:
             input("Press Enter to continue...")
 
+    return metrics
+
 # command line function
 def main(args=None):
     if args is None:
@@ -328,6 +778,49 @@ def main(args=None):
         required=False, nargs='?', default=0, const=1, 
         choices=range(0,3), type=int, metavar='')
 
+    # optional tiled evaluation
+    parser.add_argument('--tile-size', dest='tilesize',
+        help="Evaluate threshold geometry & terrain accuracy in tiles of this size (pixels) to bound memory use",
+        required=False, type=int, metavar='')
+
+    # registration offset cache
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+        help="Disable the registration offset cache")
+    parser.add_argument('--cache-file', dest='cache_file',
+        help="Registration offset cache file (default ~/.cache/core3dmetrics/offsets.sqlite)",
+        required=False, metavar='')
+    parser.add_argument('--cache-max-entries', dest='cache_max_entries',
+        help="Maximum number of cached registration offsets (least recently used are evicted)",
+        required=False, type=int, default=1000, metavar='')
+    parser.add_argument('--clear-cache', dest='clear_cache', action='store_true',
+        help="Remove all cached registration offsets before running")
+
+    # persistent prepared reference cache
+    parser.add_argument('--reference-cache', dest='reference_cache',
+        help="Folder of prepared reference products (created or refreshed as needed, then memory mapped)",
+        required=False, metavar='')
+    parser.add_argument('--prepare-reference', dest='prepare_reference', action='store_true',
+        help="Only prepare the reference cache (requires --reference-cache), without evaluating the test model")
+
+    # concurrent raster loading
+    parser.add_argument('--load-workers', dest='load_workers',
+        help="Number of threads loading & warping input rasters (default: one per file, up to the CPU count; 1 = sequential)",
+        required=False, type=int, metavar='')
+
+    # memory mapped intermediate arrays
+    parser.add_argument('--scratch-dir', dest='scratch_dir',
+        help="Folder for memory mapped intermediate arrays (removed when done), instead of private memory",
+        required=False, metavar='')
+
+    # background plot rendering
+    parser.add_argument('--plot-workers', dest='plot_workers',
+        help="Number of processes rendering saved plots in the background (default: up to 4; 0 = synchronous)",
+        required=False, type=int, metavar='')
+
+    # stage profiling
+    parser.add_argument('--profile', dest='profile', action='store_true',
+        help="Record wall time, CPU time and peak memory of each processing stage in the metrics report")
+
     args = parser.parse_args(args)
 
     print('RUN_GEOMETRICS input arguments:')
@@ -340,6 +833,24 @@ def main(args=None):
     if args.testpath: kwargs['testpath'] = args.testpath
     if args.outputpath: kwargs['outputpath'] = args.outputpath
     if args.testignore: kwargs['allow_test_ignore'] = args.testignore
+    if args.tilesize: kwargs['tilesize'] = args.tilesize
+    kwargs['use_cache'] = args.use_cache
+    kwargs['cache_max_entries'] = args.cache_max_entries
+    kwargs['clear_cache'] = args.clear_cache
+    if args.cache_file: kwargs['cache_file'] = args.cache_file
+    if args.load_workers: kwargs['load_workers'] = args.load_workers
+    if args.reference_cache: kwargs['reference_cache'] = args.reference_cache
+    if args.scratch_dir: kwargs['scratch_dir'] = args.scratch_dir
+    if args.plot_workers is not None: kwargs['plot_workers'] = args.plot_workers
+    if args.profile: kwargs['profile'] = args.profile
+
+    # prepare reference cache only
+    if args.prepare_reference:
+        if not args.reference_cache:
+            parser.error('--prepare-reference requires --reference-cache')
+        prepare_reference(args.config, args.reference_cache, refpath=args.refpath,
+            load_workers=args.load_workers)
+        return
 
     # run process
     run_geometrics(configfile=args.config,**kwargs)
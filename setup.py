@@ -17,7 +17,8 @@ setup(
     packages=find_packages(exclude=['aoi-example']),
     include_package_data=True,
     install_requires=['gdal', 'laspy', 'matplotlib', 'numpy', 'scipy'],
-    entry_points = {'console_scripts': ['core3d-metrics=core3dmetrics:main']},
+    entry_points = {'console_scripts': ['core3d-metrics=core3dmetrics:main',
+                                        'core3d-metrics-batch=core3dmetrics.run_batch:main']},
     ## entry_points={  # Optional
     ##     'console_scripts': [
     ##         'sample=sample:main',
@@ -0,0 +1,74 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import core3dmetrics.geometrics as geo
+from core3dmetrics.run_batch import share_arrays, attach_shared
+
+
+class TestBatch(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  # arrays (and StructureIndex arrays) round trip through shared memory as read-only views
+  def test_shared_arrays(self):
+    ndx = np.zeros((20,20), np.uint16)
+    ndx[2:8, 3:9] = 4
+    ndx[10:15, 10:18] = 7
+    data = {'refDSM': np.arange(12, dtype=np.float32).reshape(3,4), 'refMTL': np.zeros((0,5), np.uint8),
+      'tform': [0, .5, 0, 0, 0, -.5], 'refCLS_NoDataValue': None, 'refStructures': geo.getStructures(ndx)}
+    blocks, description = share_arrays(data)
+    try:
+      self.assertEqual(description['refStructures'][0], 'structures')
+      attached, shared = attach_shared(json.loads(json.dumps(description)))
+      for key in data:
+        if key == 'refStructures': continue
+        np.testing.assert_array_equal(shared[key], data[key])
+      with self.assertRaises(ValueError):
+        shared['refDSM'][0,0] = 1
+
+      structures = shared['refStructures']
+      self.assertEqual(structures.shape, ndx.shape)
+      self.assertEqual(structures.labels.tolist(), [4, 7])
+      for label in (4, 7):
+        np.testing.assert_array_equal(structures.pixels(label), data['refStructures'].pixels(label))
+      self.assertFalse(structures.offsets.flags.writeable)
+      for block in attached: block.close()
+    finally:
+      for block in blocks:
+        block.close()
+        block.unlink()
+
+  # test configuration inherits INPUT.REF & missing sections from the reference
+  def test_reference_config(self):
+    for name in ('ref-DSM.tif', 'ref-DTM.tif', 'ref-CLS.tif', 'ref-NDX.tif', 'test-DSM.tif', 'test-CLS.tif'):
+      open(os.path.join(self.folder, name), 'w').close()
+
+    refconfig = os.path.join(self.folder, 'ref.config')
+    with open(refconfig, 'w') as fid:
+      fid.write('[INPUT.REF]\nDSMFilename = ref-DSM.tif\nDTMFilename = ref-DTM.tif\nCLSFilename = ref-CLS.tif\n'
+        'NDXFilename = ref-NDX.tif\nCLSMatchValue = [[6],[17]]\n\n[OPTIONS]\nQuantizeHeight = true\n\n'
+        '[PLOTS]\nShowPlots = false\nSavePlots = false\n\n[MATERIALS.REF]\nMaterialNames = a,b\nMaterialIndicesToIgnore = 0\n')
+    testconfig = os.path.join(self.folder, 'test.config')
+    with open(testconfig, 'w') as fid:
+      fid.write('[INPUT.TEST]\nDSMFilename = test-DSM.tif\nCLSFilename = test-CLS.tif\n')
+
+    reference = geo.parse_config(refconfig, refpath=self.folder, require_test=False)
+    self.assertNotIn('INPUT.TEST', reference)
+
+    config = geo.parse_config(testconfig, testpath=self.folder, reference=reference)
+    self.assertEqual(config['INPUT.REF'], reference['INPUT.REF'])
+    self.assertEqual(config['INPUT.TEST']['CLSMatchValue'], [[6],[17]])
+    self.assertTrue(config['OPTIONS']['QuantizeHeight'])
+    self.assertEqual(config['INPUT.TEST']['DSMFilename'], os.path.join(self.folder, 'test-DSM.tif'))
+
+
+if __name__ == '__main__':
+  unittest.main()
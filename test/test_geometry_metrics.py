@@ -83,6 +83,107 @@ class TestGeometryMetrics(unittest.TestCase):
     self.common_test(1.0,1.0,(1,1),metrics_expected)
 
 
+  # accumulating totals over tiles matches whole-image evaluation
+  def test_tiled_accumulation(self):
+    rng = np.random.RandomState(0)
+    sh = (37,53)
+    tform = [0,.5,0,0,0,-.5]
+    refDSM = rng.uniform(-2,10,sh).astype(np.float32)
+    testDSM = refDSM + rng.normal(0,1,sh).astype(np.float32)
+    DTM = rng.uniform(0,1,sh).astype(np.float32)
+    refMSK = rng.rand(*sh) < 0.5
+    testMSK = rng.rand(*sh) < 0.5
+    ignore = rng.rand(*sh) < 0.05
+
+    expected = geo.run_threshold_geometry_metrics(
+      refDSM, DTM, refMSK, testDSM, DTM, testMSK, tform, ignore,
+      plot=None,verbose=False)
+
+    totals = None
+    for xoff, yoff, xsz, ysz in geo.tileWindows(sh[1], sh[0], 16):
+      tile = np.s_[yoff:yoff+ysz, xoff:xoff+xsz]
+      totals = geo.accumulate_threshold_geometry(refDSM[tile], DTM[tile], refMSK[tile],
+        testDSM[tile], DTM[tile], testMSK[tile], ignore[tile], totals)
+    metrics = geo.finalize_threshold_geometry(totals, tform, verbose=False)
+
+    for section in ('2D','3D'):
+      for key in ('TP','FN','FP','precision','recall'):
+        self.assertAlmostEqual(metrics[section][key], expected[section][key], places=6)
+
+  # chunked & reduced precision accumulation matches the default
+  def test_chunked_accumulation(self):
+    rng = np.random.RandomState(1)
+    sh = (41,29)
+    refDSM = rng.uniform(-2,10,sh)
+    testDSM = refDSM + rng.normal(0,1,sh)
+    DTM = rng.uniform(0,1,sh)
+    refMSK = rng.rand(*sh) < 0.5
+    testMSK = rng.rand(*sh) < 0.5
+    ignore = rng.rand(*sh) < 0.05
+    args = (refDSM, DTM, refMSK, testDSM, DTM, testMSK, ignore)
+
+    expected = geo.accumulate_threshold_geometry(*args)
+    for kwargs in ({'chunkSize': 100}, {'chunkSize': 1}, {'dtype': np.float32}):
+      totals = geo.accumulate_threshold_geometry(*args, **kwargs)
+      for key in ('ref_area','test_area','tp_area','fn_area','fp_area'):
+        self.assertEqual(totals[key], expected[key], '{} differs for {}'.format(key, kwargs))
+      for key in ('ref_volume','test_volume','tp_volume','fn_volume','fp_volume'):
+        self.assertAlmostEqual(totals[key], expected[key], places=3,
+          msg='{} differs for {}'.format(key, kwargs))
+
+
+  # batched evaluation of several CLS match sets matches per-set evaluation
+  def test_batch_match_sets(self):
+    rng = np.random.RandomState(2)
+    sh = (33,47)
+    tform = [0,.5,0,0,0,-.5]
+    refDSM = rng.uniform(-2,10,sh)
+    testDSM = refDSM + rng.normal(0,1,sh)
+    DTM = rng.uniform(0,1,sh)
+    refCLS = rng.choice([0,2,6,17],sh).astype(np.uint8)
+    testCLS = rng.choice([0,2,6,17,65],sh).astype(np.float32)
+    ignore = rng.rand(*sh) < 0.05
+
+    refSets = [[6],[17],[6,17],[2,6,17]]
+    testSets = [[6],[17],[6,17],[2,6,17,65]]
+
+    results = geo.run_threshold_geometry_metrics_batch(refDSM, DTM, refCLS, testDSM, DTM, testCLS,
+      tform, ignore, refSets, testSets, verbose=False)
+
+    for refSet, testSet, metrics in zip(refSets, testSets, results):
+      expected = geo.run_threshold_geometry_metrics(refDSM, DTM, np.isin(refCLS,refSet),
+        testDSM, DTM, np.isin(testCLS,testSet), tform, ignore, plot=None, verbose=False)
+      for section in ('2D','3D'):
+        for key in ('TP','FN','FP'):
+          self.assertAlmostEqual(metrics[section][key], expected[section][key], places=6,
+            msg='{} {} differs for {}'.format(section, key, refSet))
+
+  # partials of blocks with different classes are merged over the union of classes
+  def test_class_partials_blocks(self):
+    rng = np.random.RandomState(3)
+    sh = (40,30)
+    refDSM = rng.uniform(-2,10,sh)
+    testDSM = refDSM + rng.normal(0,1,sh)
+    DTM = rng.uniform(0,1,sh)
+    refCLS = rng.choice([2,6],sh).astype(np.uint8)
+    testCLS = rng.choice([2,6],sh).astype(np.uint8)
+    refCLS[20:] = rng.choice([0,17],(20,30))
+    testCLS[:, 20:] = 65
+    ignore = rng.rand(*sh) < 0.05
+
+    expected = geo.accumulate_class_partials(refDSM, DTM, refCLS, testDSM, DTM, testCLS, ignore,
+      np.unique(refCLS), np.unique(testCLS))
+
+    partials = None
+    for xoff, yoff, xsz, ysz in geo.tileWindows(sh[1], sh[0], 16):
+      tile = np.s_[yoff:yoff+ysz, xoff:xoff+xsz]
+      partials = geo.accumulate_class_partials(refDSM[tile], DTM[tile], refCLS[tile], testDSM[tile],
+        DTM[tile], testCLS[tile], ignore[tile], np.unique(refCLS[tile]), np.unique(testCLS[tile]), partials)
+
+    np.testing.assert_array_equal(partials['refClasses'], [0,2,6,17])
+    np.testing.assert_array_equal(partials['testClasses'], [2,6,65])
+    for key in geo.CLASS_PARTIALS:
+      np.testing.assert_allclose(partials[key], expected[key], err_msg=key)
 
 
 if __name__ == '__main__':
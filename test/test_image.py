@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+
+import core3dmetrics.geometrics as geo
+
+try:
+  import gdal
+  HAVE_GDAL = hasattr(gdal, 'Warp')
+except ImportError:
+  HAVE_GDAL = False
+
+
+def writeGeotiff(filename, img, tform):
+  driver = gdal.GetDriverByName('GTiff')
+  dataset = driver.Create(filename, img.shape[1], img.shape[0], 1, gdal.GDT_Float32)
+  dataset.SetGeoTransform(tform)
+  dataset.GetRasterBand(1).WriteArray(img)
+  dataset = None
+
+
+@unittest.skipUnless(HAVE_GDAL, 'GDAL not available')
+class TestWarpContext(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    rng = np.random.RandomState(0)
+    self.tform = [500.0, 0.5, 0, 1000.0, 0, -0.5]
+    self.refFilename = os.path.join(self.folder, 'ref.tif')
+    self.testFilename = os.path.join(self.folder, 'test.tif')
+    writeGeotiff(self.refFilename, np.zeros((300, 400), np.float32), self.tform)
+    writeGeotiff(self.testFilename, rng.uniform(0, 50, (300, 400)).astype(np.float32), self.tform)
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  # each thread has its own dataset handle of a file
+  def test_thread_handles(self):
+    with geo.WarpContext(self.refFilename) as grid:
+      handles = {}
+      def open_handle(name):
+        handles[name] = grid.open(self.testFilename)
+      threads = [threading.Thread(target=open_handle, args=(k,)) for k in range(2)]
+      for thread in threads: thread.start()
+      for thread in threads: thread.join()
+      self.assertIsNot(handles[0], handles[1])
+      self.assertIs(grid.open(self.testFilename), grid.open(self.testFilename))
+
+  # one file loaded under several keys concurrently matches a sequential load
+  def test_concurrent_same_file(self):
+    offset = (0.3, -0.2, 0)
+    expected = geo.imageWarp(self.testFilename, self.refFilename, offset)
+
+    with geo.WarpContext(self.refFilename) as grid:
+      jobs = {key: (lambda: geo.imageWarp(self.testFilename, grid, offset)) for key in ('testDSM', 'testDTM')}
+      jobs['shifted'] = lambda: geo.imageWarp(self.testFilename, grid, offset)
+      jobs['direct'] = lambda: geo.imageWarp(self.testFilename, grid)
+      for _ in range(5):
+        results, _ = geo.loadConcurrent(jobs, workers=4, verbose=False)
+        for key in ('testDSM', 'testDTM', 'shifted'):
+          np.testing.assert_array_equal(results[key], expected)
+        np.testing.assert_array_equal(results['direct'], geo.imageLoad(self.testFilename)[0])
+
+  # loads into allocated (e.g. memory mapped) arrays, block by block, match full reads
+  def test_load_allocated(self):
+    offset = (0.3, -0.2, 0)
+    with geo.WarpContext(self.refFilename) as grid, geo.ScratchArrays(self.folder) as scratch:
+      for raster in (geo.WarpedRaster(self.testFilename, grid, offset), geo.WarpedRaster(self.testFilename, grid)):
+        img = raster.load(scratch.empty, blockRows=64)
+        self.assertIsInstance(img, np.memmap)
+        np.testing.assert_array_equal(img, raster.read())
+
+        img = raster.load(scratch.empty, np.uint16, blockRows=64)
+        self.assertEqual(img.dtype, np.uint16)
+        np.testing.assert_array_equal(img, raster.load(dtype=np.uint16))
+
+
+if __name__ == '__main__':
+  unittest.main()
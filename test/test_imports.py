@@ -0,0 +1,60 @@
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+# repository root, for importing the package in a fresh interpreter
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# heavy optional dependencies, loaded only when needed
+HEAVY_MODULES = ('gdal', 'osgeo', 'scipy', 'matplotlib', 'jsonschema', 'pkg_resources')
+
+# wall time budget (seconds) to import the package & access a light function
+IMPORT_BUDGET = 1.0
+
+
+# Run "code" in a fresh interpreter, returning the import time of the
+# package (with code) and the heavy modules loaded
+def importProfile(code):
+  script = ('import sys, time, json\n'
+    't = time.perf_counter()\n'
+    'import core3dmetrics.geometrics as geo\n'
+    + code + '\n'
+    'print(json.dumps([time.perf_counter() - t, sorted(m for m in {} if m in sys.modules)]))\n').format(HEAVY_MODULES)
+  env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, os.environ.get('PYTHONPATH', '')]))
+  output = subprocess.check_output([sys.executable, '-c', script], env=env, cwd=ROOT)
+  return json.loads(output.decode().splitlines()[-1])
+
+
+class TestImports(unittest.TestCase):
+
+  def test_light_import(self):
+    elapsed, loaded = importProfile('geo.calcMops, geo.getStructures, geo.PercentileSketch')
+    self.assertEqual(loaded, [])
+    self.assertLess(elapsed, IMPORT_BUDGET)
+
+  # configuration parsing needs only jsonschema
+  def test_config_import(self):
+    _, loaded = importProfile('geo.parse_config')
+    self.assertEqual(loaded, [])
+
+  # names are resolved from their submodules on first access
+  def test_lazy_names(self):
+    import core3dmetrics.geometrics as geo
+    from core3dmetrics.geometrics.metrics_util import calcMops
+    self.assertIs(geo.calcMops, calcMops)
+    self.assertIn('run_threshold_geometry_metrics', dir(geo))
+    with self.assertRaises(AttributeError):
+      geo.notAFunction
+
+  # importing the plot submodule directly does not hide the plot class
+  def test_plot_submodule(self):
+    _, loaded = importProfile('from core3dmetrics.geometrics.plot import renderFigure\n'
+      'assert isinstance(geo.plot(showPlots=False), geo.plot)\n'
+      'assert geo.renderFigure is renderFigure')
+    self.assertIn('matplotlib', loaded)
+
+
+if __name__ == '__main__':
+  unittest.main()
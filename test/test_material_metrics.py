@@ -0,0 +1,148 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from collections import defaultdict
+
+import core3dmetrics.geometrics as geo
+
+
+# per-pixel implementation of the material metrics, retained as the
+# reference for parity testing of the vectorized implementation
+def legacy_material_metrics(refNDX, refMTL, testMTL, materialNames, materialIndicesToIgnore):
+
+  def getMaterial(img, pixels):
+    indexCounts = defaultdict(int)
+    for x, y in pixels:
+      indexCounts[img[y][x]] += 1
+    maxMaterialCount = -1
+    maxMaterialCountIndex = -1
+    for k in indexCounts.keys():
+      if indexCounts[k] > maxMaterialCount and k not in materialIndicesToIgnore:
+        maxMaterialCount = indexCounts[k]
+        maxMaterialCountIndex = k
+    return maxMaterialCountIndex
+
+  structures = defaultdict(list)
+  for y in range(len(refNDX)):
+    for x in range(len(refNDX[y])):
+      if refNDX[y][x] > 0:
+        structures[refNDX[y][x]].append((x, y))
+  structures = {k: v for k, v in structures.items() if len(v) >= 10}
+
+  n = len(materialNames)
+  pixelConfMatrix = np.zeros((n, n), dtype=np.int32)
+  for y in range(len(refMTL)):
+    for x in range(len(refMTL[y])):
+      if refNDX[y][x] != 0 and refMTL[y][x] not in materialIndicesToIgnore:
+        pixelConfMatrix[refMTL[y][x]][testMTL[y][x]] += 1
+
+  structureConfMatrix = np.zeros((n, n), dtype=np.int32)
+  for pixels in structures.values():
+    truth = getMaterial(refMTL, pixels)
+    test = getMaterial(testMTL, pixels)
+    if truth not in materialIndicesToIgnore and truth != -1:
+      structureConfMatrix[truth][test] += 1
+
+  return {
+    'scored_structures': int(np.sum(structureConfMatrix)),
+    'fraction_structures_correct': np.trace(structureConfMatrix) / np.sum(structureConfMatrix),
+    'fraction_pixels_correct': np.trace(pixelConfMatrix) / np.sum(pixelConfMatrix),
+  }
+
+
+class TestMaterialMetrics(unittest.TestCase):
+
+  def setUp(self):
+    self.materialNames = ['Unclassified','Asphalt','Concrete','Glass','Tree','Metal','Unscored','Indeterminate']
+    self.materialIndicesToIgnore = [0,6,7]
+
+  # random structure footprints with noisy material labels
+  def random_inputs(self, seed, shape=(60,80), numStructures=40):
+    rng = np.random.RandomState(seed)
+
+    refNDX = np.zeros(shape, dtype=np.uint16)
+    for label in range(1, numStructures+1):
+      y, x = rng.randint(0, shape[0]-2), rng.randint(0, shape[1]-2)
+      h, w = rng.randint(1, 12, size=2)
+      refNDX[y:y+h, x:x+w] = label
+
+    n = len(self.materialNames)
+    refMTL = rng.randint(0, n, size=shape).astype(np.uint8)
+    testMTL = refMTL.copy()
+    noise = rng.rand(*shape) < 0.4
+    testMTL[noise] = rng.randint(0, n, size=np.count_nonzero(noise))
+
+    # structures without any valid material
+    refMTL[refNDX == 1] = self.materialIndicesToIgnore[0]
+    testMTL[refNDX == 2] = self.materialIndicesToIgnore[-1]
+    return refNDX, refMTL, testMTL
+
+  def test_parity(self):
+    for seed in range(5):
+      inputs = self.random_inputs(seed)
+      expected = legacy_material_metrics(*inputs, self.materialNames, self.materialIndicesToIgnore)
+      metrics = geo.run_material_metrics(*inputs, self.materialNames, self.materialIndicesToIgnore)
+      self.assertDictEqual(metrics, expected, 'seed {} metrics differ from per-pixel implementation'.format(seed))
+
+  # equal material counts are resolved in favor of the first material in raster order
+  def test_tie_break(self):
+    refNDX = np.zeros((4,6), dtype=np.uint16)
+    refNDX[:, :5] = 1
+    refMTL = np.full(refNDX.shape, 2, dtype=np.uint8)
+    testMTL = np.zeros(refNDX.shape, dtype=np.uint8)
+    testMTL[:2, :5] = 3
+    testMTL[2:, :5] = 2
+
+    structures = geo.getStructures(refNDX)
+    materials = geo.getStructureMaterials(testMTL, structures, self.materialIndicesToIgnore)
+    self.assertEqual(structures.labels.tolist(), [1])
+    self.assertEqual(materials.tolist(), [3])
+
+    inputs = (refNDX, refMTL, testMTL)
+    expected = legacy_material_metrics(*inputs, self.materialNames, self.materialIndicesToIgnore)
+    metrics = geo.run_material_metrics(*inputs, self.materialNames, self.materialIndicesToIgnore)
+    self.assertDictEqual(metrics, expected)
+
+
+class TestStructureIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.img = np.zeros((20,30), dtype=np.uint16)
+    self.img[2:6, 3:8] = 7      # 20 pixels
+    self.img[10:12, 0:3] = 2    # 6 pixels, below minimum size
+    self.img[15:19, 20:30] = 40 # 40 pixels
+    self.img[0, 29] = 7
+
+  def test_membership(self):
+    structures = geo.StructureIndex.fromImage(self.img)
+    self.assertEqual(structures.labels.tolist(), [7, 40])
+    self.assertEqual(structures.lengths.tolist(), [21, 40])
+    self.assertNotIn(2, structures)
+
+    for label in structures.labels:
+      expected = np.flatnonzero(self.img.ravel() == label)
+      np.testing.assert_array_equal(structures.pixels(label), expected)
+      rows, cols = structures.coordinates(label)
+      self.assertTrue(np.all(self.img[rows, cols] == label))
+
+    np.testing.assert_array_equal(structures.sample(self.img),
+      np.repeat(structures.labels, structures.lengths))
+
+    with self.assertRaises(KeyError):
+      structures.pixels(2)
+
+  def test_save_load(self):
+    structures = geo.StructureIndex.fromImage(self.img)
+    with tempfile.TemporaryDirectory() as folder:
+      filename = os.path.join(folder, 'structures.npz')
+      structures.save(filename)
+      loaded = geo.StructureIndex.load(filename)
+
+    self.assertEqual(loaded.shape, structures.shape)
+    for key in ('labels', 'starts', 'lengths', 'offsets'):
+      np.testing.assert_array_equal(getattr(loaded, key), getattr(structures, key))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,57 @@
+import os
+import time
+import tempfile
+import unittest
+
+import core3dmetrics.geometrics as geo
+
+
+class TestOffsetCache(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.TemporaryDirectory()
+    self.ref = self.write('ref.tif', b'reference' * 100)
+    self.test = self.write('test.tif', b'test' * 100)
+    self.cache = geo.OffsetCache(os.path.join(self.folder.name, 'cache', 'offsets.sqlite'), maxEntries=2)
+
+  def tearDown(self):
+    self.cache.close()
+    self.folder.cleanup()
+
+  def write(self, name, data):
+    filename = os.path.join(self.folder.name, name)
+    with open(filename, 'wb') as fid:
+      fid.write(data)
+    return filename
+
+  def test_roundtrip(self):
+    key = self.cache.key(self.ref, self.test, method='align3d', maxt=10.0)
+    self.assertIsNone(self.cache.get(key))
+    self.cache.put(key, (0.5, -1.25, 2.0))
+    self.assertEqual(self.cache.get(key), [0.5, -1.25, 2.0])
+
+  # key depends on file content and registration parameters
+  def test_key(self):
+    key = self.cache.key(self.ref, self.test, method='align3d', maxt=10.0)
+    self.assertEqual(key, self.cache.key(self.ref, self.test, method='align3d', maxt=10.0))
+    self.assertNotEqual(key, self.cache.key(self.ref, self.test, method='inprocess', maxt=10.0))
+    self.assertNotEqual(key, self.cache.key(self.ref, self.test, method='align3d', maxt=5.0))
+    self.assertNotEqual(key, self.cache.key(self.test, self.ref, method='align3d', maxt=10.0))
+
+    self.write('test.tif', b'TEST' * 100)
+    self.assertNotEqual(key, self.cache.key(self.ref, self.test, method='align3d', maxt=10.0))
+
+  # least recently used entries are evicted
+  def test_eviction(self):
+    for k in range(3):
+      self.cache.put('key{}'.format(k), (k, k, k))
+      time.sleep(0.01)
+    self.assertEqual(len(self.cache), 2)
+    self.assertIsNone(self.cache.get('key0'))
+
+    self.assertEqual(self.cache.evict(maxAge=0), 2)
+    self.assertEqual(len(self.cache), 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
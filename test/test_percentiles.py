@@ -0,0 +1,82 @@
+import unittest
+import numpy as np
+
+import core3dmetrics.geometrics as geo
+
+
+class TestPercentiles(unittest.TestCase):
+
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    self.values = np.concatenate([rng.normal(0, 2, 20000), rng.standard_cauchy(500), np.zeros(100)])
+    self.q = [0, 50, 63, 68, 90, 100]
+
+  def test_calc_percentiles(self):
+    np.testing.assert_allclose(geo.calcPercentiles(self.values, self.q), np.percentile(np.abs(self.values), self.q))
+
+  # sketch percentiles are within the relative accuracy, and merging matches a single sketch
+  def test_sketch(self):
+    exact = np.percentile(np.abs(self.values), self.q)
+
+    sketch = geo.PercentileSketch(relativeAccuracy=0.005).add(self.values)
+    np.testing.assert_allclose(sketch.percentiles(self.q), exact, rtol=0.005, atol=sketch.minValue)
+    self.assertEqual(len(sketch), self.values.size)
+
+    merged = geo.PercentileSketch(relativeAccuracy=0.005)
+    for chunk in np.array_split(self.values, 7):
+      merged.merge(geo.PercentileSketch(relativeAccuracy=0.005).add(chunk))
+    self.assertEqual(merged.percentiles(self.q), sketch.percentiles(self.q))
+
+    with self.assertRaises(ValueError):
+      merged.merge(geo.PercentileSketch(relativeAccuracy=0.01))
+
+
+class TestTiledTerrainAccuracy(unittest.TestCase):
+
+  # terrain accuracy accumulated over tiles matches the whole image metrics
+  # (percentiles within the sketch accuracy)
+  def test_tiles(self):
+    rng = np.random.RandomState(2)
+    refDTM = rng.uniform(-2, 20, (90, 70))
+    refDTM[:10, :10] = -1.0  # water
+    testDTM = refDTM + rng.normal(0, 1, refDTM.shape)
+    refMask = rng.rand(*refDTM.shape) > 0.8
+
+    expected = geo.run_terrain_accuracy_metrics(refDTM, testDTM, refMask, threshold=1)
+    totals = None
+    for xoff, yoff, xsize, ysize in geo.tileWindows(70, 90, 32):
+      tile = np.s_[yoff:yoff+ysize, xoff:xoff+xsize]
+      totals = geo.accumulate_terrain_accuracy(refDTM[tile], testDTM[tile], refMask[tile], 1, totals)
+    result = geo.finalize_terrain_accuracy(totals)
+
+    for key in ('z50', 'zrmse', 'z90'):
+      self.assertAlmostEqual(result[key], expected[key], delta=0.001 * expected[key], msg=key)
+    for key in ('completeness', 'completeness_water_removed'):
+      self.assertAlmostEqual(result[key], expected[key], places=12, msg=key)
+
+  # non-finite Z errors (e.g. NaN heights) are excluded from the percentiles of both
+  def test_nonfinite(self):
+    rng = np.random.RandomState(3)
+    refDTM = rng.uniform(-2, 20, (60, 50))
+    testDTM = refDTM + rng.normal(0, 1, refDTM.shape)
+    refMask = np.zeros(refDTM.shape, bool)
+    testDTM[rng.rand(*refDTM.shape) > 0.9] = np.nan
+    testDTM[:3, :3] = np.inf
+
+    delta = testDTM - refDTM
+    finite = np.abs(delta[np.isfinite(delta)])
+    expected = geo.run_terrain_accuracy_metrics(refDTM, testDTM, refMask, threshold=1)
+    self.assertEqual(expected['z50'], float(np.percentile(finite, 50)))
+
+    totals = None
+    for xoff, yoff, xsize, ysize in geo.tileWindows(50, 60, 32):
+      tile = np.s_[yoff:yoff+ysize, xoff:xoff+xsize]
+      totals = geo.accumulate_terrain_accuracy(refDTM[tile], testDTM[tile], refMask[tile], 1, totals)
+    self.assertEqual(totals['sketch'].count, finite.size)
+    result = geo.finalize_terrain_accuracy(totals)
+    for key in ('z50', 'zrmse', 'z90'):
+      self.assertAlmostEqual(result[key], expected[key], delta=0.001 * expected[key], msg=key)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+import core3dmetrics.geometrics as geo
+
+
+class TestPlot(unittest.TestCase):
+
+  # background rendering saves the same figures as synchronous rendering,
+  # from snapshots of the images at plot.make()
+  def test_background_render(self):
+    image = np.arange(400, dtype=np.float32).reshape(20, 20)
+    image[0, 0] = -9999
+
+    with tempfile.TemporaryDirectory() as folder:
+      files = {}
+      for workers in (0, 2):
+        plot = geo.plot(saveDir=folder, autoSave=True, showPlots=False, dpi=50,
+          savePrefix='w{}_'.format(workers), workers=workers)
+        self.assertEqual(plot.asynchronous, workers > 0)
+
+        buffer = image.copy()
+        plot.make(buffer, 'Image', 1, saveName='image', colorbar=True, badValue=-9999)
+        buffer[...] = 0
+        plot.make(buffer > 0, 'Mask', 2, saveName='mask')
+
+        timings = plot.flush(verbose=False)
+        self.assertEqual([name for name, _ in timings], ['w{}_image.png'.format(workers), 'w{}_mask.png'.format(workers)])
+        for name, seconds in timings:
+          self.assertGreater(seconds, 0)
+          with open(os.path.join(folder, name), 'rb') as fid:
+            files.setdefault(name[3:], []).append(fid.read())
+
+      for name, data in files.items():
+        self.assertEqual(data[0], data[1], name)
+
+  # closing without flushing (e.g. on failure) stops the background workers
+  def test_close(self):
+    with tempfile.TemporaryDirectory() as folder:
+      with geo.plot(saveDir=folder, autoSave=True, showPlots=False, dpi=50, workers=1) as plot:
+        for fig in range(4):
+          plot.make(np.ones((20, 20)), 'Image', fig, saveName='image{}'.format(fig))
+        executor = plot._executor
+      self.assertIsNone(plot._executor)
+      self.assertEqual(plot._pending, [])
+      with self.assertRaises(RuntimeError):
+        executor.submit(int)
+
+  # images larger than the figure are decimated before rendering
+  def test_decimation_factor(self):
+    plot = geo.plot(showPlots=False, dpi=10)
+    self.assertEqual(plot.decimationFactor((48, 64)), 1)
+    self.assertEqual(plot.decimationFactor((48, 640)), 10)
+    self.assertEqual(plot.decimationFactor((200, 64)), 4)
+
+
+if __name__ == '__main__':
+  unittest.main()
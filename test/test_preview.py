@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from matplotlib import cm, colors
+import matplotlib.image
+
+import core3dmetrics.geometrics as geo
+
+
+class TestPreview(unittest.TestCase):
+
+  def setUp(self):
+    self.image = np.random.RandomState(0).rand(40, 30).astype(np.float32) * 20 - 5
+    self.image[0, :4] = np.nan
+    self.image[1, :4] = -9999
+
+  # lookup table colors match matplotlib's colormapping
+  def test_colorize(self):
+    rgb = geo.colorize(self.image, badValue=-9999, badColor='black')
+    valid = np.isfinite(self.image) & (self.image != -9999)
+    norm = colors.Normalize(self.image[valid].min(), self.image[valid].max())
+    expected = np.round(cm.get_cmap('jet')(norm(self.image))[..., :3] * 255).astype(np.uint8)
+    np.testing.assert_array_equal(rgb[valid], expected[valid])
+    self.assertTrue(np.all(rgb[~valid] == 0))
+
+    listed = ['red', 'green', 'blue']
+    rgb = geo.colorize(self.image, vmin=0, vmax=10, cmap=listed)
+    expected = np.round(colors.ListedColormap(listed)(colors.Normalize(0, 10)(self.image))[..., :3] * 255)
+    np.testing.assert_array_equal(rgb[valid], expected[valid])
+
+  # PNG previews are readable, with world files & overview
+  def test_png(self):
+    with tempfile.TemporaryDirectory() as folder:
+      filename = os.path.join(folder, 'preview.png')
+      files = geo.writePreview(filename, self.image, transform=(100, 0.5, 0, 200, 0, -0.5),
+        badValue=-9999, overview=4)
+      self.assertEqual([os.path.basename(f) for f in files],
+        ['preview.png', 'preview.pgw', 'preview_overview.png', 'preview_overview.pgw'])
+
+      data = np.round(matplotlib.image.imread(filename) * 255).astype(np.uint8)
+      np.testing.assert_array_equal(data, geo.colorize(self.image, badValue=-9999))
+      self.assertEqual(matplotlib.image.imread(files[2]).shape, (10, 8, 3))
+
+      with open(files[1]) as fid:
+        values = [float(v) for v in fid.read().split()]
+      self.assertEqual(values, [0.5, 0, 0, -0.5, 100.25, 199.75])
+
+
+class TestDecimate(unittest.TestCase):
+
+  # reference: reduce each (partial) block of valid pixels in a loop
+  def blockReduce(self, image, factor, func, badValue=None, missing=np.nan):
+    rows, cols = -(-image.shape[0] // factor), -(-image.shape[1] // factor)
+    out = np.full((rows, cols), missing, np.float64)
+    for i in range(rows):
+      for j in range(cols):
+        block = image[i*factor:(i+1)*factor, j*factor:(j+1)*factor].ravel()
+        if block.dtype.kind == 'f':
+          block = block[np.isfinite(block)]
+        if badValue is not None:
+          block = block[block != badValue]
+        if block.size:
+          out[i, j] = func(block)
+    return out
+
+  def test_mean_max(self):
+    image = np.random.RandomState(0).rand(23, 17).astype(np.float32)
+    image[0, 0] = np.nan
+    image[4:12, 4:12] = -9999
+
+    result = geo.decimateImage(image, 4, badValue=-9999)
+    self.assertEqual(result.dtype, np.float32)
+    np.testing.assert_allclose(result, self.blockReduce(image, 4, np.mean, -9999), rtol=1e-6)
+    self.assertTrue(np.isnan(result[2, 2]))
+    np.testing.assert_array_equal(geo.decimateImage(image, 4, 'max', -9999),
+      self.blockReduce(image, 4, np.max, -9999).astype(np.float32))
+
+  # boolean masks keep any set pixel
+  def test_mask(self):
+    mask = np.random.RandomState(1).rand(23, 17) > 0.97
+    np.testing.assert_array_equal(geo.decimateImage(mask, 4), self.blockReduce(mask, 4, np.max) > 0)
+
+  # most frequent value, ties to the smallest value
+  def test_mode(self):
+    def mode(block):
+      values, counts = np.unique(block, return_counts=True)
+      return values[np.argmax(counts)]
+
+    rs = np.random.RandomState(2)
+    for high in (4, 5000):
+      labels = rs.randint(0, high, (23, 17)).astype(np.uint16)
+      labels[:4, :4] = 7
+      np.testing.assert_array_equal(geo.decimateImage(labels, 4, badValue=7),
+        self.blockReduce(labels, 4, mode, 7, missing=7))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,77 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import tracemalloc
+import numpy as np
+
+import core3dmetrics.geometrics as geo
+
+
+class TestStageProfiler(unittest.TestCase):
+
+  # nested & labeled stages, in start order, with memory peaks
+  def test_stages(self):
+    profiler = geo.StageProfiler()
+    try:
+      with profiler.stage('outer'):
+        for index in range(2):
+          profiler.start('inner', CLSSet=index)
+          data = np.ones((1000, 1000 * (index + 1)))
+          del data
+          profiler.stop()
+      report = profiler.report()
+    finally:
+      profiler.close()
+
+    json.dumps(report)
+    stages = report['stages']
+    self.assertEqual([(s['stage'], s['depth'], s.get('CLSSet')) for s in stages],
+      [('outer', 0, None), ('inner', 1, 0), ('inner', 1, 1)])
+    self.assertGreaterEqual(stages[1]['peak_traced'], 8e6)
+    self.assertGreaterEqual(stages[2]['peak_traced'], 16e6)
+    self.assertLess(stages[1]['peak_traced'], 16e6)
+    self.assertGreaterEqual(stages[0]['peak_traced'], stages[2]['peak_traced'])
+    self.assertGreaterEqual(stages[0]['wall'], stages[1]['wall'] + stages[2]['wall'])
+    self.assertGreaterEqual(report['total']['peak_rss'], stages[0]['peak_rss'])
+
+  # before Python 3.9 (no tracemalloc.reset_peak), the peak is reset by restarting tracing
+  def test_without_reset_peak(self):
+    from core3dmetrics.geometrics import profiling
+    legacy = unittest.mock.Mock(spec=['start', 'stop', 'is_tracing', 'get_traced_memory'], wraps=tracemalloc)
+    with unittest.mock.patch.object(profiling, 'tracemalloc', legacy):
+      with geo.StageProfiler() as profiler:
+        for index in range(2):
+          with profiler.stage('stage'):
+            data = np.ones((1000, 1000 * (2 - index)))
+            del data
+    self.assertFalse(tracemalloc.is_tracing())
+    self.assertGreaterEqual(profiler.stages[0]['peak_traced'], 16e6)
+    self.assertLess(profiler.stages[1]['peak_traced'], 16e6)
+
+  def test_disabled(self):
+    profiler = geo.StageProfiler(enabled=False)
+    with profiler.stage('stage'):
+      pass
+    self.assertEqual(profiler.stages, [])
+    self.assertIsNone(profiler.report())
+
+  # a failed evaluation stops memory tracing (e.g. for later evaluations in a batch worker)
+  def test_failed_evaluation(self):
+    from core3dmetrics.run_geometrics import run_geometrics
+    folder = tempfile.mkdtemp()
+    try:
+      configfile = os.path.join(folder, 'missing-files.json')
+      with open(configfile, 'w') as fid:
+        json.dump({'INPUT.REF': {'DSMFilename': 'missing.tif'}}, fid)
+      with self.assertRaises(Exception):
+        run_geometrics(configfile, profile=True)
+      self.assertFalse(tracemalloc.is_tracing())
+    finally:
+      shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+  unittest.main()
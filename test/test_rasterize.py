@@ -0,0 +1,78 @@
+import tempfile
+import unittest
+import numpy as np
+
+import core3dmetrics.geometrics as geo
+
+
+class TestPointRasterizer(unittest.TestCase):
+
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    self.tform = [100.0, 0.5, 0, 200.0, 0, -0.5]
+    self.shape = (40, 50)
+    self.NODATA = -9999
+
+    # points spanning (and extending beyond) the raster
+    n = 20000
+    self.x = rng.uniform(98, 128, n)
+    self.y = rng.uniform(178, 202, n)
+    self.z = rng.uniform(0, 30, n)
+
+  # per-point reference implementation
+  def reference(self, reduction):
+    col = np.round((self.x - self.tform[0]) / self.tform[1]).astype(int)
+    row = np.round((self.y - self.tform[3]) / self.tform[5]).astype(int)
+    values = {}
+    for r, c, z in zip(row, col, self.z):
+      if 0 <= r < self.shape[0] and 0 <= c < self.shape[1]:
+        values.setdefault((r, c), []).append(z)
+
+    raster = np.full(self.shape, 0 if reduction == 'count' else self.NODATA, np.float32)
+    func = {'min': np.min, 'mean': np.mean, 'max': np.max, 'count': len}[reduction]
+    for (r, c), z in values.items():
+      raster[r, c] = func(z)
+    return raster
+
+  # chunked reductions match the per-point reference
+  def test_reductions(self):
+    for reduction in geo.PointRasterizer.REDUCTIONS:
+      rasterizer = geo.PointRasterizer(self.tform, self.shape, reduction)
+      for start in range(0, self.x.size, 3000):
+        chunk = slice(start, start + 3000)
+        rasterizer.add(self.x[chunk], self.y[chunk], self.z[chunk])
+      raster = rasterizer.result(self.NODATA)
+      np.testing.assert_allclose(raster, self.reference(reduction), rtol=1e-5, err_msg=reduction)
+
+  # the result may be written to a given (e.g. memory mapped) array
+  def test_result_out(self):
+    for reduction in geo.PointRasterizer.REDUCTIONS:
+      rasterizer = geo.PointRasterizer(self.tform, self.shape, reduction)
+      rasterizer.add(self.x, self.y, self.z)
+      with geo.ScratchArrays(tempfile.gettempdir()) as scratch:
+        out = scratch.empty(self.shape, np.float32)
+        self.assertIs(rasterizer.result(self.NODATA, out), out)
+        np.testing.assert_array_equal(out, rasterizer.result(self.NODATA), err_msg=reduction)
+
+  def test_invalid_reduction(self):
+    with self.assertRaises(ValueError):
+      geo.PointRasterizer(self.tform, self.shape, 'median')
+
+
+class TestFillHoles(unittest.TestCase):
+
+  # holes take the value of the nearest non-hole pixel
+  def test_nearest(self):
+    img = np.array([[1, 0, 0, 0, 0, 5],
+                    [1, 0, 0, 0, 0, 5]], np.float32)
+    geo.fillHoles(img, img == 0)
+    np.testing.assert_array_equal(img, [[1, 1, 1, 5, 5, 5], [1, 1, 1, 5, 5, 5]])
+
+    # all holes are left unchanged
+    img = np.zeros((3,3), np.float32)
+    geo.fillHoles(img, img == 0)
+    self.assertTrue(np.all(img == 0))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import core3dmetrics.geometrics as geo
+
+
+class TestReferenceCache(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.source = os.path.join(self.folder, 'ref-DSM.tif')
+    with open(self.source, 'wb') as fid:
+      fid.write(b'reference')
+    self.sources = {'DSMFilename': self.source}
+
+    ndx = np.zeros((20,30), np.uint16)
+    ndx[2:8, 3:9] = 4
+    self.data = {'refNDX': ndx, 'refDSM': np.random.RandomState(0).rand(20,30).astype(np.float32),
+      'tform': [0, .5, 0, 0, 0, -.5], 'refCLS_NoDataValue': None, 'refStructures': geo.getStructures(ndx)}
+    self.cache = geo.ReferenceCache(os.path.join(self.folder, 'cache'))
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+  # products round trip as read-only memory maps
+  def test_round_trip(self):
+    self.assertIsNone(self.cache.load(self.sources))
+    self.cache.save(self.data, self.sources, {'noDataValue': -9999})
+
+    data = self.cache.load(self.sources, {'noDataValue': -9999})
+    self.assertIsInstance(data['refDSM'], np.memmap)
+    self.assertFalse(data['refDSM'].flags.writeable)
+    np.testing.assert_array_equal(data['refNDX'], self.data['refNDX'])
+    self.assertEqual(data['tform'], self.data['tform'])
+    self.assertIsNone(data['refCLS_NoDataValue'])
+    self.assertEqual(data['refStructures'].labels.tolist(), [4])
+    np.testing.assert_array_equal(data['refStructures'].pixels(4), self.data['refStructures'].pixels(4))
+
+  # changed sources or parameters invalidate the cache
+  def test_invalidation(self):
+    self.cache.save(self.data, self.sources, {'noDataValue': -9999})
+    self.assertIsNone(self.cache.load(self.sources, {'noDataValue': 0}))
+
+    with open(self.source, 'wb') as fid:
+      fid.write(b'updated reference')
+    self.assertIsNone(self.cache.load(self.sources, {'noDataValue': -9999}))
+
+    self.cache.clear()
+    self.assertFalse(os.path.exists(self.cache.manifestFilename))
+
+
+if __name__ == '__main__':
+  unittest.main()
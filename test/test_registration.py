@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+from scipy import ndimage
+
+import core3dmetrics.geometrics as geo
+
+
+class TestRegistration(unittest.TestCase):
+
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    self.tform = [0,.5,0,0,0,-.5]
+
+    # terrain with rectangular buildings
+    dsm = ndimage.gaussian_filter(rng.normal(0,1,(300,320)), 20) * 50
+    for _ in range(60):
+      y, x = rng.randint(0,280), rng.randint(0,300)
+      h, w = rng.randint(8,20,size=2)
+      dsm[y:y+h, x:x+w] += rng.uniform(3,20)
+    self.refDSM = dsm.astype(np.float32)
+
+  # recover integer & sub-pixel displacements
+  def test_estimate_offset(self):
+    for drow, dcol, dz in ((4,-6,1.5), (-2.5,3.5,-0.75)):
+      testDSM = ndimage.shift(self.refDSM, (-drow,-dcol), order=1, mode='nearest') - dz
+      offset = geo.estimateXYZoffset(self.refDSM, testDSM, self.tform, maxt=5.0)
+
+      expected = [dcol*self.tform[1], drow*self.tform[5], dz]
+      for value, truth in zip(offset, expected):
+        self.assertAlmostEqual(value, truth, delta=0.1)
+
+  # invalid (NaN) pixels are excluded
+  def test_invalid_pixels(self):
+    testDSM = ndimage.shift(self.refDSM, (-3,2), order=0, mode='nearest') + 1.0
+    testDSM[:40] = np.nan
+    offset = geo.estimateXYZoffset(self.refDSM, testDSM, self.tform, maxt=5.0)
+    for value, truth in zip(offset, [-1.0, -1.5, -1.0]):
+      self.assertAlmostEqual(value, truth, delta=0.05)
+
+  # mostly no data: a small valid area is registered, and without any valid
+  # overlap (at every level) the offset is zero
+  def test_mostly_nodata(self):
+    testDSM = ndimage.shift(self.refDSM, (-3,2), order=0, mode='nearest') + 1.0
+    refDSM = np.full_like(self.refDSM, np.nan)
+    refDSM[100:160, 120:180] = self.refDSM[100:160, 120:180]
+    offset = geo.estimateXYZoffset(refDSM, testDSM, self.tform, maxt=5.0)
+    for value, truth in zip(offset, [-1.0, -1.5, -1.0]):
+      self.assertAlmostEqual(value, truth, delta=0.05)
+
+    testDSM[:, :200] = np.nan
+    refDSM[:, 150:] = np.nan
+    offset = geo.estimateXYZoffset(refDSM, testDSM, self.tform, maxt=5.0)
+    self.assertEqual(offset, [0.0, 0.0, 0.0])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+from scipy import ndimage
+from scipy.signal import convolve2d
+
+import core3dmetrics.geometrics as geo
+from core3dmetrics.geometrics.relative_accuracy_metrics import erode3x3, edgeMask
+
+
+class TestEdgeExtraction(unittest.TestCase):
+
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    self.masks = [
+      ndimage.gaussian_filter(rng.normal(0,1,(97,131)), 3) > 0,
+      rng.rand(64,64) > 0.3,
+      np.ones((20,30), bool),
+    ]
+    self.validMask = rng.rand(97,131) > 0.01
+
+  # edges match the symmetric-boundary convolution formulation
+  def test_convolution_parity(self):
+    kernel = np.ones((3,3), int)
+    for mask in self.masks:
+      expected = convolve2d(mask.astype(int), kernel, mode="same", boundary="symm") == 9
+      np.testing.assert_array_equal(erode3x3(mask), expected)
+
+    mask = self.masks[0]
+    valid = convolve2d(self.validMask.astype(int), kernel, mode="same", boundary="symm") == 9
+    expected = (convolve2d(mask.astype(int), kernel, mode="same", boundary="symm") < 9) & mask & valid
+    np.testing.assert_array_equal(edgeMask(mask, erode3x3(self.validMask)), expected)
+
+
+class TestHorizontalAccuracy(unittest.TestCase):
+
+  # distance transform and KD tree methods report identical metrics
+  def test_methods(self):
+    rng = np.random.RandomState(1)
+    refDSM = rng.uniform(0, 10, (120,140))
+    refMask = ndimage.gaussian_filter(rng.normal(0,1,refDSM.shape), 4) > 0.1
+    testMask = np.roll(refMask, (2,-1), axis=(0,1)) ^ (rng.rand(*refDSM.shape) > 0.97)
+    testDSM = refDSM + rng.normal(0, 0.5, refDSM.shape)
+    ignoreMask = np.zeros(refDSM.shape, bool)
+    ignoreMask[:5] = True
+
+    results = [geo.run_relative_accuracy_metrics(refDSM, testDSM, refMask, testMask, ignoreMask, 0.5, method=method)
+      for method in geo.HORIZONTAL_ACCURACY_METHODS]
+    for key in ('h50', 'hrmse', 'h90', 'z50'):
+      self.assertAlmostEqual(results[0][key], results[1][key], places=9, msg=key)
+
+  # a test model without objects is infinitely far from the reference edges
+  def test_empty_test_edges(self):
+    refEdge = np.zeros((20,30), bool)
+    refEdge[5:8, 10:12] = True
+    testEdge = np.zeros(refEdge.shape, bool)
+    for method in geo.HORIZONTAL_ACCURACY_METHODS:
+      for nearest in (False, True):
+        dist, nearestPts = geo.nearestEdgeDistance(refEdge, testEdge, method, nearest)
+        np.testing.assert_array_equal(dist, np.full(6, np.inf))
+        if nearest:
+          np.testing.assert_array_equal(nearestPts, refEdge.nonzero())
+
+    refMask = np.zeros(refEdge.shape, bool)
+    refMask[4:12, 6:20] = True
+    refDSM = np.zeros(refEdge.shape)
+    testMask = np.ones(refEdge.shape, bool)  # one object covering the image: no perimeter
+    results = [geo.run_relative_accuracy_metrics(refDSM, refDSM, refMask, testMask, testEdge, 0.5, method=method)
+      for method in geo.HORIZONTAL_ACCURACY_METHODS]
+    for result in results:
+      for key in ('h50', 'hrmse', 'h90'):
+        self.assertFalse(np.isfinite(result[key]), msg=key)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+import core3dmetrics.geometrics as geo
+
+
+class TestScratchArrays(unittest.TestCase):
+
+  # arrays are memory mapped files in a private folder, removed on close
+  def test_memmap(self):
+    with tempfile.TemporaryDirectory() as folder:
+      with geo.ScratchArrays(folder) as scratch:
+        self.assertTrue(scratch.enabled)
+        self.assertEqual(os.path.dirname(scratch.folder), folder)
+
+        zeros = scratch.zeros((30, 40), np.float32)
+        self.assertIsInstance(zeros, np.memmap)
+        self.assertFalse(np.any(zeros))
+
+        data = np.random.RandomState(0).rand(30, 40)
+        stored = scratch.store(data)
+        self.assertIsInstance(stored, np.memmap)
+        np.testing.assert_array_equal(stored, data)
+        self.assertEqual(len(os.listdir(scratch.folder)), 2)
+
+      self.assertFalse(os.path.exists(scratch.folder))
+      self.assertEqual(os.listdir(folder), [])
+
+  # without a folder, arrays are in memory
+  def test_disabled(self):
+    scratch = geo.ScratchArrays()
+    self.assertFalse(scratch.enabled)
+    self.assertNotIsInstance(scratch.zeros(10, bool), np.memmap)
+    data = np.arange(5)
+    self.assertIs(scratch.store(data), data)
+    scratch.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
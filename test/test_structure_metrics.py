@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+
+import core3dmetrics.geometrics as geo
+
+
+class TestStructureMetrics(unittest.TestCase):
+
+  def setUp(self):
+    rng = np.random.RandomState(0)
+    shape = (80, 90)
+    self.tform = [0, .5, 0, 0, 0, -.5]
+
+    # reference buildings (NDX labels 1..n) & shifted/resized test buildings
+    self.refNDX = np.zeros(shape, np.uint16)
+    self.refDTM = rng.uniform(0, 1, shape)
+    self.refDSM = self.refDTM.copy()
+    self.testDSM = self.refDTM.copy()
+    for label, (y, x, h, w) in enumerate([(5,5,10,12), (30,40,15,8), (60,10,12,20), (50,70,8,8)], 1):
+      self.refNDX[y:y+h, x:x+w] = label
+      self.refDSM[y:y+h, x:x+w] += 5 * label
+      self.testDSM[y+1:y+h+2, x-1:x+w-1] += 5 * label + 0.5
+
+    # unmatched test object
+    self.testDSM[70:75, 70:80] += 3
+
+    self.refMask = self.refNDX > 0
+    self.testMask = (self.testDSM - self.refDTM) > 1
+    self.ignoreMask = np.zeros(shape, bool)
+    self.ignoreMask[:2] = True
+
+  # per-structure areas & volumes sum to the scene-wide totals
+  def test_totals(self):
+    table = geo.run_structure_metrics(self.refNDX, self.refDSM, self.refDTM, self.refMask,
+      self.testDSM, self.refDTM, self.testMask, self.tform, self.ignoreMask)
+    totals = geo.accumulate_threshold_geometry(self.refDSM, self.refDTM, self.refMask,
+      self.testDSM, self.refDTM, self.testMask, self.ignoreMask)
+
+    self.assertEqual(list(table), list(geo.STRUCTURE_COLUMNS))
+    self.assertEqual(table['index'].tolist(), [0, 1, 2, 3, 4])
+    unitArea = geo.getUnitArea(self.tform)
+    for key in ('ref', 'test', 'tp', 'fn', 'fp'):
+      self.assertEqual(table[key + '_area'].sum(), totals[key + '_area'])
+      self.assertAlmostEqual(table[key + '_volume'].sum(), totals[key + '_volume'] * unitArea)
+
+    # unmatched test object is attributed to index 0
+    self.assertEqual(table['ref_area'][0], 0)
+    self.assertEqual(table['fp_area'][0], 50)
+
+  # grouped percentiles match np.percentile
+  def test_group_percentiles(self):
+    rng = np.random.RandomState(1)
+    labels = rng.randint(0, 6, 500)
+    labels[labels == 3] = 2
+    values = rng.normal(0, 1, 500)
+    result = geo.groupPercentiles(labels, values, [0, 50, 63, 90, 100], 6)
+
+    for label in range(6):
+      if label == 3:
+        self.assertTrue(np.all(np.isnan(result[label])))
+      else:
+        np.testing.assert_allclose(result[label], np.percentile(values[labels == label], [0, 50, 63, 90, 100]))
+
+
+if __name__ == '__main__':
+  unittest.main()